@@ -1,4 +1,8 @@
+import copy
+import time
+import concurrent.futures
 import numpy
+import scipy.linalg
 import scipy.sparse
 import scipy.stats
 import scipy.optimize
@@ -6,6 +10,26 @@ import model
 import osqp
 
 
+#: The fields of `MPC.telemetry`. Times are in seconds and
+#: `status` is the OSQP status value, which is 1 for solved problems.
+#: Fast path steps have no solve, update time or residuals.
+#: `fallback` is 'iterate' or 'plan' when a step ran out of time, see `MPC`,
+#: and 'cold' when a warm started solve failed and was solved again from a cold start
+TELEMETRY_DTYPE = numpy.dtype([
+    ('step_time', 'f8'),
+    ('solve_time', 'f8'),
+    ('update_time', 'f8'),
+    ('iterations', 'i4'),
+    ('prim_res', 'f8'),
+    ('dual_res', 'f8'),
+    ('status', 'i4'),
+    ('warm_started', '?'),
+    ('fast_path', '?'),
+    ('deadline_met', '?'),
+    ('fallback', 'U7')
+])
+
+
 class MPC:
     r"""A deterministic reformulation of a linear chance constrained MPC
         that uses a discrete linear state space model of the system.
@@ -48,6 +72,51 @@ class MPC:
         lin_model : model.LinearModel
             Internal model for the controller
 
+        ysp : ndarray
+            The set point in deviation form
+
+        y_bounds, u_bounds, u_step_bounds : list, optional
+            A list of (min, max) pairs for each output, input and input step
+
+        warm_start : bool, optional
+            If `True` then each solve is started from the previous solution
+            shifted forward by one control interval.
+            A jump in the state or measurement can make OSQP wrongly report
+            such a solve as infeasible, so a failed warm started solve
+            is solved again from a cold start
+
+        formulation : {'auto', 'sparse', 'condensed'}, optional
+            'sparse' keeps the states and outputs as decision variables
+            with the dynamics as equality constraints.
+            'condensed' eliminates them with prediction matrices so that only
+            the input moves remain.
+            'auto' picks the formulation with the fewest estimated
+            nonzeros in the factorised KKT matrix
+
+        move_blocking : {None, 'geometric', list}, optional
+            Holds the inputs constant over blocks of time steps, so that
+            input moves are only made at the start of each block.
+            A list gives the length of each block, where the last block
+            is extended to the end of the control horizon
+            and blocks past the control horizon are ignored.
+            'geometric' uses blocks of length 1, 2, 4, ...
+            If `None` then a move can be made at every time step
+
+        fast_path : bool, optional
+            If `True` then the unconstrained optimal input moves are calculated
+            with a precomputed linear feedback and the QP is only solved
+            when they would violate a bound.
+            Precomputing the feedback needs the dense (P*No x N_moves) prediction matrix,
+            which is expensive for long horizons, so it is off by default
+
+        time_budget : float, optional
+            A wall-clock budget for each step in seconds.
+            The time left after updating the QP is passed to OSQP as a time limit,
+            along with an iteration limit estimated from previous solves.
+            If the solver runs out of time then the last iterate is used if it is
+            feasible, otherwise the previous plan is shifted forward and used.
+            If `None` then solves are not limited
+
         Attributes
         -----------
         P, M : int
@@ -59,22 +128,43 @@ class MPC:
 
         lin_model : model.LinearModel
             Internal model for the controller
+
+        formulation : {'sparse', 'condensed'}
+            The formulation of the QP
+
+        telemetry : numpy.array
+            A structured array with a record for each step, see `TELEMETRY_DTYPE`
+
+        iterations : numpy.array
+            The number of OSQP iterations of each step.
+            Steps that take the fast path have zero iterations
+
+        fast_path_hits : int
+            The number of steps that took the fast path
+
+        setup_time : float
+            The wall-clock time taken to set up the QP and solver
+
+        deadline_met : bool
+            If the last step solved the QP within the time budget
     """
     def __init__(self, P, M, Q, R, lin_model, ysp,
-                 y_bounds=None, u_bounds=None, u_step_bounds=None):
+                 y_bounds=None, u_bounds=None, u_step_bounds=None, warm_start=True,
+                 formulation='auto', move_blocking=None, fast_path=False, time_budget=None):
+        setup_start = time.perf_counter()
         self.P = P
         self.M = M
         self.Q = Q
         self.R = R
         self.model = lin_model
         self.ysp = ysp
+        self.warm_start = warm_start
+        self.time_budget = time_budget
+        self.deadline_met = True
 
         Nx, Ni = self.model.B.shape
         No, _ = self.model.C.shape
 
-        x0 = numpy.zeros(Nx)
-        um1 = numpy.zeros(Ni)
-
         # Limit constraints
         if y_bounds is None:
             y_min = numpy.full(No, -numpy.inf)
@@ -94,156 +184,550 @@ class MPC:
         else:
             u_step_min, u_step_max = [numpy.array(u) for u in zip(*u_step_bounds)]
 
-        self.H = scipy.sparse.block_diag([
-            scipy.sparse.csc_matrix(((P + 1) * Nx, (P + 1) * Nx)),
-            scipy.sparse.kron(scipy.sparse.eye(P), self.Q),
-            scipy.sparse.csc_matrix((Ni, Ni)),
-            scipy.sparse.kron(scipy.sparse.eye(M + 1), self.R)
-        ], format='csc')
+        self._block_starts = self._move_blocks(move_blocking)
+        self._T = numpy.kron(numpy.eye(M + 1)[:, self._block_starts], numpy.eye(Ni))
+
+        if formulation == 'auto':
+            formulation = self._auto_formulation(numpy.all(numpy.isinf([y_min, y_max])))
+        self.formulation = formulation
+
+        self._bounds = y_min, y_max, u_min, u_max, u_step_min, u_step_max
+        if self.formulation == 'sparse':
+            self._setup_sparse(*self._bounds)
+        elif self.formulation == 'condensed':
+            self._setup_condensed(*self._bounds)
+        else:
+            raise ValueError(f'Unknown formulation {formulation}')
+
+        self._use_fast_path = fast_path
+        self._fast_path_gains = self._unconstrained_gains() if fast_path else None
+
+        self.y_predicted = None
+        self._previous_solution = None
+        self._log = numpy.zeros(1024, dtype=TELEMETRY_DTYPE)
+        self._log_length = 0
+        self.setup_time = time.perf_counter() - setup_start
+
+    @property
+    def telemetry(self):
+        """The records of the steps taken so far"""
+        return self._log[:self._log_length]
+
+    @property
+    def iterations(self):
+        """The number of OSQP iterations of each step"""
+        return self.telemetry['iterations']
+
+    @property
+    def fast_path_hits(self):
+        """The number of steps that took the fast path"""
+        return int(numpy.sum(self.telemetry['fast_path']))
+
+    def _record(self, **fields):
+        """Adds a step's record to the telemetry, doubling the log when it is full"""
+        if self._log_length == self._log.size:
+            self._log = numpy.concatenate([self._log, numpy.zeros_like(self._log)])
+        record = self._log[self._log_length]
+        for name, value in fields.items():
+            record[name] = value
+        self._log_length += 1
+
+    def telemetry_summary(self):
+        """Returns summary statistics of the telemetry
+
+        Returns
+        -------
+        summary : dict
+            The number of steps, the fractions of steps that were solved,
+            took the fast path and were warm started,
+            the mean and maximum iterations and residuals
+            and the mean, median, 95th and 99th percentile and maximum step and solve times
+        """
+        log = self.telemetry
+        summary = {'steps': log.size}
+        if log.size == 0:
+            return summary
+
+        summary['solved_fraction'] = numpy.mean(log['status'] == 1)
+        summary['fast_path_fraction'] = numpy.mean(log['fast_path'])
+        summary['warm_start_fraction'] = numpy.mean(log['warm_started'])
+        for name in ['iterations', 'prim_res', 'dual_res']:
+            summary[f'{name}_mean'] = numpy.mean(log[name])
+            summary[f'{name}_max'] = numpy.max(log[name])
+        for name in ['step_time', 'solve_time']:
+            summary[f'{name}_mean'] = numpy.mean(log[name])
+            for q in [50, 95, 99]:
+                summary[f'{name}_p{q}'] = numpy.percentile(log[name], q)
+            summary[f'{name}_max'] = numpy.max(log[name])
+        return summary
+
+    @property
+    def fast_path_hit_rate(self):
+        """The fraction of steps that took the fast path"""
+        return self.fast_path_hits / max(len(self.iterations), 1)
+
+    def clone(self):
+        """Returns a controller with the same problem and a fresh state
+        that shares this controller's set-up OSQP workspace.
+        Every step sets all the problem data that changes and cold solves
+        start from zero, so clones may be used in turn, but not concurrently.
+        A shared workspace is owned by neither controller,
+        so `update_model` sets up a new one instead of changing it
+
+        Returns
+        -------
+        K : MPC
+            The clone
+        """
+        K = copy.copy(self)
+        K.l_matrix = self.l_matrix.copy()
+        K.u_matrix = self.u_matrix.copy()
+        K.q = self.q.copy()
+        K.y_predicted = None
+        K._previous_solution = None
+        K._log = numpy.zeros_like(self._log)
+        K._log_length = 0
+        K.deadline_met = True
+        self._owns_workspace = K._owns_workspace = False
+        return K
+
+    def update_model(self, lin_model):
+        """Replaces the internal model, for example with one from a
+        `model.LinearModelBank` when the operating point moves.
+        The set point and the output and input bounds are shifted to the new
+        linearisation point, so that they are unchanged in un-deviated form.
+        The QP is assembled again, but the OSQP workspace is updated in place
+        when its sparsity pattern is unchanged and it is not shared with clones,
+        otherwise the controller sets up a workspace of its own.
+        The output bias carries over, while the next solve is started cold
+
+        Parameters
+        ----------
+        lin_model : model.LinearModel
+            The new internal model, with the same sampling interval and dimensions
+        """
+        setup_start = time.perf_counter()
+        if lin_model.A.shape != self.model.A.shape or lin_model.B.shape != self.model.B.shape \
+                or lin_model.C.shape != self.model.C.shape:
+            raise ValueError('The new model must have the same dimensions')
+
+        dy = numpy.asarray(self.model.y_bar) - numpy.asarray(lin_model.y_bar)
+        du = numpy.asarray(self.model.u_bar) - numpy.asarray(lin_model.u_bar)
+        y_min, y_max, u_min, u_max, u_step_min, u_step_max = self._bounds
+        self._bounds = y_min + dy, y_max + dy, u_min + du, u_max + du, u_step_min, u_step_max
+        self.ysp = self.ysp + dy
+        if self.y_predicted is not None:
+            self.y_predicted = self.y_predicted + dy
+
+        self.model = lin_model
+        if self.formulation == 'sparse':
+            self._setup_sparse(*self._bounds)
+        else:
+            self._setup_condensed(*self._bounds)
+        self._fast_path_gains = self._unconstrained_gains() if self._use_fast_path else None
+        self._previous_solution = None
+        self.setup_time = time.perf_counter() - setup_start
+
+    def _move_blocks(self, move_blocking):
+        """Returns the time steps at which input moves are made
+
+        Parameters
+        ----------
+        move_blocking : {None, 'geometric', list}
+            The blocking pattern, see `MPC`
+
+        Returns
+        -------
+        block_starts : ndarray
+            The index of the first time step of each block
+        """
+        N_moves = self.M + 1
+        if move_blocking is None:
+            lengths = [1] * N_moves
+        elif move_blocking == 'geometric':
+            lengths = [2**i for i in range(int(numpy.log2(N_moves)) + 1)]
+        else:
+            lengths = list(move_blocking)
+            if len(lengths) == 0 or min(lengths) < 1:
+                raise ValueError('Move blocks must have a length of at least one')
+
+        block_starts = numpy.cumsum([0] + lengths[:-1])
+        return block_starts[block_starts < N_moves]
+
+    def _shift_moves(self, vs):
+        """Shifts blocked input moves (or their duals) forward by one time step.
+        Moves that no longer fall on the start of a block are dropped"""
+        Ni = self.model.B.shape[1]
+        moves = (self._T @ vs).reshape(-1, Ni)
+        moves = numpy.vstack([moves[1:], numpy.zeros((1, Ni))])
+        return moves[self._block_starts].flatten()
+
+    def _setup_sparse(self, y_min, y_max, u_min, u_max, u_step_min, u_step_max):
+        """Sets up the QP with the states and outputs as decision variables.
+        The cost and constraint matrices are assembled directly from COO triplets"""
+        P, M = self.P, self.M
+        Nx, Ni = self.model.B.shape
+        No, _ = self.model.C.shape
+        N_b = self._block_starts.size
+        A, B, C, D = [numpy.atleast_2d(m) for m in [self.model.A, self.model.B, self.model.C, self.model.D]]
+
+        # Column offsets of mu_k, y_k, u_-1 and the blocked input moves v_b
+        c_mu = numpy.arange(P + 1) * Nx
+        c_y = (P + 1) * Nx + numpy.arange(P) * No
+        c_um1 = (P + 1) * Nx + P * No
+        c_v = c_um1 + Ni + numpy.arange(N_b) * Ni
+        N = c_um1 + (N_b + 1) * Ni
+
+        # Column of each input move du_k, or -1 for moves inside a block
+        c_du = numpy.full(M + 1, -1)
+        c_du[self._block_starts] = c_v
+
+        # Row offsets of each group of constraints
+        r_state = Ni + numpy.arange(P + 1) * Nx
+        r_output = Ni + (P + 1) * Nx + numpy.arange(P) * No
+        r_output_ineq = r_output + P * No
+        r_steps = Ni + (P + 1) * Nx + 2 * P * No + numpy.arange(N_b) * Ni
+        r_input = r_steps[-1] + Ni
+
+        self.H = _triplets_to_csc((N, N), [
+            _block_triplets(c_y, c_y, self.Q),
+            _block_triplets(c_v, c_v, self.R)
+        ])
 
         self.q = numpy.hstack([
             numpy.zeros((P + 1) * Nx),
-            numpy.kron(numpy.ones(P), -self.Q @ ysp),
-            numpy.zeros((M + 2)*Ni)
+            numpy.kron(numpy.ones(P), -self.Q @ self.ysp),
+            numpy.zeros((N_b + 1)*Ni)
         ])
 
-        # Handling of initial condition um1
-        A_um1_init = scipy.sparse.hstack([
-            scipy.sparse.csc_matrix((Ni, (P + 1) * Nx + P * No)),
-            scipy.sparse.eye(Ni),
-            scipy.sparse.csc_matrix((Ni, (M + 1) * Ni))
-        ])
+        k_state = numpy.arange(1, P + 1)
+        k_moves = numpy.arange(1, M)
+        k_moves = k_moves[c_du[k_moves] >= 0]
+        k_output = numpy.arange(P)
+        k_output_moves = numpy.arange(min(M, P))
+        k_output_moves = k_output_moves[c_du[k_output_moves + 1] >= 0]
+        I_x, I_y, I_u = numpy.eye(Nx), numpy.eye(No), numpy.eye(Ni)
 
-        l_um1_init = um1
-
-        # Handling of mu_(k+1) = A @ mu_k + B @ u_k
-        A_state_x = scipy.sparse.hstack([
-            scipy.sparse.vstack([
-                -scipy.sparse.eye(Nx),
-                self.model.A - scipy.sparse.eye(Nx),
-                scipy.sparse.csc_matrix(((P-1)*Nx, Nx))
-            ]),
-            scipy.sparse.vstack([
-                scipy.sparse.csc_matrix((Nx, P*Nx)),
-                scipy.sparse.kron(
-                    scipy.sparse.eye(P, k=-1),
-                    self.model.A
-                ) - scipy.sparse.eye(P*Nx)
-            ])
+        self.A_matrix = _triplets_to_csc((r_input + Ni, N), [
+            # Handling of initial condition um1
+            _block_triplets([0], [c_um1], I_u),
+            # Handling of mu_(k+1) = A @ mu_k + B @ u_k
+            _block_triplets(r_state, c_mu, -I_x),
+            _block_triplets(r_state[1:], c_mu[:-1], A),
+            _block_triplets([r_state[1]], [c_mu[0]], -I_x),
+            _block_triplets([r_state[1], r_state[1]], [c_um1, c_v[0]], B),
+            _block_triplets(r_state[k_moves + 1], c_du[k_moves], B),
+            # Handling of y_k = C @ mu_k + D u_k
+            _block_triplets([r_output[0]], [c_mu[0]], C),
+            _block_triplets(r_output, c_mu[k_state], C),
+            _block_triplets(r_output, c_y, -I_y),
+            _block_triplets(r_output[1:], c_y[:-1], I_y),
+            _block_triplets([r_output[0], r_output[0]], [c_um1, c_v[0]], D),
+            _block_triplets(r_output[k_output_moves], c_du[k_output_moves + 1], D),
+            # y_min <= y_k <= y_max
+            _block_triplets(r_output_ineq[k_output], c_y, I_y),
+            # du_min <= du_k <= du_max
+            _block_triplets(r_steps, c_v, I_u),
+            # u_min <= u_0 <= u_max
+            _block_triplets([r_input, r_input], [c_um1, c_v[0]], I_u)
         ])
 
-        A_state_u = scipy.sparse.vstack([
-            scipy.sparse.csc_matrix((Nx, (M + 2)*Ni)),
-            scipy.sparse.kron(
-                scipy.sparse.hstack([
-                    scipy.sparse.csc_matrix(([1], ([0], [0])), shape=(M, 1)),
-                    scipy.sparse.eye(M),
-                    scipy.sparse.csc_matrix((M, 1))
-                ]),
-                self.model.B
-            ),
-            scipy.sparse.csc_matrix(((P - M) * Nx, (M + 2) * Ni))
-        ])
+        # The l and u of the equality constraints are set in step
+        equalities = numpy.zeros(Ni + (P + 1) * Nx + P * No)
+        self.l_matrix = numpy.hstack([equalities, numpy.tile(y_min, P), numpy.tile(u_step_min, N_b), u_min])
+        self.u_matrix = numpy.hstack([equalities, numpy.tile(y_max, P), numpy.tile(u_step_max, N_b), u_max])
 
-        A_state = scipy.sparse.hstack([
-            A_state_x,
-            scipy.sparse.csc_matrix(((P + 1) * Nx, P * No)),
-            A_state_u
-        ])
+        self._setup_solver()
+
+    def _setup_condensed(self, y_min, y_max, u_min, u_max, u_step_min, u_step_max):
+        r"""Sets up the QP with only the input moves as decision variables.
+        The outputs are eliminated with the prediction matrices
+
+        .. math::
+            Y = \Phi_x x_0 + \Phi_u u_{-1} + \Phi_b b + \Gamma \Delta U
+        """
+        P = self.P
+        _, Ni = self.model.B.shape
+        N_b = self._block_starts.size
+        N_v = N_b * Ni
+
+        self._Phi_x, self._Phi_u, self._Phi_b, self._Gamma = self._prediction_matrices()
 
-        b_state = numpy.hstack([-x0, numpy.zeros(P * Nx)])
+        Q_bar = scipy.sparse.kron(scipy.sparse.eye(P), self.Q)
+        self._Gamma_Q = self._Gamma.T @ Q_bar
+        self._y_sp = numpy.tile(self.ysp, P)
 
-        # Handling of y_k = C @ mu_k + D u_k
-        A_output_x = scipy.sparse.kron(
-            scipy.sparse.hstack([
-                scipy.sparse.csc_matrix(([1], ([0], [0])), shape=(P, 1)),
-                scipy.sparse.eye(P)
-            ]),
-            self.model.C
+        self.H = scipy.sparse.csc_matrix(
+            self._Gamma_Q @ self._Gamma + scipy.sparse.kron(scipy.sparse.eye(N_b), self.R)
         )
+        self.q = numpy.zeros(N_v)
 
-        A_output_y = -scipy.sparse.eye(P * No) + scipy.sparse.eye(P * No, k=-No)
-
-        A_output_u = scipy.sparse.vstack([
-            scipy.sparse.kron(
-                scipy.sparse.hstack([
-                    scipy.sparse.csc_matrix(([1, 1], ([0, 0], [0, 1])), shape=(M, 2)),
-                    scipy.sparse.eye(M)
-                ]),
-                self.model.D
-            ),
-            scipy.sparse.csc_matrix(((P-M)*No, (M+2)*Ni))
-        ])
+        # du_min <= du_k <= du_max and u_min <= u_-1 + du_0 <= u_max
+        A_blocks = [scipy.sparse.eye(N_v), scipy.sparse.eye(Ni, N_v)]
+        self.l_matrix = numpy.hstack([numpy.tile(u_step_min, N_b), u_min])
+        self.u_matrix = numpy.hstack([numpy.tile(u_step_max, N_b), u_max])
+        self._u_bounds = u_min, u_max
 
-        A_output = scipy.sparse.hstack([A_output_x, A_output_y, A_output_u])
+        # y_min <= y_k <= y_max, only added when the outputs are bounded
+        self._y_bounds = None
+        if not numpy.all(numpy.isinf([y_min, y_max])):
+            A_blocks.append(self._Gamma)
+            self._y_bounds = numpy.tile(y_min, P), numpy.tile(y_max, P)
+            self.l_matrix = numpy.hstack([self.l_matrix, self._y_bounds[0]])
+            self.u_matrix = numpy.hstack([self.u_matrix, self._y_bounds[1]])
 
-        b_output = numpy.zeros(P * No)
+        self.A_matrix = scipy.sparse.csc_matrix(scipy.sparse.vstack(A_blocks))
 
-        # y_min <= y_k <= y_max
-        A_output_ineq = scipy.sparse.hstack([
-            scipy.sparse.csc_matrix((P * No, (P + 1) * Nx)),
-            scipy.sparse.eye(P * No),
-            scipy.sparse.csc_matrix((P * No, (M + 2) * Ni))
-        ])
-        l_output_ineq = numpy.kron(numpy.ones(P), y_min)
-        u_output_ineq = numpy.kron(numpy.ones(P), y_max)
+        # The condensed cost is much larger than the sparse one,
+        # so the default relative tolerance would give inaccurate input moves
+        self._setup_solver(eps_abs=1e-4, eps_rel=1e-4)
 
-        # du_min <= du_k <= du_max
-        A_input_steps = scipy.sparse.hstack([
-            scipy.sparse.csc_matrix(((M+1) * Ni, (P + 1) * Nx + P * No + Ni)),
-            scipy.sparse.eye((M+1) * Ni)
-        ])
-        l_input_steps = numpy.kron(numpy.ones(M+1), u_step_min)
-        u_input_steps = numpy.kron(numpy.ones(M+1), u_step_max)
-
-        # u_min <= u_k <= u_max
-        self.A_input_ineq = scipy.sparse.hstack([
-            scipy.sparse.csc_matrix(((M+1) * Ni, (P + 1) * Nx + P * No)),
-            scipy.sparse.kron(
-                numpy.ones((M+1, 1)),
-                scipy.sparse.eye(Ni)
-            ),
-            scipy.sparse.kron(
-                scipy.sparse.csc_matrix(numpy.tril(numpy.ones((M+1, M+1)))),
-                numpy.eye(Ni)
+    def _setup_solver(self, **settings):
+        """Sets up the OSQP workspace for the assembled QP.
+        If the controller owns its workspace, that is it does not share it with clones,
+        and the sparsity patterns of the QP's matrices are unchanged,
+        the workspace is updated in place instead of being allocated again"""
+        P_triu = scipy.sparse.triu(self.H, format='csc')
+        pattern = [P_triu.indices, P_triu.indptr, self.A_matrix.indices, self.A_matrix.indptr]
+
+        if (getattr(self, '_owns_workspace', False)
+                and all(numpy.array_equal(a, b) for a, b in zip(pattern, self._pattern))):
+            self.prob.update(q=self.q, l=self.l_matrix, u=self.u_matrix,
+                             Px=P_triu.data, Ax=self.A_matrix.data)
+            return
+
+        self._owns_workspace = True
+        self._pattern = pattern
+        self.prob = osqp.OSQP()
+        self.prob.setup(self.H, self.q, self.A_matrix, self.l_matrix, self.u_matrix, verbose=False, **settings)
+        # The step size OSQP was set up with, which it adapts during solves.
+        # osqp < 1.0 has no settings attribute, and both versions default to 0.1
+        self._rho = settings.get('rho', getattr(getattr(self.prob, 'settings', None), 'rho', 0.1))
+
+    def _prediction_matrices(self):
+        """Returns the matrices that map the initial state, previous input,
+        output bias and blocked input moves onto the (P x No) outputs.
+        Each column is the response to a unit input
+
+        Returns
+        -------
+        Phi_x, Phi_u, Phi_b, Gamma : ndarray
+            The (P*No x Nx), (P*No x Ni), (P*No x No) and (P*No x N_b*Ni) prediction matrices
+        """
+        P, M = self.P, self.M
+        Nx, Ni = self.model.B.shape
+        No, _ = self.model.C.shape
+        N_v = self._T.shape[1]
+
+        def response(x0, um1, dus, bias):
+            n = max(a.shape[-1] for a in [x0, um1, dus, bias])
+            _, ys = self._predict(
+                *[numpy.broadcast_to(a, a.shape[:-1] + (n,)) for a in [x0, um1, dus, bias]]
             )
-        ])
-        self.A_input_ineq = scipy.sparse.hstack([
-            scipy.sparse.csc_matrix((Ni, (P + 1) * Nx + P * No)),
-            scipy.sparse.kron(
-                numpy.ones((1, 2)),
-                scipy.sparse.eye(Ni)
-            ),
-            scipy.sparse.csc_matrix((Ni, M*Ni)),
-        ])
-        self.l_input_ineq = numpy.kron(numpy.ones(1), u_min)
-        self.u_input_ineq = numpy.kron(numpy.ones(1), u_max)
+            return ys.reshape(P * No, n)
 
-        self.A_matrix = scipy.sparse.vstack([A_um1_init, A_state, A_output,
-                                             A_output_ineq, A_input_steps, self.A_input_ineq])
+        return (
+            response(numpy.eye(Nx), numpy.zeros((Ni, 1)), numpy.zeros((M + 1, Ni, 1)), numpy.zeros((No, 1))),
+            response(numpy.zeros((Nx, 1)), numpy.eye(Ni), numpy.zeros((M + 1, Ni, 1)), numpy.zeros((No, 1))),
+            response(numpy.zeros((Nx, 1)), numpy.zeros((Ni, 1)), numpy.zeros((M + 1, Ni, 1)), numpy.eye(No)),
+            response(numpy.zeros((Nx, 1)), numpy.zeros((Ni, 1)), self._T.reshape(M + 1, Ni, N_v),
+                     numpy.zeros((No, 1)))
+        )
 
-        self.l_matrix = numpy.hstack([l_um1_init, b_state, b_output,
-                                      l_output_ineq, l_input_steps, self.l_input_ineq])
+    def _unconstrained_gains(self):
+        r"""Precomputes the unconstrained optimal (blocked) input moves and outputs
+        as affine functions of the initial state, previous input and output bias
 
-        self.u_matrix = numpy.hstack([l_um1_init, b_state, b_output,
-                                      u_output_ineq, u_input_steps, self.u_input_ineq])
+        .. math::
+            \Delta U = K_u p + k_u, \quad Y = K_y p + k_y, \quad p = [x_0, u_{-1}, b]
 
-        # Create an OSQP object
-        self.prob = osqp.OSQP()
+        The condensed Hessian is reused when it has been assembled and
+        is factorised with a Cholesky decomposition
 
-        # Setup workspace
-        self.A_matrix = scipy.sparse.csc_matrix(self.A_matrix)
-        self.prob.setup(self.H, self.q, self.A_matrix, self.l_matrix, self.u_matrix, verbose=False)
+        Returns
+        -------
+        gains : tuple
+            `(K_u, k_u, K_y, k_y)`, or `None` if the unconstrained problem
+            does not have a unique solution
+        """
+        P = self.P
+        if self.formulation == 'condensed':
+            Phi_x, Phi_u, Phi_b, Gamma = self._Phi_x, self._Phi_u, self._Phi_b, self._Gamma
+            Gamma_Q, H = self._Gamma_Q, self.H.toarray()
+        else:
+            Phi_x, Phi_u, Phi_b, Gamma = self._prediction_matrices()
+            Gamma_Q = (scipy.sparse.kron(scipy.sparse.eye(P), self.Q.T) @ Gamma).T
+            H = Gamma_Q @ Gamma + scipy.sparse.kron(scipy.sparse.eye(self._block_starts.size), self.R).toarray()
+        Phi = numpy.hstack([Phi_x, Phi_u, Phi_b])
 
-        self.y_predicted = None
+        try:
+            factor = scipy.linalg.cho_factor(H)
+        except numpy.linalg.LinAlgError:
+            return None
 
-    def step(self, x0, um1, y0):
-        """return the MPC control input using a linear system"""
-        # Added due to OSQP bug
-        x0 = numpy.maximum(numpy.minimum(x0, 1e10), -1e10)
-        um1 = numpy.maximum(numpy.minimum(um1, 1e10), -1e10)
-        y0 = numpy.maximum(numpy.minimum(y0, 1e10), -1e10)
+        # The gains of the unconstrained moves -H^-1 Gamma^T Q (Phi p + Y_sp)
+        F = -scipy.linalg.cho_solve(factor, numpy.hstack([Gamma_Q @ Phi, -Gamma_Q @ numpy.tile(self.ysp, P)[:, None]]))
+        K_u, k_u = F[:, :-1], F[:, -1]
+        return K_u, k_u, Phi + Gamma @ K_u, Gamma @ k_u
+
+    def _fast_path(self, x0, um1, bias):
+        """Returns the unconstrained optimal input moves and outputs
+        if they satisfy all the bounds
+
+        Parameters
+        ----------
+        x0, um1, bias : ndarray
+            The initial state, previous input and output bias
+
+        Returns
+        -------
+        dus, ys : ndarray
+            The blocked input moves and outputs, or `None` if a bound would be violated
+        """
+        K_u, k_u, K_y, k_y = self._fast_path_gains
+        y_min, y_max, u_min, u_max, u_step_min, u_step_max = self._bounds
+        Ni = u_min.size
+
+        p = numpy.hstack([x0, um1, bias])
+        dus = (K_u @ p + k_u).reshape(-1, Ni)
+        if numpy.any(dus < u_step_min) or numpy.any(dus > u_step_max):
+            return None
+
+        u0 = um1 + dus[0]
+        if numpy.any(u0 < u_min) or numpy.any(u0 > u_max):
+            return None
+
+        ys = (K_y @ p + k_y).reshape(-1, y_min.size)
+        if numpy.any(ys < y_min) or numpy.any(ys > y_max):
+            return None
+
+        return dus, ys
 
+    def _auto_formulation(self, y_unbounded):
+        """Picks the formulation with the fewest estimated nonzeros in the factorised KKT matrix.
+        The sparse KKT matrix is banded, with a bandwidth of about one time step,
+        while the condensed Hessian is dense
+
+        Parameters
+        ----------
+        y_unbounded : bool
+            If `True` then the condensed formulation has no output constraints
+
+        Returns
+        -------
+        formulation : {'sparse', 'condensed'}
+            The chosen formulation
+        """
+        P = self.P
+        Nx, Ni = self.model.B.shape
+        No, _ = self.model.C.shape
+        N_v = self._block_starts.size * Ni
+
+        # Variables plus constraint rows, times the bandwidth
+        N_sparse = (P + 1) * Nx + P * No + N_v + Ni
+        sparse = (N_sparse + Ni + (P + 1) * Nx + 2 * P * No + N_v + Ni) * (Nx + No + Ni)
+
+        # The input constraint rows barely fill in, but the dense output constraint rows do
+        N_condensed = N_v + (0 if y_unbounded else P * No)
+        condensed = N_condensed ** 2 // 2 + N_v + Ni
+
+        return 'condensed' if condensed <= sparse else 'sparse'
+
+    def _predict(self, x0, um1, dus, bias):
+        """Simulates the internal model over the prediction horizon.
+        Trailing dimensions of the arguments are carried through,
+        so that passing identity matrices gives the prediction matrices
+
+        Parameters
+        ----------
+        x0, um1, bias : ndarray
+            The initial state, previous input and output bias
+
+        dus : ndarray
+            A ((M+1) x Ni) array of input moves
+
+        Returns
+        -------
+        mus : ndarray
+            A ((P+1) x Nx) array of the initial state followed by the state changes
+
+        ys : ndarray
+            A (P x No) array of outputs, including the bias
+        """
+        A, B, C, D = self.model.A, self.model.B, self.model.C, self.model.D
+        P, M = self.P, self.M
+
+        mus = numpy.zeros((P + 1,) + x0.shape)
+        mus[0] = x0
+        mus[1] = A @ x0 - x0 + B @ (um1 + dus[0])
+        for k in range(1, P):
+            mus[k + 1] = A @ mus[k] + (B @ dus[k] if k < M else 0)
+
+        ys = numpy.zeros((P, C.shape[0]) + x0.shape[1:])
+        y_k = C @ x0 + D @ (um1 + dus[0])
+        for k in range(P):
+            y_k = y_k + C @ mus[k + 1] + (D @ dus[k + 1] if k < M else 0) + bias
+            ys[k] = y_k
+
+        return mus, ys
+
+    def _shifted_solution(self, x0, um1, bias):
+        """Returns the previous primal and dual solutions shifted forward
+        by one control interval.
+        The input moves are shifted and padded with a zero move, after which the
+        states and outputs are recalculated from the new initial conditions
+        so that the primal warm start satisfies the model equations.
+
+        Parameters
+        ----------
+        x0, um1, bias : ndarray
+            The new initial state, previous input and output bias
+
+        Returns
+        -------
+        x, y : ndarray
+            The shifted primal and dual solutions
+        """
+        Nx, Ni = self.model.B.shape
+        No, _ = self.model.C.shape
+        P = self.P
+        N_v = self._block_starts.size * Ni
+        x_prev, y_prev = self._previous_solution
+        x0, um1, bias = [numpy.atleast_1d(a) for a in [x0, um1, bias]]
+
+        def shift(v, n):
+            return numpy.hstack([v[n:], numpy.zeros(n)])
+
+        if self.formulation == 'condensed':
+            # Constraints: input steps, input bounds and optionally output bounds
+            y_steps, y_input, y_output_ineq = numpy.split(y_prev, [N_v, N_v + Ni])
+            y = numpy.hstack([self._shift_moves(y_steps), y_input])
+            if y_output_ineq.size:
+                y = numpy.hstack([y, shift(y_output_ineq, No)])
+            return self._shift_moves(x_prev), y
+
+        vs = self._shift_moves(x_prev[(P + 1) * Nx + P * No + Ni:])
+        x = self._sparse_primal(x0, um1, vs, bias)
+
+        # Constraints: u_-1, states, outputs, output bounds, input steps, input bounds
+        y_um1, y_state, y_output, y_output_ineq, y_steps, y_input = numpy.split(
+            y_prev, numpy.cumsum([Ni, (P + 1) * Nx, P * No, P * No, N_v])
+        )
+        y = numpy.hstack([y_um1, shift(y_state, Nx), shift(y_output, No),
+                          shift(y_output_ineq, No), self._shift_moves(y_steps), y_input])
+
+        return x, y
+
+    def _sparse_primal(self, x0, um1, vs, bias):
+        """Returns the sparse decision variables that satisfy
+        the model equations for the given blocked input moves"""
+        vs = numpy.ravel(vs)
+        dus = (self._T @ vs).reshape(self.M + 1, -1)
+        mus, ys = self._predict(x0, um1, dus, bias)
+        return numpy.hstack([mus.flatten(), ys.flatten(), um1, vs])
+
+    def _update_sparse(self, x0, um1, bias):
+        """Updates the initial condition and bias constraints of the sparse QP"""
         Nx, Ni = self.model.B.shape
         No, _ = self.model.C.shape
 
@@ -253,27 +737,539 @@ class MPC:
         self.u_matrix[:Ni] = um1
         self.u_matrix[Ni:Ni + Nx] = -x0
 
+        self.l_matrix[Ni + (self.P+1)*Nx: Ni + (self.P+1)*Nx + self.P*No] = numpy.tile(-bias, self.P)
+        self.u_matrix[Ni + (self.P+1)*Nx: Ni + (self.P+1)*Nx + self.P*No] = numpy.tile(-bias, self.P)
+
+        self.prob.update(l=self.l_matrix, u=self.u_matrix)
+
+    def _update_condensed(self, x0, um1, bias):
+        """Updates the linear cost and the bounds of the condensed QP with the free response"""
+        Ni = self.model.B.shape[1]
+        n = (self._block_starts.size + 1) * Ni
+        x0, um1, bias = [numpy.atleast_1d(a) for a in [x0, um1, bias]]
+
+        self._y_free = self._Phi_x @ x0 + self._Phi_u @ um1 + self._Phi_b @ bias
+        self.q = self._Gamma_Q @ (self._y_free - self._y_sp)
+
+        u_min, u_max = self._u_bounds
+        self.l_matrix[n - Ni:n] = u_min - um1
+        self.u_matrix[n - Ni:n] = u_max - um1
+        if self._y_bounds is not None:
+            self.l_matrix[n:] = self._y_bounds[0] - self._y_free
+            self.u_matrix[n:] = self._y_bounds[1] - self._y_free
+
+        self.prob.update(q=self.q, l=self.l_matrix, u=self.u_matrix)
+
+    # Statuses of solves that were stopped early
+    _OUT_OF_TIME = ['run time limit reached', 'maximum iterations reached', 'solved inaccurate']
+
+    def _limit_solve(self, remaining):
+        """Limits the time and iterations of the next solve.
+        The iteration limit uses the mean time per iteration of the last 20 solves
+
+        Parameters
+        ----------
+        remaining : float
+            The time left in the step's budget
+        """
+        remaining = max(remaining, 1e-6)
+        settings = {'time_limit': remaining}
+
+        solves = self.telemetry[self.telemetry['iterations'] > 0][-20:]
+        if solves.size > 0:
+            seconds_per_iteration = numpy.mean(solves['solve_time'] / solves['iterations'])
+            settings['max_iter'] = max(int(remaining / seconds_per_iteration), 1)
+
+        self.prob.update_settings(**settings)
+
+    def _feasible(self, x):
+        """Checks if an iterate satisfies the constraints to within OSQP's absolute tolerance"""
+        if x is None or not numpy.all(numpy.isfinite(x)):
+            return False
+        tolerance = 10 * getattr(getattr(self.prob, 'settings', None), 'eps_abs', 1e-3)
+        Ax = self.A_matrix @ x
+        return bool(numpy.all(Ax >= self.l_matrix - tolerance) and numpy.all(Ax <= self.u_matrix + tolerance))
+
+    def _cold_start(self, reset_rho):
+        """Starts the next solve from zero iterates
+
+        Parameters
+        ----------
+        reset_rho : bool
+            Should the step size be reset to the one OSQP was set up with,
+            rather than the one it adapted to in previous solves?
+        """
+        if reset_rho:
+            self.prob.update_settings(rho=self._rho)
+        self.prob.warm_start(x=numpy.zeros(self.H.shape[0]), y=numpy.zeros(self.l_matrix.size))
+
+    def _shifted_plan(self, x0, um1, bias):
+        """Returns the control input of the previous plan shifted forward by one interval.
+        The first move is limited to the input and input step bounds.
+        With no previous plan the input is held
+
+        Parameters
+        ----------
+        x0, um1, bias : ndarray
+            The initial state, previous input and output bias
+
+        Returns
+        -------
+        ctrl : ndarray
+            The control input
+        """
+        Nx, Ni = self.model.B.shape
+        No, _ = self.model.C.shape
+        y_min, y_max, u_min, u_max, u_step_min, u_step_max = self._bounds
+        x0, um1, bias = [numpy.atleast_1d(a) for a in [x0, um1, bias]]
+
+        if self._previous_solution is None:
+            vs = numpy.zeros(self._block_starts.size * Ni)
+        elif self.formulation == 'condensed':
+            vs = self._shift_moves(self._previous_solution[0])
+        else:
+            vs = self._shift_moves(self._previous_solution[0][(self.P + 1) * Nx + self.P * No + Ni:])
+
+        vs[:Ni] = numpy.clip(vs[:Ni], u_step_min, u_step_max)
+        vs[:Ni] = numpy.clip(um1 + vs[:Ni], u_min, u_max) - um1
+
+        _, ys = self._predict(x0, um1, (self._T @ vs).reshape(self.M + 1, Ni), bias)
+        self.y_predicted = ys[0] - bias
+
+        x = vs if self.formulation == 'condensed' else self._sparse_primal(x0, um1, vs, bias)
+        self._previous_solution = x, numpy.zeros_like(self.l_matrix)
+        return um1 + vs[:Ni]
+
+    def step(self, x0, um1, y0):
+        """return the MPC control input using a linear system"""
+        step_start = time.perf_counter()
+
+        # Added due to OSQP bug
+        x0 = numpy.maximum(numpy.minimum(x0, 1e10), -1e10)
+        um1 = numpy.maximum(numpy.minimum(um1, 1e10), -1e10)
+        y0 = numpy.maximum(numpy.minimum(y0, 1e10), -1e10)
+
+        Nx, Ni = self.model.B.shape
+        No, _ = self.model.C.shape
+
         if self.y_predicted is not None:
             bias = y0 - self.y_predicted
         else:
             bias = numpy.zeros_like(y0)
 
-        self.l_matrix[Ni + (self.P+1)*Nx: Ni + (self.P+1)*Nx + self.P*No] = numpy.tile(-bias, self.P)
-        self.u_matrix[Ni + (self.P+1)*Nx: Ni + (self.P+1)*Nx + self.P*No] = numpy.tile(-bias, self.P)
+        if self._fast_path_gains is not None:
+            x0, um1, bias = [numpy.atleast_1d(a) for a in [x0, um1, bias]]
+            solution = self._fast_path(x0, um1, bias)
+            if solution is not None:
+                dus, ys = solution
+                self.y_predicted = ys[0] - bias
 
-        self.prob.update(l=self.l_matrix, u=self.u_matrix)
+                # Inequality constraints are inactive, so their duals are zero
+                if self.formulation == 'condensed':
+                    x = dus.flatten()
+                else:
+                    x = self._sparse_primal(x0, um1, dus, bias)
+                self._previous_solution = x, numpy.zeros_like(self.l_matrix)
+
+                step_time = time.perf_counter() - step_start
+                self.deadline_met = self.time_budget is None or step_time <= self.time_budget
+                self._record(step_time=step_time, status=1, fast_path=True, deadline_met=self.deadline_met)
+                return um1 + dus[0]
+
+        update_start = time.perf_counter()
+        if self.formulation == 'condensed':
+            self._update_condensed(x0, um1, bias)
+        else:
+            self._update_sparse(x0, um1, bias)
+
+        warm_started = self.warm_start and self._previous_solution is not None
+        if warm_started:
+            self.prob.warm_start(*self._shifted_solution(x0, um1, bias))
+        else:
+            # A shared workspace may hold the iterates and adapted step size of a clone
+            self._cold_start(reset_rho=not self._owns_workspace)
+        if self.time_budget is not None:
+            self._limit_solve(self.time_budget - (time.perf_counter() - step_start))
+        update_time = time.perf_counter() - update_start
 
         # Solve
         res = self.prob.solve()
+        solve_time, iterations = res.info.solve_time, res.info.iter
+
+        fallback = ''
+        # The shifted solution can make OSQP report a feasible QP as infeasible
+        if warm_started and res.info.status_val != 1 and res.info.status not in MPC._OUT_OF_TIME:
+            fallback = 'cold'
+            self._cold_start(reset_rho=not self._owns_workspace)
+            if self.time_budget is not None:
+                self._limit_solve(self.time_budget - (time.perf_counter() - step_start))
+            res = self.prob.solve()
+            solve_time, iterations = solve_time + res.info.solve_time, iterations + res.info.iter
+
+        step_time = time.perf_counter() - step_start
+        self.deadline_met = res.info.status_val == 1 and (self.time_budget is None or step_time <= self.time_budget)
+
+        if self.time_budget is not None and res.info.status in MPC._OUT_OF_TIME:
+            fallback = 'iterate' if self._feasible(res.x) else 'plan'
+
+        # osqp < 1.0 names the residuals pri_res and dua_res
+        info = res.info
+        self._record(
+            step_time=step_time,
+            solve_time=solve_time,
+            update_time=update_time,
+            iterations=iterations,
+            prim_res=getattr(info, 'prim_res', getattr(info, 'pri_res', numpy.nan)),
+            dual_res=getattr(info, 'dual_res', getattr(info, 'dua_res', numpy.nan)),
+            status=info.status_val,
+            warm_started=warm_started,
+            deadline_met=self.deadline_met,
+            fallback=fallback
+        )
+
+        if fallback == 'plan':
+            return self._shifted_plan(x0, um1, bias)
 
         # Check solver status
-        if res.info.status_val not in [1]:
+        if res.info.status_val not in [1] and fallback != 'iterate':
             raise ValueError(f'OSQP did not solve the problem! Status: {res.info.status}')
 
         # Apply first control input to the plant
-        m = (self.P + 1) * Nx + self.P * No + Ni
-        ctrl = res.x[m: m + Ni] + um1
+        if self.formulation == 'condensed':
+            ctrl = res.x[:Ni] + um1
+            self.y_predicted = self._y_free[:No] + self._Gamma[:No] @ res.x - bias
+        else:
+            m = (self.P + 1) * Nx + self.P * No + Ni
+            ctrl = res.x[m: m + Ni] + um1
+            self.y_predicted = res.x[(self.P+1)*Nx:(self.P+1)*Nx + No] - bias
+        self._previous_solution = res.x, res.y
+
+        return ctrl
+
+
+def _block_triplets(row_offsets, col_offsets, block):
+    """Returns the COO triplets of copies of a dense block placed at the given offsets
 
-        self.y_predicted = res.x[(self.P+1)*Nx:(self.P+1)*Nx + No] - bias
+    Parameters
+    ----------
+    row_offsets, col_offsets : array_like
+        The row and column of the top left corner of each copy
 
+    block : ndarray
+        The 2D block
+
+    Returns
+    -------
+    rows, cols, values : ndarray
+        The triplets
+    """
+    block = numpy.atleast_2d(block)
+    a, b = block.shape
+    row_offsets = numpy.asarray(row_offsets, dtype=int)
+    col_offsets = numpy.asarray(col_offsets, dtype=int)
+
+    rows = row_offsets[:, None, None] + numpy.arange(a)[None, :, None]
+    cols = col_offsets[:, None, None] + numpy.arange(b)[None, None, :]
+    rows, cols = numpy.broadcast_arrays(rows, cols)
+    values = numpy.broadcast_to(block, rows.shape)
+    return rows.ravel(), cols.ravel(), values.ravel()
+
+
+def _triplets_to_csc(shape, triplets):
+    """Assembles a CSC matrix from lists of COO triplets, summing duplicates and dropping zeros"""
+    rows, cols, values = [numpy.concatenate(t) for t in zip(*triplets)]
+    matrix = scipy.sparse.coo_matrix((values.astype(float), (rows, cols)), shape=shape).tocsc()
+    matrix.eliminate_zeros()
+    return matrix
+
+
+class MPCCache:
+    """Creates MPC controllers, reusing the set-up solver workspace of a previous
+    controller with the same problem instead of assembling and factorising the QP again.
+    Controllers are keyed on the horizons, tuning, model matrices, set point, bounds and options.
+    The cache keeps an unused template of each problem and always returns clones of it,
+    so returned controllers with the same key share a workspace, see `MPC.clone`
+
+    Attributes
+    -----------
+    hits, misses : int
+        The number of controllers that were cloned and created
+    """
+    def __init__(self):
+        self._controllers = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f'MPCCache(hits={self.hits}, misses={self.misses})'
+
+    @staticmethod
+    def _key(*values):
+        """Returns a hashable key of arrays, lists of bounds and plain values"""
+        key = []
+        for value in values:
+            if value is None or isinstance(value, (str, bool, int, float)):
+                key.append(value)
+            else:
+                array = numpy.asarray(value, dtype=float)
+                key.append((array.shape, array.tobytes()))
+        return tuple(key)
+
+    def get(self, P, M, Q, R, lin_model, ysp, **kwargs):
+        """Returns a controller for the problem.
+        Takes the same arguments as `MPC`, with the optional ones as keywords
+
+        Returns
+        -------
+        K : MPC
+            A clone of the problem's template
+        """
+        names = sorted(kwargs)
+        key = MPCCache._key(P, M, Q, R, lin_model.A, lin_model.B, lin_model.C, lin_model.D, ysp,
+                            *names, *[kwargs[name] for name in names])
+
+        if key not in self._controllers:
+            self.misses += 1
+            self._controllers[key] = MPC(P, M, Q, R, lin_model, ysp, **kwargs)
+        else:
+            self.hits += 1
+
+        K = self._controllers[key].clone()
+        K.model = lin_model
+        return K
+
+
+class BatchMPC:
+    """Solves a batch of identically structured MPC problems that differ
+    only in their initial states, previous inputs and measurements,
+    as found in ensemble simulations.
+    Each problem has its own set-up OSQP workspace and the problems are solved
+    in a thread pool, since OSQP releases the GIL while solving.
+    A problem that fails to solve holds its previous input
+    without affecting the rest of the batch
+
+    Parameters
+    ----------
+    N_problems : int
+        Number of problems in the batch
+
+    P, M, Q, R, lin_model, ysp, y_bounds, u_bounds, u_step_bounds, warm_start, formulation
+        Arguments of `MPC`
+
+    move_blocking, fast_path, time_budget
+        Arguments of `MPC`
+
+    workers : int, optional
+        Number of threads. Defaults to the `concurrent.futures.ThreadPoolExecutor` default
+
+    Attributes
+    -----------
+    controllers : list
+        The `MPC` of each problem
+
+    solved : ndarray
+        A (N_problems) boolean array that is `False` for the problems
+        whose last step failed and held the previous input
+    """
+    def __init__(self, N_problems, P, M, Q, R, lin_model, ysp,
+                 y_bounds=None, u_bounds=None, u_step_bounds=None, warm_start=True,
+                 formulation='auto', move_blocking=None, fast_path=False, time_budget=None, workers=None):
+        self.controllers = [
+            MPC(P, M, Q, R, lin_model, ysp, y_bounds, u_bounds, u_step_bounds, warm_start, formulation,
+                move_blocking=move_blocking, fast_path=fast_path, time_budget=time_budget)
+            for _ in range(N_problems)
+        ]
+        self.solved = numpy.ones(N_problems, dtype=bool)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    @property
+    def y_predicted(self):
+        """A (N_problems x No) array of the predicted outputs, or `None` before the first step"""
+        if self.controllers[0].y_predicted is None:
+            return None
+        return numpy.array([K.y_predicted for K in self.controllers])
+
+    def step(self, x0s, um1s, y0s):
+        """Returns the MPC control inputs of all the problems
+
+        Parameters
+        ----------
+        x0s : ndarray
+            A (N_problems x Nx) array of initial states
+
+        um1s : ndarray
+            A (N_problems x Ni) array of previous inputs
+
+        y0s : ndarray
+            A (N_problems x No) array of measured outputs
+
+        Returns
+        -------
+        ctrls : ndarray
+            A (N_problems x Ni) array of control inputs,
+            with the previous inputs of the problems that failed to solve
+        """
+        futures = [
+            self._executor.submit(K.step, x0, um1, y0)
+            for K, x0, um1, y0 in zip(self.controllers, x0s, um1s, y0s)
+        ]
+
+        ctrls = []
+        for i, (future, um1) in enumerate(zip(futures, um1s)):
+            try:
+                ctrls.append(future.result())
+                self.solved[i] = True
+            except ValueError:
+                ctrls.append(numpy.asarray(um1, dtype=float))
+                self.solved[i] = False
+        return numpy.array(ctrls)
+
+    def close(self):
+        """Shuts down the thread pool"""
+        self._executor.shutdown()
+
+
+class AsyncController:
+    """Runs the steps of a controller on a worker thread so that they
+    overlap with other work, such as resampling the filter, or with `delay`,
+    the plant and the filter's predictions over the next control period.
+    The inputs of each step are copied into one of two buffers,
+    so the caller can reuse its arrays while the step that reads
+    the other buffer is still running
+
+    Parameters
+    ----------
+    K : MPC
+        The controller.
+        Only the worker thread may use it while a step is running
+
+    delay : bool, optional
+        If `True` then `step` returns the control input calculated
+        in the previous call, one control period late,
+        so that the whole period is available for the solve.
+        To compensate, each step is solved from the state one control period ahead,
+        predicted with the controller's model while the returned input is applied.
+        Otherwise `submit` and `result` have to be used to overlap the solve
+
+    Attributes
+    -----------
+    K : MPC
+        The controller
+    """
+    def __init__(self, K, delay=False):
+        self.K = K
+        self.delay = delay
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._buffers = [None, None]
+        self._current = 0
+        self._future = None
+        self._y_predicted = None
+
+    @property
+    def y_predicted(self):
+        """The predicted outputs of the last step that was collected, or `None` before it"""
+        return self._y_predicted
+
+    @property
+    def pending(self):
+        """`True` if a submitted step has not been collected with `result`"""
+        return self._future is not None
+
+    def _step(self, buffer):
+        """Runs a step of the controller on the arguments in a buffer"""
+        ctrl = self.K.step(*buffer)
+        return ctrl, copy.copy(self.K.y_predicted)
+
+    def submit(self, x0, um1, y0):
+        """Starts a step of the controller on the worker thread.
+        Only one step can be pending at a time
+
+        Parameters
+        ----------
+        x0, um1, y0 : ndarray
+            Arguments of `MPC.step`
+        """
+        if self._future is not None:
+            raise RuntimeError('The previous step has not been collected')
+
+        self._current = 1 - self._current
+        arrays = [numpy.asarray(a, dtype=numpy.float64) for a in [x0, um1, y0]]
+        buffer = self._buffers[self._current]
+        if buffer is None or any(b.shape != a.shape for b, a in zip(buffer, arrays)):
+            buffer = self._buffers[self._current] = [numpy.empty_like(a) for a in arrays]
+        for b, a in zip(buffer, arrays):
+            b[...] = a
+
+        self._future = self._executor.submit(self._step, buffer)
+
+    def result(self):
+        """Waits for the pending step and returns its control input.
+        Errors raised by the step, such as the `ValueError` of a failed solve,
+        are raised here
+
+        Returns
+        -------
+        ctrl : ndarray
+            The control input
+        """
+        future, self._future = self._future, None
+        ctrl, self._y_predicted = future.result()
+        return ctrl
+
+    def _ahead(self, x0, um1, y0, ctrl):
+        """Returns the arguments of `MPC.step` one control period ahead,
+        predicted with the controller's model while `ctrl` is applied.
+        The measurement is shifted by the predicted change in the outputs,
+        so that the controller's bias compares it to the prediction for the same time"""
+        lin_model = self.K.model
+        x0, um1, y0, ctrl = [numpy.atleast_1d(numpy.asarray(a, dtype=numpy.float64)) for a in [x0, um1, y0, ctrl]]
+        x1 = lin_model.A @ x0 + lin_model.B @ ctrl
+        y1 = y0 + lin_model.C @ (x1 - x0) + lin_model.D @ (ctrl - um1)
+        return x1, ctrl, y1
+
+    def step(self, x0, um1, y0):
+        """Returns a control input.
+        With `delay` the control input of the previous call is returned,
+        or `um1` on the first call, and the step for the next control period
+        is started from these arguments, see `delay`.
+        If the previous call's step failed its error is raised after the next
+        step is started, which assumes that `um1` is held.
+        Otherwise this waits for the step for these arguments
+
+        Parameters
+        ----------
+        x0, um1, y0 : ndarray
+            Arguments of `MPC.step`
+
+        Returns
+        -------
+        ctrl : ndarray
+            The control input
+        """
+        if not self.delay:
+            self.submit(x0, um1, y0)
+            return self.result()
+
+        # The controller is only used by one step at a time
+        previous, self._future = self._future, None
+        ctrl, error = numpy.array(um1, dtype=numpy.float64), None
+        if previous is not None:
+            try:
+                ctrl, self._y_predicted = previous.result()
+            except ValueError as e:
+                error = e
+        self.submit(*self._ahead(x0, um1, y0, ctrl))
+
+        if error is not None:
+            raise error
         return ctrl
+
+    def telemetry_summary(self):
+        """Waits for the pending step and returns `MPC.telemetry_summary`"""
+        if self._future is not None:
+            concurrent.futures.wait([self._future])
+        return self.K.telemetry_summary()
+
+    def close(self):
+        """Waits for the pending step and shuts down the worker thread"""
+        self._executor.shutdown()
@@ -1,9 +1,11 @@
 import numpy
 import cupy
-import numba
 import numba.cuda as cuda
 import torch
 import torch.utils.dlpack as torch_dlpack
+import gaussian_sum_dist
+import shared_arrays
+import model.kernels
 
 
 class GaussianSumUnscentedKalmanFilter:
@@ -31,6 +33,20 @@ class GaussianSumUnscentedKalmanFilter:
         Distributions for the state and measurement noise.
         Represented as Gaussian sums
 
+    rng : numpy.random.Generator, optional
+        The random number stream used for resampling.
+        Defaults to the global numpy random state
+
+    qmc, qmc_noise : bool, optional
+        Should quasi-Monte Carlo samples be used for the initial particles
+        and for the state noise, respectively
+
+    vectorized : bool, optional
+        If `True` then `f` and `g` take (... x Nx) arrays of states
+        and return (... x Nx) and (... x N_outputs) arrays,
+        so that all the particles are evaluated in one call.
+        A model's bound kernels, see `model.NonlinearModel.bind`, work either way
+
     Attributes
     -----------
     means : numpy.array
@@ -42,12 +58,16 @@ class GaussianSumUnscentedKalmanFilter:
     weights : numpy.array
         A (N_particles) array containing the weights of the particles
     """
-    def __init__(self, f, g, N_particles, x0, state_pdf, measurement_pdf):
+    def __init__(self, f, g, N_particles, x0, state_pdf, measurement_pdf,
+                 rng=None, qmc=False, qmc_noise=False, vectorized=False):
         self.f = f
         self.g = g
         self.N_particles = int(N_particles)
+        self.rng = numpy.random if rng is None else rng
+        self.qmc_noise = qmc_noise
+        self.vectorized = vectorized
 
-        self.means = x0.draw(N_particles)
+        self.means = x0.draw(N_particles, qmc)
 
         self.covariances = numpy.repeat(state_pdf.covariances[0][None, :, :], N_particles, axis=0)
 
@@ -58,6 +78,10 @@ class GaussianSumUnscentedKalmanFilter:
 
         self._Nx = self.means.shape[1]
         self._Ny = measurement_pdf.draw().shape[1]
+        self._set_sigma_weights()
+
+    def _set_sigma_weights(self):
+        """Sets the number of sigma points and their weights"""
         self._N_sigmas = 2 * self._Nx + 1
 
         # weights calculated such that:
@@ -93,10 +117,13 @@ class GaussianSumUnscentedKalmanFilter:
         sigmas = self._get_sigma_points()
 
         # Move the sigma points through the state transition function
-        for gaussian in range(self.N_particles):
-            for sigma in range(self._N_sigmas):
-                sigmas[gaussian, sigma] += self.f(sigmas[gaussian, sigma], u, dt)
-        sigmas += self.state_pdf.draw((self.N_particles, self._N_sigmas))
+        if self.vectorized:
+            sigmas += self.f(sigmas, u, dt)
+        else:
+            for gaussian in range(self.N_particles):
+                for sigma in range(self._N_sigmas):
+                    sigmas[gaussian, sigma] += self.f(sigmas[gaussian, sigma], u, dt)
+        sigmas += self.state_pdf.draw((self.N_particles, self._N_sigmas), self.qmc_noise)
 
         self.means = numpy.average(sigmas, axis=1, weights=self._w_sigma)
         sigmas -= self.means[:, None, :]
@@ -118,9 +145,12 @@ class GaussianSumUnscentedKalmanFilter:
         etas = numpy.zeros((self.N_particles, self._N_sigmas, self._Ny))
 
         # Move the sigma points through the state observation function
-        for gaussian in range(self.N_particles):
-            for sigma in range(self._N_sigmas):
-                etas[gaussian, sigma] = self.g(sigmas[gaussian, sigma], u)
+        if self.vectorized:
+            etas[...] = self.g(sigmas, u)
+        else:
+            for gaussian in range(self.N_particles):
+                for sigma in range(self._N_sigmas):
+                    etas[gaussian, sigma] = self.g(sigmas[gaussian, sigma], u)
 
         # Compute the Kalman gain
         eta_means = numpy.average(etas, axis=1, weights=self._w_sigma)
@@ -142,8 +172,11 @@ class GaussianSumUnscentedKalmanFilter:
         y_means = numpy.zeros((self.N_particles, self._Ny))
 
         # Move the means through the state observation function
-        for gaussian in range(self.N_particles):
-            y_means[gaussian] = self.g(self.means[gaussian], u)
+        if self.vectorized:
+            y_means[...] = self.g(self.means, u)
+        else:
+            for gaussian in range(self.N_particles):
+                y_means[gaussian] = self.g(self.means[gaussian], u)
 
         glob_es = z - y_means
         self.weights *= self.measurement_pdf.pdf(glob_es)
@@ -156,7 +189,7 @@ class GaussianSumUnscentedKalmanFilter:
         cumsum /= cumsum[-1]
 
         sample_index_result = numpy.zeros(self.N_particles, dtype=numpy.int64)
-        r = numpy.random.rand()
+        r = self.rng.random()
         k = 0
 
         for i in range(self.N_particles):
@@ -182,6 +215,73 @@ class GaussianSumUnscentedKalmanFilter:
         s = numpy.linalg.svd(cov, compute_uv=False)
         return s[0]
 
+    def to_shared_memory(self):
+        """Exports the Gaussians and noise distributions to shared memory
+        so that worker processes can attach to them without copying.
+        `f` and `g` are pickled by reference, so they must be module level functions
+        or static methods.
+
+        Returns
+        -------
+        shared : shared_arrays.SharedArrays
+            A picklable handle to the filter
+        """
+        return shared_arrays.SharedArrays(
+            {'means': self.means, 'covariances': self.covariances, 'weights': self.weights},
+            {'f': self.f, 'g': self.g, 'qmc_noise': self.qmc_noise, 'vectorized': self.vectorized,
+             'state_pdf': self.state_pdf.to_shared_memory(),
+             'measurement_pdf': self.measurement_pdf.to_shared_memory()}
+        )
+
+    @classmethod
+    def from_shared_memory(cls, shared, rng=None, noise_rng=None):
+        """Creates a filter from a handle returned by `to_shared_memory`.
+        The CPU filter works directly on the shared arrays
+        until they are replaced by a prediction or resample.
+
+        Parameters
+        ----------
+        shared : shared_arrays.SharedArrays
+            The handle returned by `to_shared_memory`
+
+        rng : numpy.random.Generator, optional
+            The random number stream used for resampling
+
+        noise_rng : {numpy.random.Generator, cupy.random.RandomState}, optional
+            The random number stream used for the state noise
+
+        Returns
+        -------
+        filter : GaussianSumUnscentedKalmanFilter
+            The filter
+        """
+        new_filter = cls.__new__(cls)
+        new_filter._attach_shared_memory(shared, rng, noise_rng)
+        return new_filter
+
+    def _attach_shared_memory(self, shared, rng, noise_rng, library=numpy):
+        """Sets the filter's attributes from a handle returned by `to_shared_memory`"""
+        self._shared = shared
+        self.f = shared.attributes['f']
+        self.g = shared.attributes['g']
+        self.rng = numpy.random if rng is None else rng
+        self.qmc_noise = shared.attributes['qmc_noise']
+        self.vectorized = shared.attributes['vectorized']
+
+        self.means = shared['means']
+        self.covariances = shared['covariances']
+        self.weights = shared['weights']
+        self.N_particles, self._Nx = self.means.shape
+
+        self.state_pdf = gaussian_sum_dist.MultivariateGaussianSum.from_shared_memory(
+            shared.attributes['state_pdf'], library, noise_rng
+        )
+        self.measurement_pdf = gaussian_sum_dist.MultivariateGaussianSum.from_shared_memory(
+            shared.attributes['measurement_pdf'], library
+        )
+        self._Ny = self.measurement_pdf.means.shape[1]
+        self._set_sigma_weights()
+
 
 class ParallelGaussianSumUnscentedKalmanFilter(GaussianSumUnscentedKalmanFilter):
     """Gaussian Sum Unscented Kalman Filter class implemented to run on the GPU.
@@ -208,6 +308,14 @@ class ParallelGaussianSumUnscentedKalmanFilter(GaussianSumUnscentedKalmanFilter)
         Distributions for the state and measurement noise.
         Represented as Gaussian sums
 
+    rng : numpy.random.Generator, optional
+        The random number stream used for resampling.
+        Defaults to the global numpy random state
+
+    qmc, qmc_noise : bool, optional
+        Should quasi-Monte Carlo samples be used for the initial particles
+        and for the state noise, respectively
+
     Attributes
     -----------
     means : cupy.array
@@ -220,9 +328,13 @@ class ParallelGaussianSumUnscentedKalmanFilter(GaussianSumUnscentedKalmanFilter)
         A (N_particles) array containing the weights of the particles
     """
 
-    def __init__(self, f, g, N_particles, x0, state_pdf, measurement_pdf):
-        super().__init__(f, g, N_particles, x0, state_pdf, measurement_pdf)
+    def __init__(self, f, g, N_particles, x0, state_pdf, measurement_pdf,
+                 rng=None, qmc=False, qmc_noise=False):
+        super().__init__(f, g, N_particles, x0, state_pdf, measurement_pdf, rng, qmc, qmc_noise)
+        self._setup_device()
 
+    def _setup_device(self):
+        """Compiles the GPU functions and moves the data to the GPU"""
         self.f_vectorize = self.__f_vec()
         self.g_vectorize = self.__g_vec()
 
@@ -236,56 +348,31 @@ class ParallelGaussianSumUnscentedKalmanFilter(GaussianSumUnscentedKalmanFilter)
         self._blocks_per_grid = self._bpg = (self.N_particles - 1) // self._threads_per_block + 1
 
         self._y_dummy = cupy.zeros(
-            self.measurement_pdf.draw().shape[1],
+            self.measurement_pdf.means.shape[1],
             dtype=cupy.float32
         )
 
+    def _attach_shared_memory(self, shared, rng, noise_rng, library=cupy):
+        """Sets the filter's attributes from a handle returned by `to_shared_memory`.
+        The arrays are copied to the GPU"""
+        super()._attach_shared_memory(shared, rng, noise_rng, library)
+        self._setup_device()
+
     def __f_vec(self):
-        """Vectorizes the state transition function to run on the GPU
+        """Vectorizes the state transition function to run on the GPU.
+        The compiled function is shared by filters with the same `f`
         """
-        f_jit = cuda.jit(device=True)(self.f)
-
-        @numba.guvectorize(['void(f4[:], i4[:], i4, f4[:])',
-                            'void(f4[:], i8[:], i8, f4[:])',
-                            'void(f4[:], f4[:], f4, f4[:])',
-                            'void(f4[:], f8[:], f8, f4[:])'],
-                           '(n), (m), () -> (n)', target='cuda')
-        def f_vec(x, u, dt, _x_out):
-            ans = f_jit(x, u, dt)
-            for i in range(len(ans)):
-                _x_out[i] = ans[i]
-
-        return f_vec
+        if isinstance(self.f, model.kernels.ModelKernel):
+            return self.f.compile('cuda')
+        return model.kernels.get_kernel(self.f, 'transition', 'cuda')
 
     def __g_vec(self):
-        """Vectorizes the state observation function to run on the GPU
+        """Vectorizes the state observation function to run on the GPU.
+        The compiled function is shared by filters with the same `g`
         """
-        g_jit = cuda.jit(device=True)(self.g)
-
-        @numba.guvectorize(['void(f4[:], i4[:], f4[:], f4[:])',
-                            'void(f4[:], i8[:], f4[:], f4[:])',
-                            'void(f4[:], f4[:], f4[:], f4[:])',
-                            'void(f4[:], f8[:], f4[:], f4[:])'],
-                           '(n), (m), (p) -> (p)', target='cuda')
-        def g_vec(x, u, _y_dummy, _y_out):
-            ans = g_jit(x, u)
-            for i in range(len(ans)):
-                _y_out[i] = ans[i]
-
-        return g_vec
-
-    def __pdf_vec(self):
-        """Vectorizes the measurement probability density function
-        to run on the GPU
-        """
-        pdf_jit = cuda.jit(device=True)(self.measurement_pdf.pdf)
-
-        @numba.guvectorize(['void(f4[:], f4[:])'],
-                           '(n) -> (n)', target='cuda')
-        def pdf_vec(e, _pdf_out=None):
-            _pdf_out = pdf_jit(e)
-
-        return pdf_vec
+        if isinstance(self.g, model.kernels.ModelKernel):
+            return self.g.compile('cuda')
+        return model.kernels.get_kernel(self.g, 'observation', 'cuda')
 
     @staticmethod
     @cuda.jit
@@ -360,7 +447,7 @@ class ParallelGaussianSumUnscentedKalmanFilter(GaussianSumUnscentedKalmanFilter)
 
         # Move the sigma points through the state transition function
         sigmas += self.f_vectorize(sigmas, u, dt)
-        sigmas += self.state_pdf.draw((self.N_particles, self._N_sigmas))
+        sigmas += self.state_pdf.draw((self.N_particles, self._N_sigmas), self.qmc_noise)
 
         self.means = cupy.average(sigmas, axis=1, weights=self._w_sigma)
         sigmas -= self.means[:, None, :]
@@ -417,7 +504,7 @@ class ParallelGaussianSumUnscentedKalmanFilter(GaussianSumUnscentedKalmanFilter)
         cumsum /= cumsum[-1]
 
         sample_index = cupy.zeros(self.N_particles, dtype=cupy.int64)
-        random_number = cupy.float64(cupy.random.rand())
+        random_number = numpy.float64(self.rng.random())
 
         if self.N_particles >= 1024:
             threads_per_block = 1024
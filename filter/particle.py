@@ -1,9 +1,11 @@
 import numpy
-import numba
 import numba.cuda as cuda
 import torch
 import torch.utils.dlpack as torch_dlpack
 import cupy
+import gaussian_sum_dist
+import shared_arrays
+import model.kernels
 
 
 class ParticleFilter:
@@ -12,6 +14,12 @@ class ParticleFilter:
     It contains methods that allow the use to perform
     predictions, updates, and resampling.
 
+    A filter created with `from_shared_memory` does not copy the particle cloud.
+    Its predictions and updates change the shared particles and weights in place,
+    so every process attached to the same handle sees them,
+    until the first resample replaces them with the filter's own arrays.
+    Give each worker that steps a filter its own handle.
+
     Parameters
     ----------
     f : callable
@@ -31,6 +39,20 @@ class ParticleFilter:
         Distributions for the state and measurement noise.
         Represented as Gaussian sums
 
+    rng : numpy.random.Generator, optional
+        The random number stream used for resampling.
+        Defaults to the global numpy random state
+
+    qmc, qmc_noise : bool, optional
+        Should quasi-Monte Carlo samples be used for the initial particles
+        and for the state noise, respectively
+
+    vectorized : bool, optional
+        If `True` then `f` and `g` take (... x Nx) arrays of states
+        and return (... x Nx) and (... x N_outputs) arrays,
+        so that all the particles are evaluated in one call.
+        A model's bound kernels, see `model.NonlinearModel.bind`, work either way
+
     Attributes
     -----------
     particles : numpy.array
@@ -40,13 +62,17 @@ class ParticleFilter:
         A (N_particles) array containing the weights of the particles
     """
 
-    def __init__(self, f, g, N_particles, x0, state_pdf, measurement_pdf):
+    def __init__(self, f, g, N_particles, x0, state_pdf, measurement_pdf,
+                 rng=None, qmc=False, qmc_noise=False, vectorized=False):
 
         self.f = f
         self.g = g
         self.N_particles = int(N_particles)
+        self.rng = numpy.random if rng is None else rng
+        self.qmc_noise = qmc_noise
+        self.vectorized = vectorized
 
-        self.particles = x0.draw(N_particles)
+        self.particles = x0.draw(N_particles, qmc)
         self.weights = numpy.full(N_particles, 1 / N_particles, dtype=numpy.float32)
         self.state_pdf = state_pdf
         self.measurement_pdf = measurement_pdf
@@ -62,9 +88,12 @@ class ParticleFilter:
         dt : float
             The time step since the previous prediction
         """
-        for i, particle in enumerate(self.particles):
-            self.particles[i] += self.f(particle, u, dt)
-        self.particles += self.state_pdf.draw(self.N_particles)
+        if self.vectorized:
+            self.particles += self.f(self.particles, u, dt)
+        else:
+            for i, particle in enumerate(self.particles):
+                self.particles[i] += self.f(particle, u, dt)
+        self.particles += self.state_pdf.draw(self.N_particles, self.qmc_noise)
 
     def update(self, u, z):
         """Performs an update step on the particles
@@ -77,10 +106,13 @@ class ParticleFilter:
         z : numpy.array
             A (N_outputs) array of the current  measured outputs
         """
-        for i, particle in enumerate(self.particles):
-            y = self.g(particle, u)
-            e = z - y
-            self.weights[i] *= self.measurement_pdf.pdf(e)
+        if self.vectorized:
+            self.weights *= self.measurement_pdf.pdf(z - self.g(self.particles, u))
+        else:
+            for i, particle in enumerate(self.particles):
+                y = self.g(particle, u)
+                e = z - y
+                self.weights[i] *= self.measurement_pdf.pdf(e)
 
     def resample(self):
         """Performs a systematic resample of the particles
@@ -90,7 +122,7 @@ class ParticleFilter:
         cumsum /= cumsum[-1]
 
         sample_index_result = numpy.zeros(self.N_particles, dtype=numpy.int64)
-        r = numpy.random.rand()
+        r = self.rng.random()
         k = 0
 
         for i in range(self.N_particles):
@@ -113,6 +145,70 @@ class ParticleFilter:
         s = numpy.linalg.svd(cov, compute_uv=False)
         return s[0]
 
+    def to_shared_memory(self):
+        """Exports the particles, weights and noise distributions to shared memory
+        so that worker processes can attach to the particle cloud without copying.
+        `f` and `g` are pickled by reference, so they must be module level functions
+        or static methods.
+
+        Returns
+        -------
+        shared : shared_arrays.SharedArrays
+            A picklable handle to the filter
+        """
+        return shared_arrays.SharedArrays(
+            {'particles': self.particles, 'weights': self.weights},
+            {'f': self.f, 'g': self.g, 'qmc_noise': self.qmc_noise, 'vectorized': self.vectorized,
+             'state_pdf': self.state_pdf.to_shared_memory(),
+             'measurement_pdf': self.measurement_pdf.to_shared_memory()}
+        )
+
+    @classmethod
+    def from_shared_memory(cls, shared, rng=None, noise_rng=None):
+        """Creates a filter from a handle returned by `to_shared_memory`.
+        The CPU filter works directly on the shared particles and weights
+        until the first resample.
+
+        Parameters
+        ----------
+        shared : shared_arrays.SharedArrays
+            The handle returned by `to_shared_memory`
+
+        rng : numpy.random.Generator, optional
+            The random number stream used for resampling
+
+        noise_rng : {numpy.random.Generator, cupy.random.RandomState}, optional
+            The random number stream used for the state noise
+
+        Returns
+        -------
+        filter : ParticleFilter
+            The filter
+        """
+        new_filter = cls.__new__(cls)
+        new_filter._attach_shared_memory(shared, rng, noise_rng)
+        return new_filter
+
+    def _attach_shared_memory(self, shared, rng, noise_rng, library=numpy):
+        """Sets the filter's attributes from a handle returned by `to_shared_memory`"""
+        self._shared = shared
+        self.f = shared.attributes['f']
+        self.g = shared.attributes['g']
+        self.rng = numpy.random if rng is None else rng
+        self.qmc_noise = shared.attributes['qmc_noise']
+        self.vectorized = shared.attributes['vectorized']
+
+        self.particles = shared['particles']
+        self.weights = shared['weights']
+        self.N_particles = self.particles.shape[0]
+
+        self.state_pdf = gaussian_sum_dist.MultivariateGaussianSum.from_shared_memory(
+            shared.attributes['state_pdf'], library, noise_rng
+        )
+        self.measurement_pdf = gaussian_sum_dist.MultivariateGaussianSum.from_shared_memory(
+            shared.attributes['measurement_pdf'], library
+        )
+
 
 class ParallelParticleFilter(ParticleFilter):
     """Particle filter class implemented to run on the GPU.
@@ -139,6 +235,14 @@ class ParallelParticleFilter(ParticleFilter):
         Distributions for the state and measurement noise.
         Represented as Gaussian sums
 
+    rng : numpy.random.Generator, optional
+        The random number stream used for resampling.
+        Defaults to the global numpy random state
+
+    qmc, qmc_noise : bool, optional
+        Should quasi-Monte Carlo samples be used for the initial particles
+        and for the state noise, respectively
+
     Attributes
     -----------
     particles : cupy.array
@@ -148,9 +252,13 @@ class ParallelParticleFilter(ParticleFilter):
         A (N_particles) array containing the weights of the particles
     """
 
-    def __init__(self, f, g, N_particles, x0, state_pdf, measurement_pdf):
-        super().__init__(f, g, N_particles, x0, state_pdf, measurement_pdf)
+    def __init__(self, f, g, N_particles, x0, state_pdf, measurement_pdf,
+                 rng=None, qmc=False, qmc_noise=False):
+        super().__init__(f, g, N_particles, x0, state_pdf, measurement_pdf, rng, qmc, qmc_noise)
+        self._setup_device()
 
+    def _setup_device(self):
+        """Compiles the GPU functions and moves the data to the GPU"""
         self.f_vectorize = self.__f_vec()
         self.g_vectorize = self.__g_vec()
 
@@ -169,56 +277,31 @@ class ParallelParticleFilter(ParticleFilter):
         self._bpg = blocks_per_grid
 
         self._y_dummy = cupy.zeros(
-            self.measurement_pdf.draw().shape[1],
+            self.measurement_pdf.means.shape[1],
             dtype=cupy.float32
         )
 
+    def _attach_shared_memory(self, shared, rng, noise_rng, library=cupy):
+        """Sets the filter's attributes from a handle returned by `to_shared_memory`.
+        The particles and weights are copied to the GPU"""
+        super()._attach_shared_memory(shared, rng, noise_rng, library)
+        self._setup_device()
+
     def __f_vec(self):
-        """Vectorizes the state transition function to run on the GPU
+        """Vectorizes the state transition function to run on the GPU.
+        The compiled function is shared by filters with the same `f`
         """
-        f_jit = cuda.jit(device=True)(self.f)
-
-        @numba.guvectorize(['void(f4[:], i4[:], i4, f4[:])',
-                            'void(f4[:], i8[:], i8, f4[:])',
-                            'void(f4[:], f4[:], f4, f4[:])',
-                            'void(f4[:], f8[:], f8, f4[:])'],
-                           '(n), (m), () -> (n)', target='cuda')
-        def f_vec(x, u, dt, _x_out):
-            ans = f_jit(x, u, dt)
-            for i in range(len(ans)):
-                _x_out[i] = ans[i]
-
-        return f_vec
+        if isinstance(self.f, model.kernels.ModelKernel):
+            return self.f.compile('cuda')
+        return model.kernels.get_kernel(self.f, 'transition', 'cuda')
 
     def __g_vec(self):
-        """Vectorizes the state observation function to run on the GPU
+        """Vectorizes the state observation function to run on the GPU.
+        The compiled function is shared by filters with the same `g`
         """
-        g_jit = cuda.jit(device=True)(self.g)
-
-        @numba.guvectorize(['void(f4[:], i4[:], f4[:], f4[:])',
-                            'void(f4[:], i8[:], f4[:], f4[:])',
-                            'void(f4[:], f4[:], f4[:], f4[:])',
-                            'void(f4[:], f8[:], f4[:], f4[:])'],
-                           '(n), (m), (p) -> (p)', target='cuda')
-        def g_vec(x, u, _y_dummy, _y_out):
-            ans = g_jit(x, u)
-            for i in range(len(ans)):
-                _y_out[i] = ans[i]
-
-        return g_vec
-
-    def __pdf_vec(self):
-        """Vectorizes the measurement probability density function
-        to run on the GPU
-        """
-        pdf_jit = cuda.jit(device=True)(self.measurement_pdf.pdf)
-
-        @numba.guvectorize(['void(f4[:], f4[:])'],
-                           '(n) -> (n)', target='cuda')
-        def pdf_vec(e, _pdf_out=None):
-            _pdf_out = pdf_jit(e)
-
-        return pdf_vec
+        if isinstance(self.g, model.kernels.ModelKernel):
+            return self.g.compile('cuda')
+        return model.kernels.get_kernel(self.g, 'observation', 'cuda')
 
     @staticmethod
     @cuda.jit
@@ -274,7 +357,7 @@ class ParallelParticleFilter(ParticleFilter):
             The time step since the previous prediction
         """
         self.particles += self.f_vectorize(self.particles, u, dt)
-        self.particles += self.state_pdf.draw(self.N_particles)
+        self.particles += self.state_pdf.draw(self.N_particles, self.qmc_noise)
 
     def update(self, u, z):
         """Performs an update step on the particles
@@ -304,7 +387,7 @@ class ParallelParticleFilter(ParticleFilter):
         cumsum /= cumsum[-1]
 
         sample_index = cupy.zeros(self.N_particles, dtype=cupy.int64)
-        random_number = cupy.float64(cupy.random.rand())
+        random_number = numpy.float64(self.rng.random())
 
         ParallelParticleFilter._parallel_resample[self._bpg, self._tpb](
             cumsum, sample_index,
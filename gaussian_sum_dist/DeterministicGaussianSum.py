@@ -22,14 +22,20 @@ class DeterministicGaussianSum(gaussian_sum_dist.MultivariateGaussianSum):
         The library to be used for array operations.
         numpy is used for CPU implementations.
         cupy is used for GPU implementations
+
+    rng : {numpy.random.Generator, cupy.random.RandomState}, optional
+        The random number stream used to fill the shared values
+
+    covariance_type : {None, 'full', 'diagonal', 'isotropic'}, optional
+        The structure of the covariances
     """
 
     __values = numpy.array([], dtype=numpy.float32)
 
-    def __init__(self,  means, covariances, weights, library=cupy):
-        super().__init__(means, covariances, weights, library)
+    def __init__(self,  means, covariances, weights, library=cupy, rng=None, covariance_type=None):
+        super().__init__(means, covariances, weights, library, rng, covariance_type)
 
-    def draw(self, shape=(1, )):
+    def draw(self, shape=(1, ), qmc=False):
         """Draw samples from the distribution
 
         Parameters
@@ -37,6 +43,9 @@ class DeterministicGaussianSum(gaussian_sum_dist.MultivariateGaussianSum):
         shape : {int, tuple} (optional)
             Output shape
 
+        qmc : bool, optional
+            Passed on when new values have to be drawn
+
         Returns
         -------
         out : library.array
@@ -48,7 +57,7 @@ class DeterministicGaussianSum(gaussian_sum_dist.MultivariateGaussianSum):
         size = int(numpy.prod(shape)) * self._Nx
 
         if DeterministicGaussianSum.__values.size < size:
-            drawn_vals = super().draw(size - DeterministicGaussianSum.__values.size)
+            drawn_vals = super().draw(size - DeterministicGaussianSum.__values.size, qmc)
 
             if self.lib == cupy:
                 drawn_vals = drawn_vals.get()
@@ -1,6 +1,10 @@
 import warnings
 import numpy
 import cupy
+import scipy.special
+import scipy.stats.qmc
+import gaussian_sum_dist.kernels
+import shared_arrays
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 
@@ -22,22 +26,149 @@ class MultivariateGaussianSum:
         The library to be used for array operations.
         numpy is used for CPU implementations.
         cupy is used for GPU implementations
+
+    rng : {numpy.random.Generator, cupy.random.RandomState}, optional
+        The random number stream used to draw samples.
+        Must belong to `library`.
+        Defaults to the global random state of `library`.
+        See `sim_base.spawn_rngs` for creating independent streams
+
+    covariance_type : {None, 'full', 'diagonal', 'isotropic'}, optional
+        The structure of the covariances.
+        'diagonal' and 'isotropic' covariances are sampled and evaluated
+        elementwise instead of with dense matrix operations.
+        If `None` then the structure is detected from `covariances`
+
+    Attributes
+    -----------
+    covariance_type : {'full', 'diagonal', 'isotropic'}
+        The structure of the covariances
     """
 
-    def __init__(self, means, covariances, weights, library=cupy):
+    def __init__(self, means, covariances, weights, library=cupy, rng=None, covariance_type=None):
         self.lib = library
+        self.rng = self.lib.random if rng is None else rng
         self.means = self.lib.asarray(means, dtype=self.lib.float32)
         self.weights = self.lib.asarray(weights, dtype=self.lib.float32)
         self.covariances = self.lib.asarray(covariances, dtype=self.lib.float32)
-
-        self._inverse_covariances = self.lib.asarray(numpy.linalg.inv(covariances))
         self._Nd, self._Nx = means.shape
 
-        self._constants = (2 * self.lib.pi) ** (-self._Nx / 2) / self.lib.sqrt(
-            self.lib.linalg.det(self.covariances))
+        detected_type = MultivariateGaussianSum._covariance_type(covariances)
+        valid_types = {
+            'full': ['full'],
+            'diagonal': ['full', 'diagonal'],
+            'isotropic': ['full', 'diagonal', 'isotropic']
+        }[detected_type]
+        if covariance_type is None:
+            covariance_type = detected_type
+        elif covariance_type not in valid_types:
+            raise ValueError(f'Covariance type {covariance_type} is not valid for the given covariances')
+        self.covariance_type = covariance_type
+
+        if self.covariance_type == 'full':
+            self._inverse_covariances = self.lib.asarray(numpy.linalg.inv(covariances))
+            self._factors = self.lib.asarray(numpy.linalg.cholesky(covariances), dtype=self.lib.float32)
+            self._constants = (2 * self.lib.pi) ** (-self._Nx / 2) / self.lib.sqrt(
+                self.lib.linalg.det(self.covariances))
+        else:
+            variances = numpy.diagonal(covariances, axis1=1, axis2=2)
+            if self.covariance_type == 'isotropic':
+                variances = variances[:, :1]
+            self._inverse_variances = self.lib.asarray(1 / variances, dtype=self.lib.float32)
+            self._factors = self.lib.asarray(numpy.sqrt(variances), dtype=self.lib.float32)
+            determinants = numpy.prod(numpy.broadcast_to(variances, (self._Nd, self._Nx)), axis=1)
+            self._constants = self.lib.asarray(
+                (2 * numpy.pi) ** (-self._Nx / 2) / numpy.sqrt(determinants),
+                dtype=self.lib.float32
+            )
+
+    @staticmethod
+    def _covariance_type(covariances):
+        """Detects the structure of the covariances
+
+        Parameters
+        ----------
+        covariances : numpy.array
+            A (N_distributions x Nx x Nx) array of the covariance for each Gaussian
+
+        Returns
+        -------
+        covariance_type : {'full', 'diagonal', 'isotropic'}
+            The most specific structure the covariances have
+        """
+        covariances = numpy.asarray(covariances)
+        variances = numpy.diagonal(covariances, axis1=1, axis2=2)
+        if numpy.any(covariances != variances[:, :, None] * numpy.eye(covariances.shape[-1])):
+            return 'full'
+        if numpy.all(variances == variances[:, :1]):
+            return 'isotropic'
+        return 'diagonal'
+
+    def to_shared_memory(self):
+        """Exports the distribution to shared memory so that other processes
+        can attach to it without copying
+
+        Returns
+        -------
+        shared : shared_arrays.SharedArrays
+            A picklable handle to the distribution's arrays
+        """
+        return shared_arrays.SharedArrays(
+            {'means': self.means, 'covariances': self.covariances, 'weights': self.weights},
+            {'covariance_type': self.covariance_type}
+        )
+
+    @classmethod
+    def from_shared_memory(cls, shared, library=numpy, rng=None):
+        """Creates a distribution from arrays exported by `to_shared_memory`.
+        With numpy as the library the means, covariances and weights are views
+        of the shared memory blocks.
+
+        Parameters
+        ----------
+        shared : shared_arrays.SharedArrays
+            The handle returned by `to_shared_memory`
+
+        library : {numpy, cupy}, optional
+            The library to be used for array operations
+
+        rng : {numpy.random.Generator, cupy.random.RandomState}, optional
+            The random number stream used to draw samples
+
+        Returns
+        -------
+        distribution : MultivariateGaussianSum
+            The distribution
+        """
+        distribution = cls(
+            shared['means'], shared['covariances'], shared['weights'],
+            library, rng, shared.attributes['covariance_type']
+        )
+        distribution._shared = shared
+        return distribution
+
+    def _exponents(self, x):
+        """Returns the (m x N_distributions) Mahalanobis distances of the points from each Gaussian"""
+        es = x[:, None, :] - self.means[None, :, :]
+
+        if self.covariance_type != 'full':
+            return self.lib.sum(es**2 * self._inverse_variances[None, :, :], axis=2)
+
+        # The code below does: exp[i] = es[i].T @ self.inverse_covariances_device[i] @ es[i]
+        exp = es[:, :, None, :] @ self._inverse_covariances[None, :, :, :] @ es[:, :, :, None]
+        return exp[:, :, 0, 0]
+
+    def _kernel_arguments(self):
+        """Returns the distribution parameters in the form the compiled CPU kernels take"""
+        if self.covariance_type == 'full':
+            scales = self._inverse_covariances
+        else:
+            scales = self._inverse_variances
+        return [numpy.asarray(a, dtype=numpy.float64) for a in [self.means, scales, self._constants, self.weights]]
 
     def pdf(self, x):
         """Get the value of the probability density function evaluated at a point.
+        Uses the compiled parallel CPU kernel when the library is numpy.
 
         Parameters
         ----------
@@ -51,25 +182,56 @@ class MultivariateGaussianSum:
 
         """
         x = self.lib.atleast_2d(x)
-        es = x[:, None, :] - self.means[None, :, :]
 
-        # The code below does: exp[i] = es[i].T @ self.inverse_covariances_device[i] @ es[i]
-        exp = es[:, :, None, :] @ self._inverse_covariances[None, :, :, :] @ es[:, :, :, None]
-        r = self.lib.exp(-0.5*exp).squeeze()
+        if self.lib is numpy:
+            kernel = gaussian_sum_dist.kernels.get_kernel('pdf', self.covariance_type)
+            return kernel(numpy.asarray(x, dtype=numpy.float64), *self._kernel_arguments())
+
+        r = self.lib.exp(-0.5*self._exponents(x))
 
         # The code below does: result = sum(r[i] * self.weights_device[i] * self.constants_device[i])
-        result = numpy.sum(self.lib.atleast_2d(self._constants * self.weights * r), axis=1)
+        result = self.lib.sum(self._constants * self.weights * r, axis=1)
 
         return result
 
-    def draw(self, shape=(1,)):
-        """Draw samples from the distribution
+    def logpdf(self, x):
+        """Get the natural logarithm of the probability density function evaluated at a point.
+        Does not underflow for points far away from all the Gaussians.
+        Uses the compiled parallel CPU kernel when the library is numpy.
+
+        Parameters
+        ----------
+        x : library.array
+            A (m x Nx) array of points at which to evaluate the log pdf
+
+        Returns
+        -------
+        result : library.array
+            A (m) array of log pdf values
+        """
+        x = self.lib.atleast_2d(x)
+
+        if self.lib is numpy:
+            kernel = gaussian_sum_dist.kernels.get_kernel('logpdf', self.covariance_type)
+            return kernel(numpy.asarray(x, dtype=numpy.float64), *self._kernel_arguments())
+
+        terms = self.lib.log(self._constants * self.weights) - 0.5*self._exponents(x)
+        largest = self.lib.max(terms, axis=1)
+        return largest + self.lib.log(self.lib.sum(self.lib.exp(terms - largest[:, None]), axis=1))
+
+    def draw(self, shape=(1,), qmc=False):
+        """Draw samples from the distribution.
+        Uses the compiled parallel CPU kernel when the library is numpy.
 
         Parameters
         ----------
         shape : {int, tuple} (optional)
             Output shape
 
+        qmc : bool, optional
+            If `True` then scrambled Sobol points are used instead of pseudo-random numbers.
+            Samples are allocated to the Gaussians in proportion to their weights
+
         Returns
         -------
         out : library.array
@@ -79,19 +241,111 @@ class MultivariateGaussianSum:
             shape = (shape,)
 
         size = int(numpy.prod(shape))
-        bins = self.lib.bincount(
-            self.lib.random.choice(
-                self.lib.arange(self._Nd),
-                size,
-                p=self.weights
-            ),
-            minlength=self._Nd
-        )
-        out = self.lib.empty((size, self._Nx), dtype=self.lib.float32)
+        if qmc:
+            bins = self._stratified_bins(size)
+            zs = self._sobol_normals(bins)
+        else:
+            bins = self.lib.bincount(
+                self.rng.choice(
+                    self.lib.arange(self._Nd),
+                    size,
+                    p=self.weights
+                ),
+                minlength=self._Nd
+            ).tolist()
+            zs = self.rng.standard_normal((size, self._Nx))
+
+        return self._transform(zs, bins).reshape(shape + (self._Nx,))
+
+    def _transform(self, zs, bins):
+        """Maps standard normal samples onto the Gaussians
+        with their Cholesky factors (or standard deviations)
+
+        Parameters
+        ----------
+        zs : library.array
+            A (size x Nx) array of standard normal samples
+
+        bins : list
+            The number of samples for each Gaussian
+
+        Returns
+        -------
+        out : library.array
+            A (size x Nx) array of samples
+        """
+        if self.lib is numpy:
+            kernel = gaussian_sum_dist.kernels.get_kernel('draw', self.covariance_type)
+            components = numpy.repeat(numpy.arange(self._Nd), bins)
+            out = kernel(
+                numpy.asarray(zs, dtype=numpy.float64),
+                components,
+                numpy.asarray(self.means, dtype=numpy.float64),
+                numpy.asarray(self._factors, dtype=numpy.float64)
+            )
+            return out.astype(numpy.float32)
 
+        zs = self.lib.asarray(zs, dtype=self.lib.float32)
+        out = self.lib.empty((zs.shape[0], self._Nx), dtype=self.lib.float32)
         index = 0
-        for n, mean, cov in zip(bins, self.means, self.covariances):
-            out[index:index + n] = self.lib.random.multivariate_normal(mean, cov, int(n))
+        for n, mean, factor in zip(bins, self.means, self._factors):
+            if self.covariance_type == 'full':
+                out[index:index + n] = mean + zs[index:index + n] @ factor.T
+            else:
+                out[index:index + n] = mean + zs[index:index + n] * factor
             index += n
 
-        return out.reshape(shape + (self._Nx,))
+        return out
+
+    def _stratified_bins(self, size):
+        """Allocates samples to the Gaussians in proportion to their weights.
+        Each Gaussian gets the floor of its expected count,
+        with the remainder going to the largest fractional parts
+
+        Parameters
+        ----------
+        size : int
+            Number of samples
+
+        Returns
+        -------
+        bins : list
+            The number of samples for each Gaussian
+        """
+        expected = numpy.asarray(self.weights.tolist()) * size / float(self.weights.sum())
+        bins = numpy.floor(expected).astype(numpy.int64)
+        remainder = numpy.argsort(bins - expected)[:size - bins.sum()]
+        bins[remainder] += 1
+        return bins.tolist()
+
+    def _sobol_normals(self, bins):
+        """Returns quasi-random standard normal samples.
+        Scrambled Sobol points for each Gaussian are mapped through the inverse normal CDF.
+
+        Parameters
+        ----------
+        bins : list
+            The number of samples for each Gaussian
+
+        Returns
+        -------
+        zs : numpy.array
+            A (sum(bins) x Nx) array of standard normal samples
+        """
+        if isinstance(self.rng, numpy.random.Generator):
+            seeds = [self.rng] * len(bins)
+        else:
+            # Each Gaussian gets its own child of one seed, so their scramblings are independent
+            entropy = int(self.rng.randint(0, 2**31 - 1))
+            seeds = [numpy.random.default_rng(child) for child in numpy.random.SeedSequence(entropy).spawn(len(bins))]
+
+        zs = []
+        for n, seed in zip(bins, seeds):
+            sobol = scipy.stats.qmc.Sobol(self._Nx, scramble=True, seed=seed)
+            with warnings.catch_warnings():
+                # Balance is best for powers of two, but any size is valid
+                warnings.simplefilter('ignore', category=UserWarning)
+                points = sobol.random(n)
+            zs.append(scipy.special.ndtri(numpy.clip(points, 1e-10, 1 - 1e-10)))
+
+        return numpy.vstack(zs)
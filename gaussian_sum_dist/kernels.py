@@ -0,0 +1,126 @@
+"""Compiled CPU kernels for Gaussian sums.
+
+The kernels are numba generalised ufuncs that run in parallel over all points.
+Each point is processed in registers, so no (m x N_distributions x Nx)
+temporaries are created.
+Kernels are compiled the first time they are requested by `get_kernel`.
+"""
+import math
+import functools
+import numba
+import numpy
+
+
+def _full_exponent(x, means, inverse_covariances, j):
+    """Returns the Mahalanobis distance of `x` from Gaussian `j`"""
+    exponent = 0.
+    for a in range(x.shape[0]):
+        e_a = x[a] - means[j, a]
+        for b in range(x.shape[0]):
+            exponent += e_a * inverse_covariances[j, a, b] * (x[b] - means[j, b])
+    return exponent
+
+
+def _diagonal_exponent(x, means, inverse_variances, j):
+    """Returns the Mahalanobis distance of `x` from Gaussian `j`.
+    `inverse_variances` has either Nx columns or a single (isotropic) column"""
+    exponent = 0.
+    k = inverse_variances.shape[1]
+    for a in range(x.shape[0]):
+        e_a = x[a] - means[j, a]
+        exponent += e_a * e_a * inverse_variances[j, a % k]
+    return exponent
+
+
+def _pdf(exponent_fun):
+    """Creates a pdf kernel from a Mahalanobis distance function"""
+    def pdf(x, means, scales, constants, weights, out):
+        total = 0.
+        for j in range(means.shape[0]):
+            total += weights[j] * constants[j] * math.exp(-0.5 * exponent_fun(x, means, scales, j))
+        out[0] = total
+
+    return pdf
+
+
+def _logpdf(exponent_fun):
+    """Creates a log-pdf kernel from a Mahalanobis distance function.
+    Uses the log-sum-exp trick so that far away points do not underflow"""
+    def logpdf(x, means, scales, constants, weights, out):
+        # The log terms are kept so that each exponent is only computed once
+        terms = numpy.empty(means.shape[0])
+        largest = -math.inf
+        for j in range(means.shape[0]):
+            terms[j] = math.log(weights[j] * constants[j]) - 0.5 * exponent_fun(x, means, scales, j)
+            largest = max(largest, terms[j])
+
+        total = 0.
+        for j in range(means.shape[0]):
+            total += math.exp(terms[j] - largest)
+        out[0] = largest + math.log(total)
+
+    return logpdf
+
+
+def _full_draw(z, component, means, factors, out):
+    """Transforms standard normal samples `z` with the Cholesky factor of Gaussian `component`"""
+    j = component[0]
+    for a in range(z.shape[0]):
+        total = means[j, a]
+        for b in range(a + 1):
+            total += factors[j, a, b] * z[b]
+        out[a] = total
+
+
+def _diagonal_draw(z, component, means, factors, out):
+    """Scales standard normal samples `z` with the standard deviations of Gaussian `component`"""
+    j = component[0]
+    k = factors.shape[1]
+    for a in range(z.shape[0]):
+        out[a] = means[j, a] + factors[j, a % k] * z[a]
+
+
+_density_signature = ['void(f8[:], f8[:, :], f8[:, :, :], f8[:], f8[:], f8[:])',
+                      '(n), (d, n), (d, n, n), (d), (d) -> ()']
+_diagonal_density_signature = ['void(f8[:], f8[:, :], f8[:, :], f8[:], f8[:], f8[:])',
+                               '(n), (d, n), (d, k), (d), (d) -> ()']
+_draw_signature = ['void(f8[:], i8[:], f8[:, :], f8[:, :, :], f8[:])',
+                   '(n), (), (d, n), (d, n, n) -> (n)']
+_diagonal_draw_signature = ['void(f8[:], i8[:], f8[:, :], f8[:, :], f8[:])',
+                            '(n), (), (d, n), (d, k) -> (n)']
+
+_kernels = {
+    ('pdf', 'full'): (lambda: _pdf(numba.njit(_full_exponent)), _density_signature),
+    ('pdf', 'diagonal'): (lambda: _pdf(numba.njit(_diagonal_exponent)), _diagonal_density_signature),
+    ('logpdf', 'full'): (lambda: _logpdf(numba.njit(_full_exponent)), _density_signature),
+    ('logpdf', 'diagonal'): (lambda: _logpdf(numba.njit(_diagonal_exponent)), _diagonal_density_signature),
+    ('draw', 'full'): (lambda: _full_draw, _draw_signature),
+    ('draw', 'diagonal'): (lambda: _diagonal_draw, _diagonal_draw_signature),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_kernel(operation, covariance_type):
+    """Returns a compiled kernel, compiling it on first use
+
+    Parameters
+    ----------
+    operation : {'pdf', 'logpdf', 'draw'}
+        The operation the kernel performs.
+        The 'pdf' and 'logpdf' kernels take the points, means, inverse covariances
+        (or inverse variances), normalising constants and weights.
+        The 'draw' kernel takes standard normal samples, the Gaussian index of each sample,
+        the means and the Cholesky factors (or standard deviations)
+
+    covariance_type : {'full', 'diagonal', 'isotropic'}
+        The structure of the covariances
+
+    Returns
+    -------
+    kernel : numba.np.ufunc.gufunc.GUFunc
+        The parallel generalised ufunc
+    """
+    if covariance_type == 'isotropic':
+        covariance_type = 'diagonal'
+    make_kernel, (signature, layout) = _kernels[operation, covariance_type]
+    return numba.guvectorize([signature], layout, target='parallel', nopython=True)(make_kernel())
@@ -0,0 +1,117 @@
+import numpy
+import model
+import model.kernels
+
+
+class BioreactorFleet(model.Bioreactor):
+    """A fleet of bioreactors that are simulated together.
+    The states of all the reactors are held in one array and every step
+    updates all of them with one evaluation of the array versions of the
+    differential equations per integrator stage.
+    The other methods of `model.Bioreactor`, such as `step`, `raw_outputs`,
+    `add_noise` and `measured_outputs`, work on the whole fleet.
+    A fleet created from a single (5) state behaves like one `model.Bioreactor`
+
+    Parameters
+    ----------
+    X0 : numpy.array
+        A (N_reactors x 5) array of initial states,
+        or a (5) state that is copied to each reactor
+
+    t : float, optional
+        Current time.
+        Defaults to zero
+
+    high_N : {bool, numpy.array}, optional
+        A flag, or a (N_reactors) array of flags per reactor,
+        setting whether the reactors are in the high or low nitrogen regime
+
+    integrator : {'euler', 'heun', 'rk4', 'rk23', callable}, optional
+        The method `step` integrates the differential equations with.
+        See `model.integrators`
+
+    substeps : int, optional
+        Number of integrator steps per call to `step`
+
+    N_reactors : int, optional
+        Number of copies of a single initial state
+
+    Attributes
+    -----------
+    X : numpy.array
+        A (N_reactors x 5) array of current states
+    """
+    def __init__(self, X0, t=0, high_N=True, integrator='euler', substeps=1, N_reactors=None):
+        X0 = numpy.array(X0, dtype=numpy.float64)
+        if N_reactors is not None:
+            X0 = numpy.tile(X0, (N_reactors, 1))
+        super().__init__(X0, t=t, high_N=high_N, integrator=integrator, substeps=substeps)
+
+    @property
+    def N_reactors(self):
+        """The number of reactors, or `None` for a fleet with a single (5) state"""
+        return self.X.shape[0] if self.X.ndim > 1 else None
+
+    def DEs(self, inputs):
+        """Evaluates the differential equations of all the reactors.
+        See `model.Bioreactor.DEs`
+
+        Parameters
+        ----------
+        inputs : numpy.array
+            A (2) array of inputs for all the reactors,
+            or a (N_reactors x 2) array of inputs per reactor
+
+        Returns
+        -------
+        dX : numpy.array
+            A (N_reactors x 5) array of the differential changes to the states
+        """
+        return self.batch_DEs(self.X, inputs)
+
+    def outputs(self, inputs):
+        """Returns the outputs of all the reactors.
+        See `model.Bioreactor.outputs`
+
+        Parameters
+        ----------
+        inputs : numpy.array
+            A (2) array of inputs for all the reactors,
+            or a (N_reactors x 2) array of inputs per reactor
+
+        Returns
+        -------
+        outputs : numpy.array
+            A (N_reactors x 5) array of the outputs
+        """
+        # The outputs do not depend on the regimes, which the fleet holds per reactor
+        return model.kernels.batched(self.output, self.X, inputs, ())
+
+    def batch_DEs(self, xs, us):
+        """Array version of `DEs`.
+        Per reactor regimes need (N_reactors x 5) states
+
+        Parameters
+        ----------
+        xs : numpy.array
+            A (... x 5) array of states
+
+        us : numpy.array
+            A (... x 2) array of inputs that broadcasts with the states
+
+        Returns
+        -------
+        dXs : numpy.array
+            A (... x 5) array of the differential changes to the states
+        """
+        high_N = numpy.asarray(self.high_N)
+        if not numpy.any(high_N):
+            return model.Bioreactor.batch_homeostatic_DEs(xs, us)
+        if numpy.all(high_N):
+            return model.Bioreactor.batch_high_N_DEs(xs, us)
+
+        return numpy.where(
+            high_N[:, None],
+            model.Bioreactor.batch_high_N_DEs(xs, us),
+            model.Bioreactor.batch_homeostatic_DEs(xs, us)
+        )
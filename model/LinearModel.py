@@ -1,7 +1,8 @@
 import numpy
-import scipy.signal
+import scipy.linalg
 
 import model
+import model.dual
 
 
 class LinearModel:
@@ -27,6 +28,10 @@ class LinearModel:
     f_bar, y_bar : array-lke
         The constants at linearisation
 
+    continuous : tuple, optional
+        The continuous time matrices `(A, B, C, D)` that the model was discretised from,
+        which allows it to be discretised again with `discretize`
+
     Attributes
     -----------
     A, B, C, D : array-like
@@ -46,7 +51,7 @@ class LinearModel:
 
     """
     def __init__(self, A, B, C, D, dt,
-                 x_bar, u_bar, f_bar, y_bar):
+                 x_bar, u_bar, f_bar, y_bar, continuous=None):
         A, B, C, D = [numpy.atleast_2d(m) for m in [A, B, C, D]]
         self.A = A
         self.B = B
@@ -67,9 +72,52 @@ class LinearModel:
         self.inputs = range(self.Ni)
         self.outputs = range(self.No)
 
+        self._hold = None
+        if continuous is not None:
+            self._hold = _ZeroOrderHold(*continuous, x_bar, u_bar, f_bar, y_bar)
+
+    @staticmethod
+    def _from_continuous(A, B, C, D, T, x_bar, u_bar, f_bar, y_bar):
+        """Returns the model discretised with a zero order hold, that can be discretised again"""
+        linear_model = model.LinearModel(A, B, C, D, T, x_bar, u_bar, f_bar, y_bar, continuous=(A, B, C, D))
+        return linear_model.discretize(T)
+
+    def discretize(self, T):
+        """Returns the model discretised with a zero order hold at another sampling interval.
+        The continuous time system's matrix is diagonalised once and the
+        decomposition is shared by all the discretised models, so that each
+        sampling interval only costs the exponentials of the eigenvalues.
+        The selected subset of the states, inputs and outputs is kept
+
+        Parameters
+        ----------
+        T : float
+            The sampling interval
+
+        Returns
+        -------
+        linear_model : model.LinearModel
+            The discrete model
+        """
+        if self._hold is None:
+            raise ValueError('The model has no continuous time matrices to discretise')
+
+        hold = self._hold
+        Ad, Bd = hold(T)
+        C, D, x_bar, u_bar, f_bar, y_bar = [numpy.array(a, copy=True) for a in
+                                            [hold.C, hold.D, hold.x_bar, hold.u_bar, hold.f_bar, hold.y_bar]]
+        linear_model = model.LinearModel(Ad, Bd, C, D, T, x_bar, u_bar, f_bar, y_bar)
+        linear_model._hold = hold
+
+        full = [range(n) for n in [linear_model.Nx, linear_model.Ni, linear_model.No]]
+        subsets = [self.states, self.inputs, self.outputs]
+        if any(list(subset) != list(r) for subset, r in zip(subsets, full)):
+            linear_model.select_subset(*subsets)
+        return linear_model
+
     @staticmethod
     def create_LinearModel(nonlinear_model: model.NonlinearModel,
-                           x_bar, u_bar, T):
+                           x_bar, u_bar, T, method='finite_difference'):
         """Linearise a non-linear model about an operating point to give
         a linear state space model
 
@@ -88,11 +136,31 @@ class LinearModel:
         T : float
             The sampling interval
 
+        method : {'finite_difference', 'batch_difference', 'dual'}, optional
+            How the Jacobians are calculated.
+            'finite_difference' uses central differences, halving the step until they converge.
+            'batch_difference' evaluates the central differences of all the columns
+            for a sequence of halved steps in one call of the model's `batch_DEs`
+            and `batch_outputs`, and picks the best converged Richardson extrapolate per column.
+            'dual' evaluates the model's `DEs` and `outputs` once on dual numbers
+            to get exact Jacobians, see `model.dual`.
+            The model equations then have to be written with arithmetic,
+            the builtin `max` and `min` and numpy functions
+
         Returns
         -------
         linear_model : model.LinearModel
             The linear model of the system
         """
+        if method in ['dual', 'batch_difference']:
+            if method == 'dual':
+                jacobians = LinearModel._dual_jacobians(nonlinear_model, x_bar, u_bar)
+            else:
+                jacobians = LinearModel._batch_difference_jacobians(nonlinear_model, x_bar, u_bar)
+            (A, B), (C, D), f_bar, y_bar = jacobians
+            return LinearModel._from_continuous(A, B, C, D, T, x_bar, u_bar, f_bar, y_bar)
+        if method != 'finite_difference':
+            raise ValueError(f'Unknown linearisation method {method}')
 
         def max_norm_error_close(g, tol=1e-8, x=0.1):
             """Takes in a function :math:`g` that takes in a
@@ -135,14 +203,93 @@ class LinearModel:
                 matrices[i][j] = numpy.array(matrix).T
 
         (A, B), (C, D) = matrices
-        Ad, Bd, Cd, Dd, _ = scipy.signal.cont2discrete((A, B, C, D), T)
         f_bar = nonlinear_model.DEs(u_bar)
         y_bar = nonlinear_model.outputs(u_bar)
-        linear_model = model.LinearModel(Ad, Bd, Cd, Dd, T, x_bar, u_bar, f_bar, y_bar)
+        linear_model = LinearModel._from_continuous(A, B, C, D, T, x_bar, u_bar, f_bar, y_bar)
         nonlinear_model.X = old_X
 
         return linear_model
 
+    @staticmethod
+    def _dual_jacobians(nonlinear_model, x_bar, u_bar):
+        """Returns the Jacobians and values of the model's `DEs` and `outputs`
+        from a single evaluation on dual numbers
+
+        Returns
+        -------
+        (A, B), (C, D) : numpy.array
+            The continuous time Jacobians with respect to the states and inputs
+
+        f_bar, y_bar : numpy.array
+            The values of the `DEs` and `outputs`
+        """
+        x_bar, u_bar = numpy.atleast_1d(x_bar, u_bar)
+        Nx, N = x_bar.size, x_bar.size + u_bar.size
+        us = model.dual.seed(u_bar, N, Nx)
+
+        old_X = nonlinear_model.X
+        nonlinear_model.X = model.dual.seed(x_bar, N)
+        try:
+            f_bar, AB = model.dual.split(nonlinear_model.DEs(us), N)
+            y_bar, CD = model.dual.split(nonlinear_model.outputs(us), N)
+        finally:
+            nonlinear_model.X = old_X
+
+        return (AB[:, :Nx], AB[:, Nx:]), (CD[:, :Nx], CD[:, Nx:]), f_bar, y_bar
+
+    @staticmethod
+    def _batch_difference_jacobians(nonlinear_model, x_bar, u_bar, h=0.1, N_steps=12):
+        """Returns the Jacobians and values of the model's `DEs` and `outputs`
+        from central differences evaluated in a single batch.
+        The steps are :math:`h, h/2, h/4, ...` and the central differences of consecutive
+        steps are combined with Richardson extrapolation, which cancels their
+        :math:`O(h^2)` errors.
+        For each column the extrapolate that changes the least from the previous one is used
+
+        Parameters
+        ----------
+        h : float, optional
+            The largest step
+
+        N_steps : int, optional
+            Number of steps
+
+        Returns
+        -------
+        (A, B), (C, D) : numpy.array
+            The continuous time Jacobians with respect to the states and inputs
+
+        f_bar, y_bar : numpy.array
+            The values of the `DEs` and `outputs`
+        """
+        x_bar, u_bar = [numpy.asarray(a, dtype=numpy.float64) for a in numpy.atleast_1d(x_bar, u_bar)]
+        Nx = x_bar.size
+        center = numpy.hstack([x_bar, u_bar])
+        N = center.size
+
+        # A (N_steps x 2 x N x N) array of the points, with the centre point last
+        hs = h / 2**numpy.arange(N_steps)
+        offsets = hs[:, None, None, None] * numpy.array([1, -1])[None, :, None, None] * numpy.eye(N)
+        points = numpy.vstack([(center + offsets).reshape(-1, N), center])
+
+        values = numpy.hstack([
+            nonlinear_model.batch_DEs(points[:, :Nx], points[:, Nx:]),
+            nonlinear_model.batch_outputs(points[:, :Nx], points[:, Nx:])
+        ])
+        f_bar, y_bar = numpy.split(values[-1], [Nx])
+        values = values[:-1].reshape(N_steps, 2, N, -1)
+
+        # (N_steps x N x N_outputs) central differences and their extrapolates
+        differences = (values[:, 0] - values[:, 1]) / (2 * hs[:, None, None])
+        extrapolates = (4 * differences[1:] - differences[:-1]) / 3
+        changes = numpy.max(numpy.abs(numpy.diff(extrapolates, axis=0)), axis=2)
+        best = numpy.argmin(changes, axis=0) + 1
+        jacobian = extrapolates[best, numpy.arange(N)].T
+
+        return ((jacobian[:Nx, :Nx], jacobian[:Nx, Nx:]),
+                (jacobian[Nx:, :Nx], jacobian[Nx:, Nx:]),
+                f_bar, y_bar)
+
     def select_subset(self, states, inputs, outputs):
         """Selects a subset of the states, inputs and outputs of the linear model
         
@@ -272,3 +419,55 @@ class LinearModel:
         return u - self.u_bar
 
 
+class _ZeroOrderHold:
+    r"""Discretises a continuous time linear model with a zero order hold
+
+    .. math::
+        A_d = e^{A T}, \quad B_d = \int_0^T e^{A s} ds B
+
+    The matrix :math:`A = V \Lambda V^{-1}` is diagonalised once, after which
+    :math:`A_d = V e^{\Lambda T} V^{-1}` and
+    :math:`B_d = V \frac{e^{\Lambda T} - 1}{\Lambda} V^{-1} B`.
+    If :math:`A` is not diagonalisable, or nearly so, the augmented matrix
+    exponential is used for each sampling interval instead.
+    Results are cached per sampling interval and copies are returned,
+    so that the models made from them do not share their matrices.
+    The full model's matrices and linearisation point are kept for `LinearModel.discretize`
+    """
+    def __init__(self, A, B, C, D, x_bar, u_bar, f_bar, y_bar):
+        self.A, self.B, self.C, self.D = [numpy.atleast_2d(numpy.asarray(m, dtype=numpy.float64))
+                                          for m in [A, B, C, D]]
+        self.x_bar, self.u_bar, self.f_bar, self.y_bar = x_bar, u_bar, f_bar, y_bar
+        self._cache = {}
+
+        self._eigen = None
+        eigenvalues, V = numpy.linalg.eig(self.A)
+        if numpy.linalg.cond(V) < 1e8:
+            V_inv = numpy.linalg.inv(V)
+            self._eigen = eigenvalues, V, V_inv, V_inv @ self.B
+
+    def __call__(self, T):
+        if T not in self._cache:
+            self._cache[T] = self._discretise(T)
+        Ad, Bd = self._cache[T]
+        return Ad.copy(), Bd.copy()
+
+    def _discretise(self, T):
+        """Returns the discrete matrices :math:`A_d, B_d`"""
+        if self._eigen is None:
+            Nx, Ni = self.B.shape
+            augmented = numpy.zeros((Nx + Ni, Nx + Ni))
+            augmented[:Nx, :Nx] = self.A
+            augmented[:Nx, Nx:] = self.B
+            exponential = scipy.linalg.expm(augmented * T)
+            return exponential[:Nx, :Nx], exponential[:Nx, Nx:]
+
+        eigenvalues, V, V_inv, V_inv_B = self._eigen
+        exponentials = numpy.exp(eigenvalues * T)
+        # (e^(lambda T) - 1) / lambda, which is T for a zero eigenvalue
+        zero = eigenvalues == 0
+        integrals = numpy.where(zero, T, numpy.expm1(eigenvalues * T) / numpy.where(zero, 1, eigenvalues))
+
+        Ad = (V * exponentials) @ V_inv
+        Bd = (V * integrals) @ V_inv_B
+        return Ad.real, Bd.real
@@ -0,0 +1,207 @@
+import itertools
+import numpy
+
+import model
+
+
+class LinearModelBank:
+    """A bank of linear models of a nonlinear model, linearised over a grid
+    of operating points, for gain scheduling.
+    The matrices and constants of all the models are stacked, so that the
+    model for a scheduling point is looked up or interpolated without
+    linearising again.
+    A point's cell is found directly on evenly spaced grid axes
+    and with a binary search on other axes, so lookups on even grids
+    take the same time however many models there are
+
+    Parameters
+    ----------
+    models : list
+        The (N_1 * N_2 * ...) `model.LinearModel` of the grid points in C order,
+        so that the last axis varies fastest.
+        All of them must have the same sampling interval and dimensions
+
+    axes : list
+        The increasing values of the scheduling variables along each axis of the grid
+
+    Attributes
+    -----------
+    models : list
+        The linear models of the grid points
+
+    axes : list
+        The increasing values of the scheduling variables along each axis of the grid
+
+    A, B, C, D : numpy.array
+        The (N_1 x N_2 x ... x rows x columns) stacked state space matrices
+
+    x_bar, u_bar, f_bar, y_bar : numpy.array
+        The (N_1 x N_2 x ... x N) stacked linearisation points and constants
+
+    T : float
+        The sampling interval
+    """
+    _fields = ['A', 'B', 'C', 'D', 'x_bar', 'u_bar', 'f_bar', 'y_bar']
+
+    def __init__(self, models, axes):
+        self.axes = [numpy.atleast_1d(numpy.asarray(axis, dtype=numpy.float64)) for axis in axes]
+        shape = tuple(axis.size for axis in self.axes)
+        if len(models) != numpy.prod(shape):
+            raise ValueError(f'{len(models)} models do not fill a grid of shape {shape}')
+        for axis in self.axes:
+            if numpy.any(numpy.diff(axis) <= 0):
+                raise ValueError('The grid axes must be increasing')
+        if len(set(m.T for m in models)) > 1:
+            raise ValueError('The models must have the same sampling interval')
+
+        # The spacing of each evenly spaced axis, or None
+        self._steps = []
+        for axis in self.axes:
+            widths = numpy.diff(axis)
+            even = widths.size > 0 and numpy.allclose(widths, widths[0], rtol=1e-12, atol=0)
+            self._steps.append(widths[0] if even else None)
+
+        self.models = list(models)
+        self.T = models[0].T
+        self._stack()
+
+    def _stack(self):
+        """Stacks the matrices and constants of the models in the grid's shape"""
+        shape = tuple(axis.size for axis in self.axes)
+        for name in LinearModelBank._fields:
+            values = numpy.array([numpy.asarray(getattr(m, name), dtype=numpy.float64) for m in self.models])
+            if not numpy.all(numpy.isfinite(values)):
+                raise ValueError(f'The {name} of some of the models are not finite')
+            setattr(self, name, values.reshape(shape + values.shape[1:]))
+
+    @staticmethod
+    def create_LinearModelBank(nonlinear_model: model.NonlinearModel,
+                               axes, operating_point, T, method='finite_difference'):
+        """Linearises a nonlinear model at each point of a grid of scheduling variables
+
+        Parameters
+        ----------
+        nonlinear_model : model.NonlinearModel
+            The nonlinear model to be linearised
+
+        axes : list
+            The increasing values of the scheduling variables along each axis of the grid
+
+        operating_point : callable
+            Takes an array of the scheduling variables and returns the
+            state and input `(x_bar, u_bar)` around which to linearise,
+            for example a steady state of the inputs
+
+        T : float
+            The sampling interval
+
+        method : {'finite_difference', 'batch_difference', 'dual'}, optional
+            How the Jacobians are calculated, see `model.LinearModel.create_LinearModel`
+
+        Returns
+        -------
+        bank : model.LinearModelBank
+            The bank of linear models
+        """
+        models = []
+        for point in itertools.product(*axes):
+            x_bar, u_bar = operating_point(numpy.array(point))
+            models.append(model.LinearModel.create_LinearModel(
+                nonlinear_model, x_bar, u_bar, T, method=method
+            ))
+        return LinearModelBank(models, axes)
+
+    def select_subset(self, states, inputs, outputs):
+        """Selects a subset of the states, inputs and outputs of all the models.
+        See `model.LinearModel.select_subset`
+
+        Parameters
+        ----------
+        states, inputs, outputs : array
+            An array containing indices of the selected states, inputs, or outputs
+        """
+        for m in self.models:
+            m.select_subset(states, inputs, outputs)
+        self._stack()
+
+    def _cells(self, point):
+        """Returns the index of the lower corner of the cell containing each
+        scheduling variable and the fraction of the way across the cell.
+        Points outside the grid are moved onto its edge"""
+        point = numpy.atleast_1d(point)
+        if point.size != len(self.axes):
+            raise ValueError(f'Expected {len(self.axes)} scheduling variables, got {point.size}')
+
+        lowers, fractions = [], []
+        for axis, step, p in zip(self.axes, self._steps, point):
+            if axis.size == 1:
+                lowers.append(0)
+                fractions.append(0.)
+                continue
+            p = min(max(p, axis[0]), axis[-1])
+            if step is not None:
+                i = min(int((p - axis[0]) // step), axis.size - 2)
+            else:
+                i = min(numpy.searchsorted(axis, p, side='right') - 1, axis.size - 2)
+            lowers.append(i)
+            fractions.append(min(max((p - axis[i]) / (axis[i + 1] - axis[i]), 0.), 1.))
+        return lowers, fractions
+
+    def _model(self, values):
+        """Returns a linear model from the values of the stacked fields,
+        with the same subsets as the models in the bank"""
+        linear_model = model.LinearModel(*values[:4], self.T, *values[4:])
+        template = self.models[0]
+        linear_model.states = template.states
+        linear_model.inputs = template.inputs
+        linear_model.outputs = template.outputs
+        return linear_model
+
+    def nearest(self, point):
+        """Returns the model of the grid point nearest to the scheduling variables.
+        The model is the one in the bank, not a copy
+
+        Parameters
+        ----------
+        point : array-like
+            The scheduling variables
+
+        Returns
+        -------
+        linear_model : model.LinearModel
+            The nearest model
+        """
+        lowers, fractions = self._cells(point)
+        index = tuple(i + (f > 0.5) for i, f in zip(lowers, fractions))
+        return self.models[numpy.ravel_multi_index(index, self.A.shape[:len(self.axes)])]
+
+    def interpolate(self, point):
+        """Returns a model that is multilinearly interpolated between the models
+        at the corners of the grid cell containing the scheduling variables.
+        Points outside the grid use the models on its edge
+
+        Parameters
+        ----------
+        point : array-like
+            The scheduling variables
+
+        Returns
+        -------
+        linear_model : model.LinearModel
+            The interpolated model
+        """
+        lowers, fractions = self._cells(point)
+
+        values = [0.] * len(LinearModelBank._fields)
+        for corner in itertools.product([0, 1], repeat=len(self.axes)):
+            weight = 1.
+            for c, f in zip(corner, fractions):
+                weight *= f if c else 1 - f
+            if weight == 0:
+                continue
+
+            index = tuple(i + c for i, c in zip(lowers, corner))
+            for k, name in enumerate(LinearModelBank._fields):
+                values[k] = values[k] + weight * getattr(self, name)[index]
+
+        return self._model(values)
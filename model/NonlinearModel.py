@@ -1,5 +1,33 @@
+import numpy
+import model.kernels
+
+
 class NonlinearModel:
-    """Base class for nonlinear models"""
+    """Base class for nonlinear models.
+
+    Subclasses can implement the model as two pure kernels,
+    static methods that take a single state:
+
+    - `rhs(x, u, params)` returns a tuple of the time derivatives of the states
+    - `output(x, u, params)` returns a tuple of the outputs
+
+    where `params` is the model's `params` tuple.
+    The kernels may only use arithmetic, indexing, the builtin `max` and `min`
+    and scalar math functions such as `numpy.sqrt`, so that numba can compile them.
+    `DEs`, `outputs`, `batch_DEs` and `batch_outputs` are then derived from them,
+    `kernel` gives the NumPy batched, CPU parallel and CUDA variants
+    and `bind` gives the kernels in the form the filters take.
+    Subclasses that do not implement the kernels override `DEs` and `outputs` instead
+
+    Attributes
+    -----------
+    params : tuple
+        Parameters of the kernels as floats
+    """
+    rhs = None
+    output = None
+    params = ()
+
     def DEs(self, inputs):
         """Contains the differential and algebraic equations for the system model.
 
@@ -7,7 +35,9 @@ class NonlinearModel:
         ----------
         inputs : array-like
         """
-        raise NotImplementedError
+        if self.rhs is None:
+            raise NotImplementedError
+        return numpy.array(self.rhs(self.X, inputs, self.params))
 
     def step(self, dt, inputs):
         """Updates the model with inputs
@@ -26,4 +56,122 @@ class NonlinearModel:
         ----------
         inputs : array-like
         """
-        raise NotImplementedError
+        if self.output is None:
+            raise NotImplementedError
+        return numpy.array(self.output(self.X, inputs, self.params))
+
+    def kernel(self, name, target='parallel'):
+        """Returns a batched variant of the `rhs` or `output` kernel.
+        Compiled variants are cached per kernel and parameters,
+        see `model.kernels.get_kernel`
+
+        Parameters
+        ----------
+        name : {'rhs', 'output'}
+            The kernel
+
+        target : {'numpy', 'parallel', 'cuda'}, optional
+            'numpy' evaluates the kernel once with arrays of each state and input,
+            see `model.kernels.batched`,
+            which only works for kernels that do not branch on the states or inputs.
+            'parallel' and 'cuda' compile the kernel with numba
+
+        Returns
+        -------
+        fun : callable
+            A function that takes (... x Nx) states and (... x Ni) inputs
+            and returns the (... x Nx) time derivatives or (... x No) outputs
+        """
+        kernel = getattr(self, name)
+        if kernel is None:
+            raise NotImplementedError(f'{type(self).__name__} does not implement {name}')
+
+        if target == 'numpy':
+            def fun(xs, us):
+                xs, us = [numpy.asarray(a, dtype=numpy.float64) for a in [xs, us]]
+                return model.kernels.batched(kernel, xs, us, self.params)
+            return fun
+
+        compiled = model.kernels.get_kernel(kernel, name, target, tuple(self.params))
+        if name == 'rhs':
+            return lambda xs, us: compiled(xs, us, 1.)
+        return lambda xs, us: compiled(xs, us, numpy.zeros(self._N_outputs(xs, us)))
+
+    def bind(self, name, outputs=None):
+        """Returns the `rhs` or `output` kernel bound to the current parameters,
+        in the form of the filters' state transition and observation functions.
+        The GPU filters compile it once for all the filters with the same kernel,
+        see `model.kernels.ModelKernel`
+
+        Parameters
+        ----------
+        name : {'rhs', 'output'}
+            The kernel
+
+        outputs : list, optional
+            The indices of the outputs the 'output' kernel returns.
+            If `None` then all the outputs are returned
+
+        Returns
+        -------
+        kernel : model.kernels.ModelKernel
+            The bound kernel
+        """
+        kernel = getattr(self, name)
+        if kernel is None:
+            raise NotImplementedError(f'{type(self).__name__} does not implement {name}')
+
+        return model.kernels.ModelKernel(kernel, name, self.params, outputs)
+
+    def _N_outputs(self, xs, us):
+        """Returns the number of outputs by evaluating `output` on the first state"""
+        xs, us = [numpy.asarray(a, dtype=numpy.float64) for a in [xs, us]]
+        return len(self.output(xs.reshape(-1, xs.shape[-1])[0], us.reshape(-1, us.shape[-1])[0], self.params))
+
+    def batch_DEs(self, xs, us):
+        """Evaluates `DEs` at many states and inputs.
+        Subclasses can override this with an array version.
+        The default uses the CPU parallel `rhs` kernel if there is one,
+        otherwise it sets `X` to each state in turn
+
+        Parameters
+        ----------
+        xs : array-like
+            A (N x Nx) array of states
+
+        us : array-like
+            A (N x Ni) array of inputs
+
+        Returns
+        -------
+        dXs : numpy.array
+            A (N x Nx) array of the differential changes to the states
+        """
+        if self.rhs is not None:
+            return self.kernel('rhs')(numpy.asarray(xs, dtype=numpy.float64), numpy.asarray(us, dtype=numpy.float64))
+        return self._batch(self.DEs, xs, us)
+
+    def batch_outputs(self, xs, us):
+        """Evaluates `outputs` at many states and inputs.
+        See `batch_DEs`
+
+        Returns
+        -------
+        ys : numpy.array
+            A (N x No) array of the outputs
+        """
+        if self.output is not None:
+            return self.kernel('output')(numpy.asarray(xs, dtype=numpy.float64), numpy.asarray(us, dtype=numpy.float64))
+        return self._batch(self.outputs, xs, us)
+
+    def _batch(self, fun, xs, us):
+        """Evaluates a method that uses `X` at each of the states"""
+        old_X = self.X
+        try:
+            results = []
+            for x, u in zip(xs, us):
+                self.X = numpy.array(x, dtype=numpy.float64)
+                results.append(numpy.array(fun(u), dtype=numpy.float64))
+        finally:
+            self.X = old_X
+        return numpy.array(results)
@@ -1,5 +1,7 @@
 from model.NonlinearModel import NonlinearModel
 from model.BioreactorModel import Bioreactor
+from model.BioreactorFleet import BioreactorFleet
 from model.LinearModel import LinearModel
+from model.LinearModelBank import LinearModelBank
 
-__all__ = ['Bioreactor', 'LinearModel']
+__all__ = ['Bioreactor', 'BioreactorFleet', 'LinearModel', 'LinearModelBank']
@@ -0,0 +1,178 @@
+"""Forward-mode automatic differentiation with dual numbers.
+
+A `Dual` carries a value and its gradient with respect to a set of seeded variables.
+Model equations written with Python arithmetic, the builtin `max` and `min`
+and numpy functions on scalars or object arrays can be evaluated on duals unchanged,
+which gives their exact Jacobians in a single evaluation.
+At a kink, such as `max(0, x)` at `x = 0`, the derivative of the branch that
+is taken is used, where central differences would average the two sides.
+"""
+import numpy
+
+
+class Dual:
+    """A dual number
+
+    Parameters
+    ----------
+    value : float
+        The value
+
+    gradient : numpy.array
+        The derivatives of the value with respect to the seeded variables
+    """
+    __slots__ = ('value', 'gradient')
+
+    def __init__(self, value, gradient):
+        self.value = float(value)
+        self.gradient = gradient
+
+    def __repr__(self):
+        return f'Dual({self.value}, {self.gradient})'
+
+    @staticmethod
+    def _parts(other):
+        if isinstance(other, Dual):
+            return other.value, other.gradient
+        return float(other), 0.
+
+    def __add__(self, other):
+        value, gradient = Dual._parts(other)
+        return Dual(self.value + value, self.gradient + gradient)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        value, gradient = Dual._parts(other)
+        return Dual(self.value - value, self.gradient - gradient)
+
+    def __rsub__(self, other):
+        value, gradient = Dual._parts(other)
+        return Dual(value - self.value, gradient - self.gradient)
+
+    def __mul__(self, other):
+        value, gradient = Dual._parts(other)
+        return Dual(self.value * value, self.gradient * value + self.value * gradient)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        value, gradient = Dual._parts(other)
+        return Dual(self.value / value, (self.gradient * value - self.value * gradient) / value**2)
+
+    def __rtruediv__(self, other):
+        value, gradient = Dual._parts(other)
+        return Dual(value / self.value, (gradient * self.value - value * self.gradient) / self.value**2)
+
+    def __pow__(self, power):
+        if isinstance(power, Dual):
+            return (self.log() * power).exp()
+        power = float(power)
+        return Dual(self.value**power, power * self.value**(power - 1) * self.gradient)
+
+    def __rpow__(self, other):
+        return (self * numpy.log(float(other))).exp()
+
+    def __neg__(self):
+        return Dual(-self.value, -self.gradient)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return -self if self.value < 0 else self
+
+    # Comparisons use the values, so that branches, max and min pick the active piece
+    def __lt__(self, other):
+        return self.value < Dual._parts(other)[0]
+
+    def __le__(self, other):
+        return self.value <= Dual._parts(other)[0]
+
+    def __gt__(self, other):
+        return self.value > Dual._parts(other)[0]
+
+    def __ge__(self, other):
+        return self.value >= Dual._parts(other)[0]
+
+    def __float__(self):
+        return self.value
+
+    # Methods called by numpy functions on duals and object arrays of duals
+    def exp(self):
+        value = numpy.exp(self.value)
+        return Dual(value, value * self.gradient)
+
+    def log(self):
+        return Dual(numpy.log(self.value), self.gradient / self.value)
+
+    def sqrt(self):
+        value = numpy.sqrt(self.value)
+        return Dual(value, self.gradient / (2 * value))
+
+    def sin(self):
+        return Dual(numpy.sin(self.value), numpy.cos(self.value) * self.gradient)
+
+    def cos(self):
+        return Dual(numpy.cos(self.value), -numpy.sin(self.value) * self.gradient)
+
+    def tanh(self):
+        value = numpy.tanh(self.value)
+        return Dual(value, (1 - value**2) * self.gradient)
+
+
+def seed(values, N=None, offset=0):
+    """Returns an object array of duals that are the seeded variables
+
+    Parameters
+    ----------
+    values : array_like
+        The values of the variables
+
+    N : int, optional
+        Total number of seeded variables.
+        Defaults to the number of values
+
+    offset : int, optional
+        Index of the first of these variables among the seeded variables
+
+    Returns
+    -------
+    duals : numpy.array
+        An object array of duals
+    """
+    values = numpy.asarray(values, dtype=numpy.float64).flatten()
+    N = values.size if N is None else N
+    eye = numpy.eye(N)
+    duals = numpy.empty(values.size, dtype=object)
+    for i, value in enumerate(values):
+        duals[i] = Dual(value, eye[offset + i])
+    return duals
+
+
+def split(duals, N):
+    """Returns the values and Jacobian of the results of a dual evaluation
+
+    Parameters
+    ----------
+    duals : array_like
+        The results. Entries that are not duals are constants
+
+    N : int
+        Number of seeded variables
+
+    Returns
+    -------
+    values : numpy.array
+        A (M) array of the values
+
+    jacobian : numpy.array
+        A (M x N) array of the derivatives
+    """
+    duals = numpy.asarray(duals, dtype=object).flatten()
+    values = numpy.array([float(d) for d in duals])
+    jacobian = numpy.zeros((duals.size, N))
+    for i, d in enumerate(duals):
+        if isinstance(d, Dual):
+            jacobian[i] = d.gradient
+    return values, jacobian
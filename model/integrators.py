@@ -0,0 +1,170 @@
+"""Explicit integrators for the system models and the filters' state transitions.
+
+Each integrator advances :math:`\\dot{x} = fun(x)` over one interval `dt`.
+The states can be a single (Nx) array or a (... x Nx) array of states,
+provided `fun` accepts the same shape.
+"""
+import numpy
+
+
+def euler(fun, x, dt):
+    """Takes one explicit Euler step
+
+    Parameters
+    ----------
+    fun : callable
+        Returns the time derivatives of the states
+
+    x : numpy.array
+        A (... x Nx) array of the current states
+
+    dt : float
+        The time step
+
+    Returns
+    -------
+    x_new : numpy.array
+        The states after `dt`
+    """
+    return x + fun(x)*dt
+
+
+def heun(fun, x, dt):
+    """Takes one step of Heun's second order method.
+    See `euler` for the parameters"""
+    k1 = fun(x)
+    k2 = fun(x + k1*dt)
+    return x + (k1 + k2)*(dt/2)
+
+
+def rk4(fun, x, dt):
+    """Takes one step of the classical fourth order Runge-Kutta method.
+    See `euler` for the parameters"""
+    k1 = fun(x)
+    k2 = fun(x + k1*(dt/2))
+    k3 = fun(x + k2*(dt/2))
+    k4 = fun(x + k3*dt)
+    return x + (k1 + 2*k2 + 2*k3 + k4)*(dt/6)
+
+
+def rk23(fun, x, dt, rtol=1e-6, atol=1e-8, max_substeps=10000):
+    """Integrates over `dt` with the adaptive Bogacki-Shampine 3(2) pair.
+    The interval is split into substeps whose local error estimate,
+    the largest over all the states, satisfies the tolerances.
+    The first substep tries the whole interval
+
+    Parameters
+    ----------
+    fun : callable
+        Returns the time derivatives of the states
+
+    x : numpy.array
+        A (... x Nx) array of the current states
+
+    dt : float
+        The time interval
+
+    rtol, atol : float, optional
+        Relative and absolute tolerances of the local error
+
+    max_substeps : int, optional
+        Limit on the number of accepted and rejected substeps
+
+    Returns
+    -------
+    x_new : numpy.array
+        The states after `dt`
+    """
+    x = numpy.asarray(x)
+    t, h = 0., dt
+    k1 = fun(x)
+    for _ in range(max_substeps):
+        if t >= dt:
+            return x
+
+        h = min(h, dt - t)
+        k2 = fun(x + k1*(h/2))
+        k3 = fun(x + k2*(3*h/4))
+        x_new = x + (2*k1 + 3*k2 + 4*k3)*(h/9)
+        k4 = fun(x_new)
+
+        error = (-5*k1/72 + k2/12 + k3/9 - k4/8)*h
+        scale = atol + rtol*numpy.maximum(numpy.abs(x), numpy.abs(x_new))
+        error_norm = numpy.max(numpy.abs(error) / scale) if error.size else 0.
+
+        if error_norm <= 1:
+            t += h
+            x, k1 = x_new, k4
+
+        # Standard step size controller for a third order method
+        h *= min(5., max(0.2, 0.9 * (error_norm + 1e-16) ** (-1/3)))
+
+    raise RuntimeError(f'rk23 did not reach the end of the interval in {max_substeps} substeps')
+
+
+methods = {'euler': euler, 'heun': heun, 'rk4': rk4, 'rk23': rk23}
+
+
+def get_integrator(method):
+    """Returns an integrator by name
+
+    Parameters
+    ----------
+    method : {'euler', 'heun', 'rk4', 'rk23', callable}
+        The name of the integrator.
+        Callables with the signature of `euler` are returned as is
+
+    Returns
+    -------
+    integrator : callable
+        The integrator
+    """
+    if callable(method):
+        return method
+    if method not in methods:
+        raise ValueError(f'Unknown integrator {method}, use one of {list(methods)}')
+    return methods[method]
+
+
+class Transition:
+    """Wraps a filter's state transition function so that
+    the prediction is integrated with a different method.
+    The wrapped function has the same signature as `f` and
+    returns the change in the states over `dt`, so it can be passed to the CPU filters.
+    It is picklable if `f` is
+
+    Parameters
+    ----------
+    f : callable
+        The state transition function :math:`f(x, u, dt)` that returns
+        the Euler change in the states, such as `model.Bioreactor.homeostatic_DEs`
+        or, for vectorized filters, `model.Bioreactor.batch_homeostatic_DEs`
+
+    method : {'euler', 'heun', 'rk4', 'rk23', callable}, optional
+        The integrator
+
+    substeps : int, optional
+        Number of integrator steps per prediction
+    """
+    def __init__(self, f, method='rk4', substeps=1):
+        self.f = f
+        self.method = method
+        self.substeps = substeps
+        self._integrator = get_integrator(method)
+
+    def __getstate__(self):
+        return {'f': self.f, 'method': self.method, 'substeps': self.substeps}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __call__(self, x, u, dt):
+        x = numpy.asarray(x, dtype=numpy.float64)
+
+        def fun(x_):
+            return numpy.asarray(self.f(x_, u, 1), dtype=numpy.float64)
+
+        x_new = x
+        for _ in range(self.substeps):
+            x_new = self._integrator(fun, x_new, dt / self.substeps)
+        return x_new - x
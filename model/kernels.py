@@ -0,0 +1,242 @@
+"""Compiled variants of model functions.
+
+The functions are written for a single state and compiled with numba into
+generalised ufuncs that run over all the states of a batch,
+in parallel on the CPU or on the GPU.
+Compiled kernels are cached, so models and filters that use the same
+function share one compilation.
+`batched` evaluates the same functions on whole arrays with NumPy instead,
+and `ModelKernel` binds a model's `rhs` or `output` kernel to its parameters,
+so that it can be passed to the filters.
+"""
+import types
+import functools
+import numpy
+import numba
+import numba.cuda as cuda
+
+# Kinds of function and the layouts of their kernels
+#   'transition' : f(x, u, dt), the change in the states over dt
+#   'observation' : g(x, u), the outputs
+#   'rhs' : rhs(x, u, params), the time derivatives of the states, scaled by dt
+#   'output' : output(x, u, params), the outputs
+_layouts = {
+    'transition': '(n), (m), () -> (n)',
+    'rhs': '(n), (m), () -> (n)',
+    'observation': '(n), (m), (p) -> (p)',
+    'output': '(n), (m), (p) -> (p)',
+}
+
+_signatures = {
+    ('transition', 'parallel'): ['void(f8[:], f8[:], f8, f8[:])'],
+    ('observation', 'parallel'): ['void(f8[:], f8[:], f8[:], f8[:])'],
+    ('transition', 'cuda'): ['void(f4[:], i4[:], i4, f4[:])',
+                             'void(f4[:], i8[:], i8, f4[:])',
+                             'void(f4[:], f4[:], f4, f4[:])',
+                             'void(f4[:], f8[:], f8, f4[:])'],
+    ('observation', 'cuda'): ['void(f4[:], i4[:], f4[:], f4[:])',
+                              'void(f4[:], i8[:], f4[:], f4[:])',
+                              'void(f4[:], f4[:], f4[:], f4[:])',
+                              'void(f4[:], f8[:], f4[:], f4[:])'],
+}
+_signatures['rhs', 'parallel'] = _signatures['transition', 'parallel']
+_signatures['rhs', 'cuda'] = _signatures['transition', 'cuda']
+_signatures['output', 'parallel'] = _signatures['observation', 'parallel']
+_signatures['output', 'cuda'] = _signatures['observation', 'cuda']
+
+
+def _body(fun, kind, params, outputs):
+    """Returns the gufunc body that calls the compiled function `fun`"""
+    if kind == 'transition':
+        def body(x, u, dt, out):
+            ans = fun(x, u, dt)
+            for i in range(len(ans)):
+                out[i] = ans[i]
+    elif kind == 'rhs':
+        def body(x, u, dt, out):
+            ans = fun(x, u, params)
+            for i in range(len(ans)):
+                out[i] = ans[i] * dt
+    elif kind == 'observation':
+        def body(x, u, _y_dummy, out):
+            ans = fun(x, u)
+            for i in range(len(ans)):
+                out[i] = ans[i]
+    elif outputs is None:
+        def body(x, u, _y_dummy, out):
+            ans = fun(x, u, params)
+            for i in range(len(ans)):
+                out[i] = ans[i]
+    else:
+        def body(x, u, _y_dummy, out):
+            ans = fun(x, u, params)
+            for i in range(len(outputs)):
+                out[i] = ans[outputs[i]]
+
+    return body
+
+
+@functools.lru_cache(maxsize=None)
+def get_kernel(function, kind, target='parallel', params=(), outputs=None):
+    """Returns a compiled kernel, compiling it on first use
+
+    Parameters
+    ----------
+    function : callable
+        A function of a single state, written with arithmetic, indexing,
+        the builtin `max` and `min` and scalar math functions,
+        that returns a tuple
+
+    kind : {'transition', 'observation', 'rhs', 'output'}
+        The signature of `function`.
+        The 'transition' and 'rhs' kernels take the states, inputs and time step
+        and return the change in the states.
+        The 'observation' and 'output' kernels take the states, inputs and
+        a dummy array with the shape of the outputs, and return the outputs
+
+    target : {'parallel', 'cuda'}, optional
+        Where the kernel runs
+
+    params : tuple, optional
+        The parameters passed to 'rhs' and 'output' functions.
+        They are compiled into the kernel as constants
+
+    outputs : tuple, optional
+        The indices of the outputs an 'output' kernel returns.
+        If `None` then all the outputs are returned
+
+    Returns
+    -------
+    kernel : numba.np.ufunc.gufunc.GUFunc
+        The generalised ufunc
+    """
+    if target == 'cuda':
+        fun = cuda.jit(device=True)(function)
+    else:
+        fun = numba.njit(function)
+
+    return numba.guvectorize(_signatures[kind, target], _layouts[kind], target=target)(
+        _body(fun, kind, params, outputs)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _elementwise(function):
+    """Returns a copy of `function` in which the builtin `max` and `min`
+    are the elementwise `numpy.maximum` and `numpy.minimum`.
+    Functions that it calls are not changed"""
+    namespace = dict(function.__globals__, max=numpy.maximum, min=numpy.minimum)
+    return types.FunctionType(function.__code__, namespace, function.__name__,
+                              function.__defaults__, function.__closure__)
+
+
+def batched(function, xs, us, *args):
+    """Evaluates a function of a single state at a batch of states in one call.
+    The function is called once with arrays of each state and input,
+    so it may not branch on their values
+
+    Parameters
+    ----------
+    function : callable
+        A function of a single state, see `get_kernel`,
+        such as `model.Bioreactor.rhs`
+
+    xs : numpy.array
+        A (... x Nx) array of states
+
+    us : numpy.array
+        A (... x Ni) array of inputs that broadcasts with the states
+
+    args
+        The remaining arguments of `function`.
+        Arrays must broadcast with the states' leading dimensions
+
+    Returns
+    -------
+    results : numpy.array
+        A (... x N) array of the returned values
+    """
+    xs, us = [numpy.moveaxis(numpy.asarray(a), -1, 0) for a in [xs, us]]
+    return numpy.stack(numpy.broadcast_arrays(*_elementwise(function)(xs, us, *args)), axis=-1)
+
+
+class ModelKernel:
+    """A model's `rhs` or `output` kernel bound to the model's parameters,
+    see `model.NonlinearModel.bind`.
+    It is called like the filters' state transition and observation functions,
+    `f(x, u, dt)` and `g(x, u)`, with a single state or a (... x Nx) array of states,
+    and the GPU filters compile it with `compile`
+
+    Parameters
+    ----------
+    function : callable
+        The kernel, a function `function(x, u, params)` of a single state
+
+    kind : {'rhs', 'output'}
+        The kind of kernel
+
+    params : tuple, optional
+        The model's parameters
+
+    outputs : tuple, optional
+        The indices of the outputs of an 'output' kernel that are returned.
+        If `None` then all the outputs are returned
+    """
+    def __init__(self, function, kind, params=(), outputs=None):
+        if kind not in ['rhs', 'output']:
+            raise ValueError(f'Unknown kernel kind {kind}')
+        self.function = function
+        self.kind = kind
+        self.params = tuple(params)
+        self.outputs = None if outputs is None else tuple(outputs)
+
+    def __repr__(self):
+        return f'ModelKernel({self.function.__qualname__}, {self.kind!r}, {self.params}, {self.outputs})'
+
+    def __call__(self, x, u, dt=1.):
+        """Returns the change in the states over `dt` of an 'rhs' kernel,
+        or the outputs of an 'output' kernel
+
+        Parameters
+        ----------
+        x : array-like
+            A single state, or a (... x Nx) array of states
+
+        u : array-like
+            The inputs, which broadcast with the states
+
+        dt : {float, numpy.array}, optional
+            The time step of an 'rhs' kernel
+
+        Returns
+        -------
+        values : numpy.array
+            An (Nx) or (No) array for a single state, otherwise a (... x Nx) or (... x No) array
+        """
+        if numpy.ndim(x) > 1:
+            values = batched(self.function, x, u, self.params)
+        else:
+            values = numpy.array(self.function(x, u, self.params))
+
+        if self.kind == 'rhs':
+            return values * dt
+        if self.outputs is not None:
+            return values[..., list(self.outputs)]
+        return values
+
+    def compile(self, target='parallel'):
+        """Returns the compiled kernel, see `get_kernel`.
+        An 'rhs' kernel is compiled with the layout of the 'transition' kernels
+        and an 'output' kernel with that of the 'observation' kernels
+
+        Parameters
+        ----------
+        target : {'parallel', 'cuda'}, optional
+            Where the kernel runs
+
+        Returns
+        -------
+        kernel : numba.np.ufunc.gufunc.GUFunc
+            The generalised ufunc
+        """
+        return get_kernel(self.function, self.kind, target, self.params, self.outputs)
@@ -0,0 +1,67 @@
+import numpy
+import time
+import tqdm
+import controller
+import sim_base
+import matplotlib
+import matplotlib.pyplot as plt
+from decorators import PickleJar
+
+
+@PickleJar.pickle(path='mpc/construction')
+def get_construction_times(Ps, N_runs):
+    """Times the construction of the bioreactor MPC for a number of prediction horizons.
+    The control horizon is two thirds of the prediction horizon, as in `sim_base.get_parts`
+
+    Parameters
+    ----------
+    Ps : list
+        Prediction horizons
+
+    N_runs : int
+        Number of constructions timed for each prediction horizon
+
+    Returns
+    -------
+    times : numpy.array
+        A (len(Ps) x N_runs) array of construction times
+    """
+    _, lin_model, K, _ = sim_base.get_parts(gpu=False)
+
+    times = numpy.zeros((len(Ps), N_runs))
+    for i, P in enumerate(tqdm.tqdm(Ps)):
+        for j in range(N_runs):
+            t = time.time()
+            controller.MPC(
+                P=P,
+                M=max(2 * P // 3, 1),
+                Q=K.Q,
+                R=K.R,
+                lin_model=lin_model,
+                ysp=K.ysp,
+                formulation='sparse',
+                fast_path=False
+            )
+            times[i, j] = time.time() - t
+
+    return times
+
+
+def plot_results():
+    """Plots the median construction time against the prediction horizon
+    """
+    Ps = [10, 30, 100, 300, 1000, 3000]
+    times = get_construction_times(Ps, 10)
+
+    matplotlib.rcParams.update({'font.size': 9})
+    plt.figure(figsize=(6.25/1.4, 5/1.4))
+    plt.loglog(Ps, numpy.median(times, axis=1), 'kx-')
+    plt.ylabel('Construction time (s)')
+    plt.xlabel('Prediction horizon')
+    plt.tight_layout(rect=[0, 0.03, 1, 0.95])
+    plt.savefig('mpc_construction_time.pdf')
+    plt.show()
+
+
+if __name__ == '__main__':
+    plot_results()
@@ -1,4 +1,5 @@
 import numpy
+import cupy
 import tqdm
 import matplotlib.pyplot as plt
 import sim_base
@@ -16,7 +17,8 @@ def get_simulation_performance(dt_control, monte_carlo):
         Control period
 
     monte_carlo : int
-        Index of the monte carlo run
+        Index of the monte carlo run.
+        Used as the seed of the plant noise stream
 
     Returns
     -------
@@ -24,14 +26,14 @@ def get_simulation_performance(dt_control, monte_carlo):
         ISE performance of the run
 
     """
-    _ = monte_carlo
     end_time = 50
     ts = numpy.linspace(0, end_time, end_time*20)
     dt = ts[1]
     assert dt <= dt_control
 
     bioreactor, lin_model, K, _ = sim_base.get_parts(dt_control=dt_control)
-    state_pdf, measurement_pdf = sim_base.get_noise()
+    noise_rng, = sim_base.spawn_rngs(1, seed=monte_carlo, lib=cupy)
+    state_pdf, measurement_pdf = sim_base.get_noise(rng=noise_rng)
 
     # Initial values
     us = [numpy.array([0.06, 0.2])]
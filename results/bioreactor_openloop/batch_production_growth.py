@@ -6,18 +6,38 @@ import sim_base
 import model
 
 
-def simulate():
-    """Performs no noise simulation"""
+def simulate(N_reactors=1, X0s=None):
+    """Performs a simulation of a fleet of reactors, each with its own noise
+
+    Parameters
+    ----------
+    N_reactors : int, optional
+        Number of reactors with the standard initial state
+
+    X0s : numpy.array, optional
+        A (N x 5) array of initial states of the reactors,
+        used instead of `N_reactors` copies of the standard initial state
+
+    Returns
+    -------
+    ts : numpy.array
+        The times
+
+    ys, ys_meas : numpy.array
+        The (N_t x N x 5) outputs without and with measurement noise
+
+    us : numpy.array
+        The (N_t x 2) inputs
+    """
     # Simulation set-up
     end_time = 800
     ts = numpy.linspace(0, end_time, end_time*10)
     dt = ts[1]
 
-    bioreactor = model.Bioreactor(
+    if X0s is None:
         #                Ng,         Nx,      Nfa, Ne, Nh
-        X0=numpy.array([3000 / 180, 1 / 24.6, 0 / 116, 0., 0.]),
-        high_N=True
-    )
+        X0s = numpy.tile([3000 / 180, 1 / 24.6, 0 / 116, 0., 0.], (N_reactors, 1))
+    bioreactor = model.BioreactorFleet(X0=X0s, high_N=True)
 
     select_inputs = [0, 1]  # Fg_in, Fm_in
     select_outputs = [0, 2]  # Cg, Cfa
@@ -26,7 +46,6 @@ def simulate():
 
     # Initial values
     us = [numpy.array([0., 0.])]
-    xs = [bioreactor.X.copy()]
     ys = [bioreactor.outputs(us[-1])]
     ys_meas = [bioreactor.outputs(us[-1])]
 
@@ -36,7 +55,7 @@ def simulate():
             us.append(numpy.array([0., 0.]))
         elif t < 200:
             if not_cleared:
-                bioreactor.X[[0, 2, 3, 4]] = 0
+                bioreactor.X[:, [0, 2, 3, 4]] = 0
                 not_cleared = False
                 bioreactor.high_N = False
 
@@ -47,12 +66,10 @@ def simulate():
             us.append(numpy.array([0.074, 0.]))
 
         bioreactor.step(dt, us[-1])
-        bioreactor.X += state_pdf.draw().get().squeeze()
-        outputs = bioreactor.outputs(us[-1])
-        ys.append(outputs.copy())
-        outputs[select_outputs] += measurement_pdf.draw().get().squeeze()
-        ys_meas.append(outputs)
-        xs.append(bioreactor.X.copy())
+        bioreactor.add_noise(state_pdf)
+        outputs, measured_outputs = bioreactor.measured_outputs(us[-1], measurement_pdf, select_outputs)
+        ys.append(outputs)
+        ys_meas.append(measured_outputs)
 
     ys = numpy.array(ys)
     ys_meas = numpy.array(ys_meas)
@@ -66,6 +83,7 @@ def plot():
     that shows the various phases of the bioreactor
     """
     ts, ys, ys_meas, us, end_time, select_inputs = simulate()
+    ys, ys_meas = ys[:, 0], ys_meas[:, 0]
 
     def add_time_lines(axis):
         for time in [25, 200, 500]:
@@ -122,6 +140,7 @@ def plot_pretty():
     For use in a presentation
     """
     ts, ys, ys_meas, us, end_time, select_inputs = simulate()
+    ys, ys_meas = ys[:, 0], ys_meas[:, 0]
 
     black = '#2B2B2D'
     red = '#E90039'
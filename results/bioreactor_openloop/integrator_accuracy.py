@@ -0,0 +1,76 @@
+import numpy
+import time
+import tqdm
+import model
+import sim_base
+import matplotlib
+import matplotlib.pyplot as plt
+from decorators import PickleJar
+
+
+@PickleJar.pickle(path='bioreactor/integrators')
+def get_trajectory(method, dt):
+    """Simulates a step in the inputs of the bioreactor with an integrator
+
+    Parameters
+    ----------
+    method : {'euler', 'heun', 'rk4', 'rk23'}
+        The integrator, see `model.integrators`
+
+    dt : float
+        The simulation period
+
+    Returns
+    -------
+    ts, ys, run_time : numpy.array
+        The times and outputs of the simulation and its run time
+    """
+    end_time = 300
+    ts = numpy.linspace(0, end_time, int(round(end_time / dt)) + 1)
+
+    bioreactor, _, _, _ = sim_base.get_parts(gpu=False, integrator=method)
+
+    u = numpy.array([0.04, 0.1])
+    ys = [bioreactor.outputs(u)]
+    t = time.time()
+    for _ in ts[1:]:
+        bioreactor.step(dt, u)
+        ys.append(bioreactor.outputs(u).copy())
+    run_time = time.time() - t
+
+    return ts, numpy.array(ys), run_time
+
+
+def plot_results():
+    """Plots the trajectory error and run time against the simulation period.
+    The error is measured against the adaptive method at the smallest period
+    """
+    dts = [0.05, 0.1, 0.2, 0.5, 1, 2]
+    methods = ['euler', 'heun', 'rk4', 'rk23']
+    reference_ts, reference_ys, _ = get_trajectory('rk23', dts[0])
+
+    matplotlib.rcParams.update({'font.size': 9})
+    fig, axes = plt.subplots(1, 2, figsize=(6.25, 5/1.4))
+    for method in tqdm.tqdm(methods):
+        errors, run_times = [], []
+        for dt in dts:
+            ts, ys, run_time = get_trajectory(method, dt)
+            step = int(round(dt / dts[0]))
+            errors.append(numpy.max(numpy.abs(ys - reference_ys[::step])))
+            run_times.append(run_time)
+
+        axes[0].loglog(dts, errors, '.-', label=method)
+        axes[1].loglog(dts, run_times, '.-', label=method)
+
+    axes[0].set_ylabel('Maximum output error')
+    axes[1].set_ylabel('Run time (s)')
+    for ax in axes:
+        ax.set_xlabel('Simulation period (min)')
+    axes[0].legend()
+    plt.tight_layout(rect=[0, 0.03, 1, 0.95])
+    plt.savefig('integrator_accuracy.pdf')
+    plt.show()
+
+
+if __name__ == '__main__':
+    plot_results()
@@ -2,6 +2,7 @@ import numpy
 import tqdm
 import matplotlib.pyplot as plt
 import sim_base
+import model
 import itertools
 import warnings
 import matplotlib
@@ -10,37 +11,37 @@ from decorators import PickleJar
 
 
 @PickleJar.pickle(path='bioreactor')
-def step_test(percent, dt):
-    """Does a simulation with given input changes and returns the outputs vs time
+def step_tests(percents, dt):
+    """Does a simulation for each of the given input changes and returns the outputs vs time.
+    The reactors are simulated together as a `model.BioreactorFleet`
 
     Parameters
     ----------
-    percent : numpy.array
-        A (2,) array containing the percentage changes for the two inputs
+    percents : numpy.array
+        A (N x 2) array containing the percentage changes for the two inputs of each run
 
     dt : the simulation period
 
     Returns
     -------
     ts, ys : numpy.array
-        The times and outputs of the simulation
+        The times and the (N_t x N x 5) outputs of the simulations
     """
     # Simulation set-up
     end_time = 300
     ts = numpy.linspace(0, end_time, int(end_time//dt))
 
     bioreactor, lin_model, _, _ = sim_base.get_parts()
+    fleet = model.BioreactorFleet(bioreactor.X, high_N=bioreactor.high_N, N_reactors=len(percents))
 
     # Initial values
-    u = numpy.array([0.06, 0.2])
-    u *= percent
-    ys = [bioreactor.outputs(u)]
+    us = numpy.array([0.06, 0.2]) * percents
+    ys = [fleet.outputs(us)]
 
     for _ in tqdm.tqdm(ts[1:]):
 
-        bioreactor.step(dt, u)
-        outputs = bioreactor.outputs(u)
-        ys.append(outputs.copy())
+        fleet.step(dt, us)
+        ys.append(fleet.outputs(us))
 
     ys = numpy.array(ys)
     return ts, ys
@@ -63,9 +64,11 @@ def plot():
     max_slope = 0
     argmax = 0
 
-    for p1, p2, dt in itertools.product(percents, percents, dts):
-        percent = numpy.array([p1, p2])
-        ts, ys = step_test(percent, dt)
+    runs = numpy.array(list(itertools.product(percents, percents)))
+    results = {dt: step_tests(runs, dt) for dt in dts}
+
+    for (i, percent), dt in itertools.product(enumerate(runs), dts):
+        ts, ys = results[dt][0], results[dt][1][:, i]
         # u_i = u * percent
 
         # Find the maximum slope
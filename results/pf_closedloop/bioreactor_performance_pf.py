@@ -29,7 +29,8 @@ def get_sim(N_particles, dt_control, dt_predict, monte_carlo=0, end_time=50, pf=
         Control and prediction periods
 
     monte_carlo : int, optional
-        The monte carlo indexing number
+        The monte carlo indexing number.
+        Used as the seed of the simulation's random number streams
 
     end_time : float, optional
         Simulation end time
@@ -51,8 +52,7 @@ def get_sim(N_particles, dt_control, dt_predict, monte_carlo=0, end_time=50, pf=
     covariance_point_size : numpy.array
         Maximum singular value of the covariance point estimate for each time instance
     """
-    _ = monte_carlo
-    sim = sim_base.Simulation(N_particles, dt_control, dt_predict, end_time, pf)
+    sim = sim_base.Simulation(N_particles, dt_control, dt_predict, end_time, pf, seed=monte_carlo)
     sim.simulate()
     ans = sim.performance, sim.mpc_frac, sim.predict_count, sim.update_count, sim.covariance_point_size
     return ans
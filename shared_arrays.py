@@ -0,0 +1,98 @@
+import os
+import multiprocessing.shared_memory
+import multiprocessing.resource_tracker
+import numpy
+
+
+class SharedArrays:
+    """A picklable handle to arrays stored in `multiprocessing.shared_memory` blocks.
+    Pickling the handle only sends the block names, shapes and data types,
+    so worker processes can attach to large arrays without copying them.
+
+    Parameters
+    ----------
+    arrays : dict
+        Arrays to be copied into shared memory, keyed by name.
+        GPU arrays are copied to the host first
+
+    attributes : dict, optional
+        Small picklable values that travel with the handle
+
+    Attributes
+    -----------
+    attributes : dict
+        Small picklable values that travel with the handle
+    """
+    def __init__(self, arrays, attributes=None):
+        self.attributes = {} if attributes is None else attributes
+        self._owner = os.getpid()
+        self._specs = {}
+        self._blocks = {}
+
+        for name, array in arrays.items():
+            # cupy arrays have to be copied to the host explicitly
+            array = numpy.asarray(array.get() if hasattr(array, 'get') else array)
+            block = multiprocessing.shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            numpy.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self._specs[name] = block.name, array.shape, array.dtype.str
+            self._blocks[name] = block
+
+    def __getstate__(self):
+        return {'attributes': self.attributes, '_owner': self._owner, '_specs': self._specs}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._blocks = {}
+
+    def __contains__(self, name):
+        return name in self._specs
+
+    def __getitem__(self, name):
+        """Returns a zero-copy view of an array, attaching to its block if needed.
+        The view is only valid while this handle is alive and open.
+
+        Parameters
+        ----------
+        name : str
+            Name of the array
+
+        Returns
+        -------
+        view : numpy.array
+            An array backed by the shared memory block
+        """
+        block_name, shape, dtype = self._specs[name]
+        if name not in self._blocks:
+            block = multiprocessing.shared_memory.SharedMemory(name=block_name)
+            if os.getpid() != self._owner:
+                # Only the creating process may unlink the block
+                # noinspection PyProtectedMember
+                multiprocessing.resource_tracker.unregister(block._name, 'shared_memory')
+            self._blocks[name] = block
+        return numpy.ndarray(shape, numpy.dtype(dtype), buffer=self._blocks[name].buf)
+
+    def _nested(self):
+        """Returns the handles stored in the attributes"""
+        return [value for value in self.attributes.values() if isinstance(value, SharedArrays)]
+
+    def close(self):
+        """Detaches this process from the blocks, including those of nested handles.
+        Views returned by this handle must not be used afterwards"""
+        for block in self._blocks.values():
+            block.close()
+        self._blocks = {}
+
+        for nested in self._nested():
+            nested.close()
+
+    def unlink(self):
+        """Frees the blocks, including those of nested handles.
+        Should be called once, by the creating process, when all workers are done"""
+        self.close()
+        for block_name, _, _ in self._specs.values():
+            block = multiprocessing.shared_memory.SharedMemory(name=block_name)
+            block.close()
+            block.unlink()
+
+        for nested in self._nested():
+            nested.unlink()
@@ -1,13 +1,19 @@
+import functools
 import numpy
 import cupy
 import controller
 import model.LinearModel
+import model.integrators
 import gaussian_sum_dist.MultivariateGaussianSum
 import filter.particle
 import scipy.integrate
 
+# Controllers with the same control period share a set-up solver workspace
+mpc_cache = controller.MPCCache()
 
-def get_parts(dt_control=1, N_particles=2*15, gpu=True, pf=True):
+
+def get_parts(dt_control=1, N_particles=2*15, gpu=True, pf=True, seed=None, qmc=False, time_budget=None,
+              integrator='euler'):
     """Returns the parts needed for a closedloop simulation.
     Allows customization of the control period, number of particles
     and whether the simulation should use the GPU implementation or
@@ -28,6 +34,22 @@ def get_parts(dt_control=1, N_particles=2*15, gpu=True, pf=True):
         If `True` then the particle filter is used
         otherwise, the GSF is used
 
+    seed : {None, int, numpy.random.SeedSequence}, optional
+        Seed for the filter's random number streams.
+        If `None` the global random states are used
+
+    qmc : bool, optional
+        Should the filter use quasi-Monte Carlo samples
+        for its initial particles and state noise?
+
+    time_budget : float, optional
+        Wall-clock budget in seconds for each MPC step.
+        See `controller.MPC`
+
+    integrator : {'euler', 'heun', 'rk4', 'rk23'}, optional
+        The method the bioreactor is integrated with, see `model.integrators`.
+        The CPU filters' predictions use the same method
+
     Returns
     -------
     bioreactor : model.Bioreactor
@@ -37,7 +59,9 @@ def get_parts(dt_control=1, N_particles=2*15, gpu=True, pf=True):
         Linear system model
 
     K : controller.MPC
-        MPC controller
+        MPC controller.
+        Shares its solver workspace with previous controllers
+        that have the same control period, see `mpc_cache`
 
     pf : {filter.ParticleFilter, filter.ParallelParticleFilter}
         Particle filter
@@ -49,21 +73,12 @@ def get_parts(dt_control=1, N_particles=2*15, gpu=True, pf=True):
             #            Ng,         Nx,      Nfa, Ne, Nh
             numpy.array([260/180, 640/24.6, 1000/116, 0, 0])
         ),
-        high_N=False
+        high_N=False,
+        integrator=integrator
     )
 
-    # Linear model
-    lin_model = model.LinearModel.create_LinearModel(
-        bioreactor,
-        x_bar=model.Bioreactor.find_SS(
-            numpy.array([0.04, 0.1]),
-            #           Ng,         Nx,      Nfa, Ne, Nh
-            numpy.array([260/180, 640/24.6, 1000/116, 0, 0])
-        ),
-        #          Fg_in (L/h), Cg (mol/L), Fm_in (L/h)
-        u_bar=numpy.array([0.04, 0.1]),
-        T=dt_control
-    )
+    # Linear model, discretised from the shared linearisation
+    lin_model = _linearisation().discretize(dt_control)
     #  Select states, outputs and inputs for MPC
     lin_model.select_subset(
         states=[0, 2],  # Cg, Cfa
@@ -72,7 +87,7 @@ def get_parts(dt_control=1, N_particles=2*15, gpu=True, pf=True):
     )
 
     # Controller
-    K = controller.MPC(
+    K = mpc_cache.get(
         P=int(300//dt_control),
         M=max(int(200//dt_control), 1),
         Q=numpy.diag([0.1, 1]),
@@ -82,7 +97,8 @@ def get_parts(dt_control=1, N_particles=2*15, gpu=True, pf=True):
         u_bounds=[
             numpy.array([0, numpy.inf]) - lin_model.u_bar[0],
             numpy.array([0, numpy.inf]) - lin_model.u_bar[1]
-        ]
+        ],
+        time_budget=time_budget
     )
 
     # Filter
@@ -99,22 +115,61 @@ def get_parts(dt_control=1, N_particles=2*15, gpu=True, pf=True):
             my_filter = filter.GaussianSumUnscentedKalmanFilter
         my_library = numpy
 
-    state_pdf, measurement_pdf = get_noise(my_library)
-    x0, _ = get_noise(my_library)
+    if seed is None:
+        noise_rng, resample_rng = None, None
+    else:
+        noise_seed, resample_seed = _seed_sequence(seed).spawn(2)
+        noise_rng, = spawn_rngs(1, noise_seed, my_library)
+        resample_rng, = spawn_rngs(1, resample_seed)
+
+    state_pdf, measurement_pdf = get_noise(my_library, rng=noise_rng)
+    x0, _ = get_noise(my_library, rng=noise_rng)
     x0.means += my_library.array(bioreactor.X[numpy.newaxis, :])
+    # The GPU filters compile the bound kernels, and the CPU filters evaluate all the particles in one call
+    functions = {'f': bioreactor.bind('rhs'), 'g': bioreactor.bind('output', outputs=[0, 2])}
+    if not gpu:
+        functions['vectorized'] = True
+        if integrator != 'euler':
+            functions['f'] = model.integrators.Transition(functions['f'], integrator)
     pf = my_filter(
-        f=bioreactor.homeostatic_DEs,
-        g=bioreactor.static_outputs,
         N_particles=N_particles,
         x0=x0,
         state_pdf=state_pdf,
-        measurement_pdf=measurement_pdf
+        measurement_pdf=measurement_pdf,
+        rng=resample_rng,
+        qmc=qmc,
+        qmc_noise=qmc,
+        **functions
     )
 
     return bioreactor, lin_model, K, pf
 
 
-def get_noise(lib=cupy, deterministic=False):
+@functools.lru_cache(maxsize=None)
+def _linearisation():
+    """Returns the linearisation of the bioreactor used by the controllers.
+    It is computed once, and `model.LinearModel.discretize` gives it for each control period
+
+    Returns
+    -------
+    lin_model : model.LinearModel
+        The linear model, discretised with a sampling interval of one minute
+    """
+    x_bar = model.Bioreactor.find_SS(
+        numpy.array([0.04, 0.1]),
+        #           Ng,         Nx,      Nfa, Ne, Nh
+        numpy.array([260/180, 640/24.6, 1000/116, 0, 0])
+    )
+    return model.LinearModel.create_LinearModel(
+        model.Bioreactor(X0=x_bar, high_N=False),
+        x_bar=x_bar,
+        #          Fg_in (L/h), Cg (mol/L), Fm_in (L/h)
+        u_bar=numpy.array([0.04, 0.1]),
+        T=1
+    )
+
+
+def get_noise(lib=cupy, deterministic=False, rng=None):
     """Returns measurement and state noise.
     Allows customization of whether the simulation should use the GPU
     implementation or CPU implementation, and whether a
@@ -129,6 +184,10 @@ def get_noise(lib=cupy, deterministic=False):
     deterministic : bool, optional
      Should a deterministic version be used?
 
+    rng : {numpy.random.Generator, cupy.random.RandomState}, optional
+        The random number stream shared by the noise objects.
+        Defaults to the global random state of `lib`
+
     Returns
     -------
     state_pdf, measurement_pdf : {gaussian_sum_dist.MultivariateGaussianSum, gaussian_sum_dist.DeterministicGaussianSum}
@@ -145,7 +204,9 @@ def get_noise(lib=cupy, deterministic=False):
             numpy.diag([1e-3, 1e-6, 1e-2, 1e-2, 1e-6])
         ]),
         weights=numpy.array([0.75, 0.25]),
-        library=lib
+        library=lib,
+        rng=rng,
+        covariance_type='diagonal'
     )
     measurement_pdf = distribution(
         means=numpy.array([[1e-1, 0],
@@ -156,7 +217,8 @@ def get_noise(lib=cupy, deterministic=False):
                                  [[500, 100],
                                   [100, 700]]]),
         weights=numpy.array([0.85, 0.15]),
-        library=lib
+        library=lib,
+        rng=rng
     )
     return state_pdf, measurement_pdf
 
@@ -181,44 +243,148 @@ def performance(ys, r, ts):
         Integral of the Time Absolute Error
     """
     se = (ys - r)**2
-    ise = sum([scipy.integrate.simps(se_ax * ts, ts) for se_ax in numpy.rollaxis(se, 1)])
+    ise = sum([scipy.integrate.simpson(se_ax * ts, x=ts) for se_ax in numpy.rollaxis(se, 1)])
     return ise
 
 
-def get_random_io():
+def get_random_io(rng=None):
     """Get random system input and output for simulations
 
+    Parameters
+    ----------
+    rng : numpy.random.Generator, optional
+        The random number stream.
+        Defaults to the global numpy random state
+
     Returns
     -------
     u, y : numpy.array
         Random inputs and outputs, respectively
     """
+    if rng is None:
+        rng = numpy.random
+
     u = numpy.array([
-        numpy.random.uniform(low=0, high=0.1),
-        numpy.random.uniform(low=0, high=0.2)
+        rng.uniform(low=0, high=0.1),
+        rng.uniform(low=0, high=0.2)
     ])
     y = numpy.array([
-        numpy.random.uniform(low=0.25, high=0.3),
-        numpy.random.uniform(low=0.8, high=0.9)
+        rng.uniform(low=0.25, high=0.3),
+        rng.uniform(low=0.8, high=0.9)
     ])
     return u, y
 
 
+def _seed_sequence(seed):
+    """Wraps a seed in a `numpy.random.SeedSequence` if it is not one already"""
+    if isinstance(seed, numpy.random.SeedSequence):
+        return seed
+    return numpy.random.SeedSequence(seed)
+
+
+def spawn_rngs(N, seed=None, lib=numpy):
+    """Returns independent random number streams that are reproducible from a single seed.
+    Useful for giving every Monte Carlo replicate or worker its own stream.
+
+    Parameters
+    ----------
+    N : int
+        Number of streams
+
+    seed : {None, int, numpy.random.SeedSequence}, optional
+        The root seed.
+        If `None` then fresh entropy is drawn from the operating system
+
+    lib : {numpy, cupy}, optional
+        The library the streams should generate arrays for
+
+    Returns
+    -------
+    rngs : list
+        A list of `N` `numpy.random.Generator` or `cupy.random.RandomState` objects
+    """
+    children = _seed_sequence(seed).spawn(N)
+    if lib is numpy:
+        return [numpy.random.default_rng(child) for child in children]
+    return [lib.random.RandomState(int(child.generate_state(1)[0])) for child in children]
+
+
 class Simulation:
-    """Holds details of a simulation"""
-    def __init__(self, N_particles, dt_control, dt_predict, end_time=50, pf=True):
+    """Holds details of a simulation
+
+    Parameters
+    ----------
+    N_particles : int
+        Number of particles
+
+    dt_control, dt_predict : float
+        Control and prediction periods
+
+    end_time : float, optional
+        Simulation end time
+
+    pf : bool, optional
+        Should the filter be the particle filter or gaussian sum filter
+
+    seed : {None, int, numpy.random.SeedSequence}, optional
+        Seed from which the filter and plant noise streams are spawned.
+        If `None` the global random states are used
+
+    time_budget : float, optional
+        Wall-clock budget in seconds for each MPC step.
+        When the budget runs out the controller falls back to its best
+        available move instead of the hardcoded input, see `controller.MPC`
+
+    async_control : {None, 'overlap', 'delay'}, optional
+        Runs the MPC on a worker thread, see `controller.AsyncController`.
+        'overlap' starts the MPC from the estimate after the filter's update
+        and resamples while it solves.
+        The filter's predictions need the new input, so they can not overlap the solve.
+        'delay' applies each control input one control period late,
+        so the solve overlaps with the plant and the filter's predictions.
+        The controller compensates by solving from the state it predicts
+        one control period ahead.
+        If `None` then the MPC runs after the filter
+
+    plant : model.BioreactorFleet, optional
+        A fleet of reactors that is simulated as the plant instead of
+        the bioreactor of `get_parts`.
+        All the reactors get the controller's inputs, while the filter and
+        controller follow the first reactor, whose outputs give the performance.
+        The stored states and outputs have a reactor axis
+
+    gpu : bool, optional
+        Should the filter run on the GPU, see `get_parts`
+    """
+    def __init__(self, N_particles, dt_control, dt_predict, end_time=50, pf=True, seed=None, time_budget=None,
+                 async_control=None, plant=None, gpu=True):
         self.ts = numpy.linspace(0, end_time, end_time*10)
         self.dt = self.ts[1]
         self.dt_control = dt_control
         self.dt_predict = dt_predict
 
+        library = cupy if gpu else numpy
+        if seed is None:
+            filter_seed, plant_rng = None, None
+        else:
+            filter_seed, plant_seed = _seed_sequence(seed).spawn(2)
+            plant_rng, = spawn_rngs(1, plant_seed, library)
+
         self.bioreactor, self.lin_model, self.K, self.f = get_parts(
             dt_control=dt_control,
             N_particles=N_particles,
-            pf=pf
+            pf=pf,
+            seed=filter_seed,
+            time_budget=time_budget,
+            gpu=gpu
         )
+        if plant is not None:
+            self.bioreactor = plant
+        self.async_control = async_control
+        if async_control is not None:
+            self.K = controller.AsyncController(self.K, delay=async_control == 'delay')
 
-        self.state_pdf, self.measurement_pdf = get_noise()
+        self.state_pdf, self.measurement_pdf = get_noise(lib=library, rng=plant_rng)
 
         self.us = [numpy.array([0.06, 0.2])]
         self.xs = [self.bioreactor.X.copy()]
@@ -238,8 +404,14 @@ class Simulation:
         self.biass = []
         self.performance = None
         self.mpc_frac = None
+        self.mpc_telemetry = None
         self.predict_count, self.update_count = 0, 0
 
+    def _followed(self, values):
+        """Returns the (... x N) values of the reactor followed by the filter and controller,
+        which is the first reactor of a fleet"""
+        return values[..., 0, :] if self.bioreactor.X.ndim > 1 else values
+
     def simulate(self):
         """Performs a simulation using the simulation parameters"""
         t_next_control, t_next_predict = 0, 0
@@ -252,23 +424,32 @@ class Simulation:
 
             if t > t_next_control:
                 U_temp = self.us[-1].copy()
+                y_meas = self._followed(self.ys_meas[-1])
                 if self.K.y_predicted is not None:
-                    self.biass.append(self.lin_model.yn2d(self.ys_meas[-1]) - self.K.y_predicted)
+                    self.biass.append(self.lin_model.yn2d(y_meas) - self.K.y_predicted)
 
-                self.f.update(self.us[-1], self.ys_meas[-1][self.lin_model.outputs])
-                self.f.resample()
+                self.f.update(self.us[-1], y_meas[self.lin_model.outputs])
                 self.update_count += 1
 
-                self.xs_f.append(self.f.point_estimate())
-                # noinspection PyBroadException
+                mpc_arguments = [
+                    self.lin_model.un2d(self.us[-1]),
+                    self.lin_model.yn2d(y_meas)
+                ]
+                if self.async_control == 'overlap':
+                    self.xs_f.append(self.f.point_estimate())
+                    self.K.submit(self.lin_model.xn2d(self.xs_f[-1]), *mpc_arguments)
+                    self.f.resample()
+                else:
+                    self.f.resample()
+                    self.xs_f.append(self.f.point_estimate())
+
                 try:
-                    u = self.K.step(
-                        self.lin_model.xn2d(self.xs_f[-1]),
-                        self.lin_model.un2d(self.us[-1]),
-                        self.lin_model.yn2d(self.ys_meas[-1])
-                    )
+                    if self.async_control == 'overlap':
+                        u = self.K.result()
+                    else:
+                        u = self.K.step(self.lin_model.xn2d(self.xs_f[-1]), *mpc_arguments)
                     mpc_converged += 1
-                except:
+                except ValueError:
                     u = numpy.array([0.06, 0.2])
                     mpc_no_converged += 1
                 U_temp[self.lin_model.inputs] = self.lin_model.ud2n(u)
@@ -278,11 +459,12 @@ class Simulation:
                 self.us.append(self.us[-1])
 
             self.bioreactor.step(self.dt, self.us[-1])
-            self.bioreactor.X += self.state_pdf.draw().get().squeeze()
-            outputs = self.bioreactor.outputs(self.us[-1])
-            self.ys.append(outputs.copy())
-            outputs[self.lin_model.outputs] += self.measurement_pdf.draw().get().squeeze()
-            self.ys_meas.append(outputs)
+            self.bioreactor.add_noise(self.state_pdf)
+            outputs, measured_outputs = self.bioreactor.measured_outputs(
+                self.us[-1], self.measurement_pdf, self.lin_model.outputs
+            )
+            self.ys.append(outputs)
+            self.ys_meas.append(measured_outputs)
             self.xs.append(self.bioreactor.X.copy())
             self.ys_f.append(
                 numpy.array(
@@ -302,8 +484,11 @@ class Simulation:
         self.ys_f = numpy.array(self.ys_f)
         self.covariance_point_size = numpy.array(self.covariance_point_size)
         self.performance = performance(
-            self.ys[:, self.lin_model.outputs],
+            self._followed(self.ys[..., self.lin_model.outputs]),
             self.ys_f,
             self.ts
         )
         self.mpc_frac = mpc_converged / (mpc_converged + mpc_no_converged)
+        self.mpc_telemetry = self.K.telemetry_summary()
+        if self.async_control is not None:
+            self.K.close()
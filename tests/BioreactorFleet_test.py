@@ -0,0 +1,54 @@
+import numpy
+import model
+
+
+class ConstantNoise:
+    """Stands in for a noise distribution, drawing 1, 2, 3, ... in turn"""
+    def __init__(self, Nx):
+        self.Nx = Nx
+        self.count = 0
+
+    def draw(self, N):
+        values = numpy.arange(self.count, self.count + N * self.Nx).reshape(N, self.Nx) + 1.
+        self.count += N * self.Nx
+        return values
+
+
+def test_fleet():
+    rng = numpy.random.default_rng(0)
+    X0s = numpy.array([3000 / 180, 1 / 24.6, 0, 0, 0]) * rng.uniform(0.5, 1.5, (6, 5))
+    us = rng.uniform(0, 0.1, (6, 2))
+    high_N = numpy.array([True, False, True, False, False, True])
+
+    fleet = model.BioreactorFleet(X0s, high_N=high_N, integrator='rk4')
+    bioreactors = [model.Bioreactor(X0, high_N=h, integrator='rk4') for X0, h in zip(X0s, high_N)]
+    assert fleet.N_reactors == 6
+
+    for _ in range(50):
+        fleet.step(0.5, us)
+        for bioreactor, u in zip(bioreactors, us):
+            bioreactor.step(0.5, u)
+
+    for i, bioreactor in enumerate(bioreactors):
+        numpy.testing.assert_allclose(fleet.X[i], bioreactor.X, rtol=1e-12, atol=1e-14)
+        numpy.testing.assert_allclose(fleet.outputs(us)[i], bioreactor.outputs(us[i]), rtol=1e-12)
+
+    # A single input is shared by all the reactors
+    fleet = model.BioreactorFleet(X0s[0], high_N=False, N_reactors=3)
+    fleet.step(0.1, us[0])
+    assert fleet.X.shape == (3, 5) and numpy.all(fleet.X == fleet.X[0])
+
+
+def test_fleet_noise():
+    fleet = model.BioreactorFleet(numpy.zeros(5), high_N=False, N_reactors=2)
+    fleet.add_noise(ConstantNoise(5))
+    numpy.testing.assert_array_equal(fleet.X, numpy.arange(1., 11).reshape(2, 5))
+
+    outputs, measured = fleet.measured_outputs(numpy.zeros(2), ConstantNoise(2), [0, 2])
+    numpy.testing.assert_array_equal(outputs, fleet.X * [180, 24.6, 116, 46, 1])
+    numpy.testing.assert_array_equal(measured - outputs, [[1, 0, 2, 0, 0], [3, 0, 4, 0, 0]])
+
+    # A single reactor draws one sample, as the simulations did
+    bioreactor = model.Bioreactor(numpy.zeros(5), high_N=False)
+    bioreactor.add_noise(ConstantNoise(5))
+    numpy.testing.assert_array_equal(bioreactor.X, numpy.arange(1., 6))
@@ -0,0 +1,58 @@
+import numpy
+import pytest
+import model
+import tests.mpc_tests.LinkedTanks as LinkedTanks
+
+
+def operating_point(point):
+    return point, numpy.array([10., 12.])
+
+
+def test_linear_model_bank():
+    tanks = LinkedTanks.LinkedTanks(numpy.array([50., 60.]))
+    axes = [numpy.array([20., 40., 80.]), numpy.array([30., 60.])]
+    bank = model.LinearModelBank.create_LinearModelBank(tanks, axes, operating_point, T=1, method='dual')
+    assert bank.A.shape == (3, 2, 2, 2) and bank.y_bar.shape == (3, 2, 2)
+
+    # At the grid points both lookups give the linearisation there
+    for point in [[20., 30.], [80., 60.], [40., 30.]]:
+        expected = model.LinearModel.create_LinearModel(tanks, *operating_point(numpy.array(point)), T=1,
+                                                        method='dual')
+        for linear_model in [bank.nearest(point), bank.interpolate(point)]:
+            for name in model.LinearModelBank._fields:
+                numpy.testing.assert_allclose(getattr(linear_model, name), getattr(expected, name))
+
+    # Inside a cell the corners are weighted by their closeness
+    interpolated = bank.interpolate([50., 37.5])
+    corners = [bank.models[i] for i in [2, 3, 4, 5]]
+    weights = [0.75*0.75, 0.75*0.25, 0.25*0.75, 0.25*0.25]
+    numpy.testing.assert_allclose(interpolated.A, sum(w*m.A for w, m in zip(weights, corners)))
+    numpy.testing.assert_allclose(interpolated.x_bar, [50., 37.5])
+    assert bank.nearest([50., 37.5]) is bank.models[2]
+
+    # Points outside the grid use its edge
+    numpy.testing.assert_allclose(bank.interpolate([100., 0.]).A, bank.models[4].A)
+
+    bank.select_subset(states=[0], inputs=[1], outputs=[0])
+    linear_model = bank.interpolate([50., 37.5])
+    assert linear_model.A.shape == (1, 1) and bank.B.shape == (3, 2, 1, 1)
+    assert list(linear_model.outputs) == [0]
+
+    with pytest.raises(ValueError):
+        model.LinearModelBank(bank.models[:5], axes)
+
+
+def test_even_axes():
+    tanks = LinkedTanks.LinkedTanks(numpy.array([50., 60.]))
+    axes = [numpy.linspace(20., 80., 7), numpy.array([30., 40., 60.])]
+    bank = model.LinearModelBank.create_LinearModelBank(tanks, axes, operating_point, T=1)
+    assert bank._steps[0] == pytest.approx(10.) and bank._steps[1] is None
+
+    # The cells found directly on the even axis match a binary search
+    for point in numpy.random.default_rng(0).uniform([10., 20.], [90., 70.], size=(200, 2)):
+        lowers, fractions = bank._cells(point)
+        p = numpy.clip(point[0], 20., 80.)
+        i = min(numpy.searchsorted(axes[0], p, side='right') - 1, 5)
+        assert lowers[0] == i or fractions[0] in [0., 1.]
+        assert axes[0][lowers[0]] + fractions[0] * 10. == pytest.approx(p)
+        assert 0 <= fractions[1] <= 1
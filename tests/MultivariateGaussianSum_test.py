@@ -1,5 +1,8 @@
+import multiprocessing
 import numpy
 import cupy
+import sim_base
+import pytest
 from gaussian_sum_dist.MultivariateGaussianSum import MultivariateGaussianSum
 
 m = MultivariateGaussianSum(
@@ -16,3 +19,133 @@ x = cupy.array([-10, -10])
 pdf_test = m.pdf(x)
 
 draw_test = m.draw(10)
+
+
+def test_spawned_streams():
+    def draw(rng):
+        m_cpu = MultivariateGaussianSum(
+            means=numpy.array([[10, 0],
+                               [-10, -10]]),
+            covariances=numpy.array([[[1, 0],
+                                      [0, 1]],
+
+                                     [[2, 0.5],
+                                      [0.5, 0.5]]]),
+            weights=numpy.array([0.3, 0.7]),
+            library=numpy,
+            rng=rng)
+        return m_cpu.draw(100)
+
+    first, second = sim_base.spawn_rngs(2, seed=42)
+    first_again, _ = sim_base.spawn_rngs(2, seed=42)
+
+    assert numpy.array_equal(draw(first), draw(first_again))
+    assert not numpy.array_equal(draw(first), draw(second))
+
+
+def test_qmc_draw():
+    m_cpu = MultivariateGaussianSum(
+        means=numpy.array([[10, 0],
+                           [-10, -10]]),
+        covariances=numpy.array([[[1, 0],
+                                  [0, 1]],
+
+                                 [[2, 0.5],
+                                  [0.5, 0.5]]]),
+        weights=numpy.array([0.3, 0.7]),
+        library=numpy,
+        rng=numpy.random.default_rng(0))
+
+    samples = m_cpu.draw((8, 128), qmc=True)
+    assert samples.shape == (8, 128, 2)
+
+    flat = samples.reshape(-1, 2)
+    # Stratified allocation gives exactly 30 % of the samples to the first Gaussian
+    assert numpy.sum(flat[:, 0] > 0) == int(0.3 * flat.shape[0])
+    assert numpy.allclose(flat.mean(axis=0), [0.3*10 - 0.7*10, -0.7*10], atol=5e-2)
+
+
+def test_qmc_streams():
+    # Equal Gaussians, so that correlated point sets would give equal samples
+    for rng in [numpy.random.default_rng(0), numpy.random.RandomState(0)]:
+        m = MultivariateGaussianSum(
+            means=numpy.zeros((2, 2)),
+            covariances=numpy.array([numpy.eye(2), numpy.eye(2)]),
+            weights=numpy.array([0.5, 0.5]),
+            library=numpy,
+            rng=rng)
+
+        first, second = numpy.split(m.draw(64, qmc=True), 2)
+        assert not numpy.allclose(first, second)
+
+
+def test_diagonal_fast_path():
+    means = numpy.array([[1e-3, 0, 1],
+                         [0, -1e-3, 0]])
+    covariances = numpy.array([numpy.diag([1e-4, 1e-5, 1e-3]),
+                               numpy.diag([2e-4, 2e-4, 2e-4])])
+    weights = numpy.array([0.5, 0.5])
+
+    full = MultivariateGaussianSum(means, covariances, weights, library=numpy, covariance_type='full')
+    diagonal = MultivariateGaussianSum(means, covariances, weights, library=numpy)
+    assert diagonal.covariance_type == 'diagonal'
+
+    xs = diagonal.draw(50)
+    assert numpy.allclose(full.pdf(xs), diagonal.pdf(xs), rtol=1e-4)
+
+    isotropic = MultivariateGaussianSum(means[1:], covariances[1:], weights[1:], library=numpy)
+    full = MultivariateGaussianSum(means[1:], covariances[1:], weights[1:], library=numpy, covariance_type='full')
+    assert isotropic.covariance_type == 'isotropic'
+    assert numpy.allclose(full.pdf(xs), isotropic.pdf(xs), rtol=1e-4)
+
+    with pytest.raises(ValueError):
+        MultivariateGaussianSum(means, covariances, weights, library=numpy, covariance_type='isotropic')
+
+
+def test_cpu_kernels():
+    m_cpu = MultivariateGaussianSum(
+        means=numpy.array([[10, 0],
+                           [-10, -10]]),
+        covariances=numpy.array([[[1, 0],
+                                  [0, 1]],
+
+                                 [[2, 0.5],
+                                  [0.5, 0.5]]]),
+        weights=numpy.array([0.3, 0.7]),
+        library=numpy)
+
+    xs = m_cpu.draw(100)
+    es = xs[:, None, :] - m_cpu.means[None, :, :]
+    exponents = numpy.einsum('mdi,dij,mdj->md', es, m_cpu._inverse_covariances, es)
+    expected = numpy.sum(m_cpu._constants * m_cpu.weights * numpy.exp(-0.5*exponents), axis=1)
+
+    assert numpy.allclose(m_cpu.pdf(xs), expected, rtol=1e-5)
+    assert numpy.allclose(m_cpu.logpdf(xs), numpy.log(expected), rtol=1e-5)
+    assert numpy.isfinite(m_cpu.logpdf(numpy.array([1e3, 1e3])))
+
+
+def _attached_pdf(shared, xs):
+    attached = MultivariateGaussianSum.from_shared_memory(shared)
+    return attached.pdf(xs), attached.covariance_type
+
+
+def test_shared_memory():
+    m_cpu = MultivariateGaussianSum(
+        means=numpy.array([[10, 0],
+                           [-10, -10]]),
+        covariances=numpy.array([[[1, 0],
+                                  [0, 1]],
+
+                                 [[2, 0.5],
+                                  [0.5, 0.5]]]),
+        weights=numpy.array([0.3, 0.7]),
+        library=numpy)
+    shared = m_cpu.to_shared_memory()
+    xs = m_cpu.draw(20)
+
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        pdf, covariance_type = pool.apply(_attached_pdf, (shared, xs))
+
+    assert covariance_type == m_cpu.covariance_type
+    numpy.testing.assert_allclose(pdf, m_cpu.pdf(xs), rtol=1e-6)
+    shared.unlink()
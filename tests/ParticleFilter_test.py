@@ -1,3 +1,4 @@
+import multiprocessing
 import numpy
 from filter.particle import ParticleFilter
 from gaussian_sum_dist.MultivariateGaussianSum import MultivariateGaussianSum
@@ -66,3 +67,38 @@ def test_ParticleFilter_update():
 
 def test_ParticleFilter_resample():
     p.resample()
+
+
+def f_vectorized(xs, u, dt):
+    return numpy.stack(f(numpy.moveaxis(xs, -1, 0), u, dt), axis=-1)
+
+
+def g_vectorized(xs, u):
+    return numpy.stack(g(numpy.moveaxis(xs, -1, 0), u), axis=-1)
+
+
+def _attached_estimate(shared, seed):
+    attached = ParticleFilter.from_shared_memory(shared, noise_rng=numpy.random.default_rng(seed))
+    attached.predict([1.], 1)
+    attached.update([1.], numpy.array([2.3, 1.2]))
+    return attached.point_estimate()
+
+
+def test_shared_memory():
+    p_vectorized = ParticleFilter(f_vectorized, g_vectorized, 10, x0, state_noise, measurement_noise,
+                                  vectorized=True)
+    first, second = p_vectorized.to_shared_memory(), p_vectorized.to_shared_memory()
+
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        estimate = pool.apply(_attached_estimate, (first, 0))
+
+    # The worker's filter is the same as one attached in this process
+    numpy.testing.assert_allclose(estimate, _attached_estimate(second, 0))
+
+    # Until it resamples, an attached filter changes the shared particles and weights in place
+    numpy.testing.assert_array_equal(first['particles'], second['particles'])
+    numpy.testing.assert_array_equal(first['weights'], second['weights'])
+    assert not numpy.array_equal(first['particles'], p_vectorized.particles)
+
+    first.unlink()
+    second.unlink()
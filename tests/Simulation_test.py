@@ -0,0 +1,19 @@
+import numpy
+import model
+import sim_base
+
+
+def test_fleet_plant():
+    bioreactor, _, _, _ = sim_base.get_parts(gpu=False)
+    plant = model.BioreactorFleet(bioreactor.X, high_N=False, N_reactors=3)
+    plant.X[1:, 0] *= [0.9, 1.1]
+
+    sim = sim_base.Simulation(N_particles=30, dt_control=1, dt_predict=1, end_time=5, seed=0,
+                              plant=plant, gpu=False)
+    sim.simulate()
+
+    N_steps = sim.ts.size
+    assert sim.xs.shape == (N_steps, 3, 5) and sim.ys.shape == (N_steps, 3, 5)
+    assert sim.us.shape == (N_steps, 2) and sim.ys_f.shape == (N_steps, 2)
+    assert numpy.all(sim.xs[-1, 1:] != sim.xs[-1, 0])
+    assert numpy.isfinite(sim.performance)
@@ -1,6 +1,7 @@
 import numpy
 import model
 import pytest
+import scipy.signal
 
 
 def test_linearise():
@@ -26,3 +27,57 @@ def test_linearise():
         )
 
     assert lin_model.A[0, 0] == pytest.approx(0.72648)
+
+
+@pytest.mark.parametrize('high_N', [False, True])
+def test_batch_difference(high_N):
+    bioreactor = model.Bioreactor(X0=numpy.zeros(5), high_N=high_N)
+    rng = numpy.random.default_rng(0)
+    xs, us = rng.normal(2, 3, (10, 5)), rng.uniform(0, 0.2, (10, 2))
+    numpy.testing.assert_allclose(
+        bioreactor.batch_DEs(xs, us), model.NonlinearModel.batch_DEs(bioreactor, xs, us), atol=1e-14
+    )
+    numpy.testing.assert_allclose(
+        bioreactor.batch_outputs(xs, us), model.NonlinearModel.batch_outputs(bioreactor, xs, us)
+    )
+
+    x_bar = numpy.array([1.5, 26., 9.8, 1e-3, 52.])
+    u_bar = numpy.array([0.04, 0.1])
+    batch = model.LinearModel.create_LinearModel(bioreactor, x_bar, u_bar, 1, method='batch_difference')
+    dual = model.LinearModel.create_LinearModel(bioreactor, x_bar, u_bar, 1, method='dual')
+    for m in ['A', 'B', 'C', 'D', 'f_bar', 'y_bar']:
+        numpy.testing.assert_allclose(getattr(batch, m), getattr(dual, m), atol=1e-10)
+
+
+def test_discretize():
+    x_bar = numpy.array([1.5, 26., 9.8, 1e-3, 52.])
+    u_bar = numpy.array([0.04, 0.1])
+    bioreactor = model.Bioreactor(X0=x_bar, high_N=False)
+    lin_model = model.LinearModel.create_LinearModel(bioreactor, x_bar, u_bar, 1, method='dual')
+    lin_model.select_subset(states=[0, 2], inputs=[0, 1], outputs=[0, 2])
+
+    for T in [0.1, 2.5, 30]:
+        expected = model.LinearModel.create_LinearModel(bioreactor, x_bar, u_bar, T, method='dual')
+        A, B, C, D, _ = scipy.signal.cont2discrete(
+            (lin_model._hold.A, lin_model._hold.B, lin_model._hold.C, lin_model._hold.D), T
+        )
+        numpy.testing.assert_allclose(expected.A, A, rtol=1e-12, atol=1e-14)
+        numpy.testing.assert_allclose(expected.B, B, rtol=1e-12, atol=1e-14)
+
+        # The subset is selected from the full discrete model
+        expected.select_subset(states=[0, 2], inputs=[0, 1], outputs=[0, 2])
+        discrete = lin_model.discretize(T)
+        assert discrete.T == T and list(discrete.outputs) == [0, 2]
+        for m in ['A', 'B', 'C', 'D', 'x_bar', 'u_bar', 'f_bar', 'y_bar']:
+            numpy.testing.assert_allclose(getattr(discrete, m), getattr(expected, m), rtol=1e-12, atol=1e-14)
+
+    # Models discretised at the same interval do not share their matrices
+    first, second = [lin_model.discretize(2.5) for _ in range(2)]
+    first.A[:] = 0
+    first.C[:] = 0
+    assert numpy.all(second.A == lin_model.discretize(2.5).A) and numpy.any(second.A != 0)
+    assert numpy.any(second.C != 0) and numpy.any(lin_model._hold.C != 0)
+
+    # Models that were not created from continuous matrices cannot be discretised again
+    with pytest.raises(ValueError):
+        model.LinearModel(A, B, C, D, 30, x_bar, u_bar, x_bar, x_bar).discretize(1)
@@ -49,3 +49,77 @@ def test_biomodel():
             ys[-1], [280,  632, 1121, 0, 50.5]
         )
     )
+
+
+def test_batch_functions():
+    rng = numpy.random.default_rng(0)
+    xs = rng.normal(1, 2, (4, 6, 5))
+    us = rng.uniform(0, 0.2, (6, 2))
+
+    dxs = model.Bioreactor.batch_homeostatic_DEs(xs, us, 0.1)
+    ys = model.Bioreactor.batch_static_outputs(xs, us)
+    assert dxs.shape == (4, 6, 5) and ys.shape == (4, 6, 2)
+
+    for i in range(4):
+        for j in range(6):
+            assert numpy.all(dxs[i, j] == model.Bioreactor.homeostatic_DEs(xs[i, j], us[j], 0.1))
+            assert numpy.all(ys[i, j] == model.Bioreactor.static_outputs(xs[i, j], us[j]))
+
+    # A single input is broadcast to all the states
+    numpy.testing.assert_array_equal(
+        model.Bioreactor.batch_homeostatic_DEs(xs[0], us[0]),
+        [model.Bioreactor.homeostatic_DEs(x, us[0]) for x in xs[0]]
+    )
+
+
+def test_find_SS():
+    X0 = numpy.array([260/180, 640/24.6, 1000/116, 0, 0])
+    U_op = numpy.array([0.04, 0.1])
+
+    x_ss = model.Bioreactor.find_SS(U_op, X0)
+    bioreactor = model.Bioreactor(X0=x_ss, high_N=False)
+    assert numpy.max(numpy.abs(bioreactor.DEs(U_op))) < 1e-10
+    assert x_ss[1] == X0[1]
+
+    # Results are memoized, and callers get their own copy
+    x_ss[:] = 0
+    numpy.testing.assert_array_equal(model.Bioreactor.find_SS(U_op, X0), bioreactor.X)
+
+    # Inputs without a steady state near the previous one give NaN
+    U_ops = numpy.array([[0.04, 0.1], [0.06, 0.1], [0.02, 0.3], [0.06, 0.2], [0.06, 0.3]])
+    x_sss = model.Bioreactor.find_SS_sweep(U_ops, X0)
+    assert numpy.all(numpy.isnan(x_sss[2]))
+    for U_op, x_ss in zip(U_ops[[0, 1, 3, 4]], x_sss[[0, 1, 3, 4]]):
+        bioreactor.X = x_ss
+        assert numpy.max(numpy.abs(bioreactor.DEs(U_op))) < 1e-10
+
+
+def test_high_N_DEs():
+    gamma, beta = 1.8, 0.1
+    rate_matrix = numpy.array([[1, 0, 0, 0, 0],
+                               [0, 0, 0, 1, 0],
+                               [0, 0, 0, 0, 1],
+                               [-6, 4, 7/3, 2, -6*gamma],
+                               [0, 12, -1, 0, 6*beta]])
+
+    rng = numpy.random.default_rng(0)
+    xs = rng.normal(1, 2, (20, 5))
+    us = rng.uniform(0, 0.2, (20, 2))
+    dxs = model.Bioreactor.batch_high_N_DEs(xs, us, 0.5)
+
+    for x, u, dx in zip(xs, us, dxs):
+        # The rate equations solved at each state
+        Cg, Cx, Cfa, Ce = numpy.maximum(x[:4], 0)
+        s = Cg / (1 + Cg)
+        rFAf, rTCA, _, rEf, rX = numpy.linalg.solve(rate_matrix, [s/230, s/12, s/21, 1.1*s, 0])
+        F_out = u[0] + u[1]
+        expected = numpy.array([
+            u[0] * 5000/180 - F_out * Cg + (-rFAf - rTCA - rEf - rX) * Cx,
+            6 * rX * Cx,
+            -F_out * Cfa + 2 * rFAf * Cx,
+            -F_out * Ce + 2 * rEf * Cx,
+            0
+        ]) * 0.5
+
+        numpy.testing.assert_allclose(dx, expected, rtol=1e-12, atol=1e-15)
+        numpy.testing.assert_allclose(model.Bioreactor.high_N_DEs(x, u, 0.5), dx, rtol=1e-14, atol=1e-16)
@@ -0,0 +1,51 @@
+import numpy
+import pytest
+import model
+import model.dual
+import tests.mpc_tests.LinkedTanks as LinkedTanks
+
+
+def test_dual_arithmetic():
+    x, y = model.dual.seed([2., 3.])
+
+    def fun(a, b):
+        return [
+            a * b + 1 - b / a,
+            2 / a - a ** 3 + 2 ** b,
+            numpy.sqrt(a) * numpy.exp(-b) + numpy.log(b) ** 0.5,
+            max(a, 0) + min(b, 1) + abs(-a) + a ** b
+        ]
+
+    values, jacobian = model.dual.split(fun(x, y), 2)
+    numpy.testing.assert_allclose(values, fun(2., 3.))
+
+    # Central differences of the smooth pieces
+    h = 1e-6
+    expected = numpy.array([
+        (numpy.array(fun(2. + h, 3.)) - fun(2. - h, 3.)) / 2 / h,
+        (numpy.array(fun(2., 3. + h)) - fun(2., 3. - h)) / 2 / h
+    ]).T
+    numpy.testing.assert_allclose(jacobian, expected, rtol=1e-6)
+
+
+def test_dual_linearisation():
+    tanks = LinkedTanks.LinkedTanks(numpy.array([50., 60.]))
+    x_bar, u_bar = numpy.array([50., 60.]), numpy.array([10., 12.])
+
+    finite = model.LinearModel.create_LinearModel(tanks, x_bar, u_bar, 1)
+    dual = model.LinearModel.create_LinearModel(tanks, x_bar, u_bar, 1, method='dual')
+    for m in ['A', 'B', 'C', 'D', 'f_bar', 'y_bar']:
+        numpy.testing.assert_allclose(getattr(dual, m), getattr(finite, m), atol=1e-8)
+    assert tanks.X.dtype == numpy.float64
+
+    # Away from the kinks of the rate limits the two methods agree
+    bioreactor = model.Bioreactor(X0=numpy.zeros(5), high_N=False)
+    x_bar = numpy.array([1.5, 26., 9.8, 1e-3, 52.])
+    u_bar = numpy.array([0.04, 0.1])
+    finite = model.LinearModel.create_LinearModel(bioreactor, x_bar, u_bar, 1)
+    dual = model.LinearModel.create_LinearModel(bioreactor, x_bar, u_bar, 1, method='dual')
+    for m in ['A', 'B', 'C', 'D']:
+        numpy.testing.assert_allclose(getattr(dual, m), getattr(finite, m), atol=1e-8)
+
+    with pytest.raises(ValueError):
+        model.LinearModel.create_LinearModel(bioreactor, x_bar, u_bar, 1, method='symbolic')
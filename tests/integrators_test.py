@@ -0,0 +1,72 @@
+import numpy
+import pickle
+import pytest
+import model
+import model.integrators
+
+
+def decay(x):
+    return -x
+
+
+@pytest.mark.parametrize('method, order', [('euler', 1), ('heun', 2), ('rk4', 4)])
+def test_order(method, order):
+    integrator = model.integrators.get_integrator(method)
+    errors = []
+    for dt in [0.1, 0.05]:
+        x = numpy.array([1., 2.])
+        for _ in range(int(round(1 / dt))):
+            x = integrator(decay, x, dt)
+        errors.append(numpy.max(numpy.abs(x - numpy.exp(-1) * numpy.array([1., 2.]))))
+
+    assert numpy.log2(errors[0] / errors[1]) == pytest.approx(order, abs=0.2)
+
+
+def test_rk23():
+    xs = numpy.linspace(0.5, 2, 6).reshape(3, 2)
+    x = model.integrators.rk23(decay, xs, 3., rtol=1e-8, atol=1e-10)
+    numpy.testing.assert_allclose(x, numpy.exp(-3) * xs, rtol=1e-6)
+
+    with pytest.raises(RuntimeError):
+        model.integrators.rk23(decay, xs, 3., rtol=1e-12, atol=1e-14, max_substeps=10)
+
+
+def test_transition():
+    rng = numpy.random.default_rng(0)
+    xs = model.Bioreactor.find_SS(
+        numpy.array([0.06, 0.2]),
+        numpy.array([260/180, 640/24.6, 1000/116, 0, 0])
+    ) + rng.normal(0, 0.1, (20, 5))
+    u = numpy.array([0.04, 0.1])
+
+    euler = model.integrators.Transition(model.Bioreactor.homeostatic_DEs, 'euler')
+    numpy.testing.assert_allclose(euler(xs[0], u, 0.5), model.Bioreactor.homeostatic_DEs(xs[0], u, 0.5))
+
+    # The vectorized form gives the same predictions for all the states at once
+    rk4 = pickle.loads(pickle.dumps(model.integrators.Transition(model.Bioreactor.batch_homeostatic_DEs, 'rk4', 2)))
+    rk4_single = model.integrators.Transition(model.Bioreactor.homeostatic_DEs, 'rk4', 2)
+    numpy.testing.assert_allclose(rk4(xs, u, 2.), [rk4_single(x, u, 2.) for x in xs], rtol=1e-12)
+
+
+def test_bioreactor_integrators():
+    X0 = model.Bioreactor.find_SS(
+        numpy.array([0.06, 0.2]),
+        numpy.array([260/180, 640/24.6, 1000/116, 0, 0])
+    )
+    u = numpy.array([0.04, 0.1])
+
+    def simulate(dt, **kwargs):
+        bioreactor = model.Bioreactor(X0=X0.copy(), high_N=False, **kwargs)
+        for _ in range(int(round(20 / dt))):
+            bioreactor.step(dt, u)
+        return bioreactor.outputs(u)
+
+    reference = simulate(0.1, integrator='rk23')
+    euler_error = numpy.max(numpy.abs(simulate(0.1) - reference))
+    # Steps ten times larger are more accurate with the higher order methods
+    for method in ['heun', 'rk4']:
+        assert numpy.max(numpy.abs(simulate(1., integrator=method) - reference)) < euler_error
+    numpy.testing.assert_allclose(simulate(1., integrator='rk4', substeps=4), reference, rtol=1e-6)
+
+    with pytest.raises(ValueError):
+        model.Bioreactor(X0=X0, integrator='rk45')
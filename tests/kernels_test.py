@@ -0,0 +1,57 @@
+import numpy
+import pytest
+import model
+import model.kernels
+import tests.mpc_tests.LinkedTanks as LinkedTanks
+
+
+@pytest.mark.parametrize('linear', [False, True])
+def test_kernel_variants(linear):
+    tanks = LinkedTanks.LinkedTanks(numpy.array([50., 60.]), linear=linear)
+    rng = numpy.random.default_rng(0)
+    xs, us = rng.uniform(1, 100, (3, 50, 2)), rng.uniform(0, 20, (50, 2))
+
+    expected = numpy.array([[tanks.rhs(x, u, tanks.params) for x, u in zip(x_row, us)] for x_row in xs])
+    for target in ['numpy', 'parallel']:
+        numpy.testing.assert_allclose(tanks.kernel('rhs', target)(xs, us), expected, rtol=1e-14)
+        numpy.testing.assert_allclose(tanks.kernel('output', target)(xs, us), xs)
+
+    # The derived methods use the kernels
+    tanks.X = xs[0, 0]
+    numpy.testing.assert_allclose(tanks.DEs(us[0]), expected[0, 0], rtol=1e-14)
+    numpy.testing.assert_array_equal(tanks.outputs(us[0]), xs[0, 0])
+    numpy.testing.assert_allclose(tanks.batch_DEs(xs[0], us), expected[0], rtol=1e-14)
+
+
+def test_kernel_cache():
+    tanks = [LinkedTanks.LinkedTanks(numpy.array([50., 60.])) for _ in range(2)]
+    xs, us = numpy.full((4, 2), 50.), numpy.full((4, 2), 10.)
+
+    tanks[0].batch_DEs(xs, us)
+    misses = model.kernels.get_kernel.cache_info().misses
+    tanks[1].batch_DEs(xs, us)
+    assert model.kernels.get_kernel.cache_info().misses == misses
+
+    # Different parameters are compiled separately
+    tanks[1].linear = True
+    assert not numpy.allclose(tanks[1].batch_DEs(xs, us), tanks[0].batch_DEs(xs, us))
+
+
+@pytest.mark.parametrize('high_N', [False, True])
+def test_bioreactor_kernels(high_N):
+    bioreactor = model.Bioreactor(X0=numpy.zeros(5), high_N=high_N)
+    rng = numpy.random.default_rng(0)
+    xs, us = rng.normal(2, 3, (3, 10, 5)), rng.uniform(0, 0.2, (10, 2))
+
+    expected = numpy.array([[bioreactor.rhs(x, u, bioreactor.params) for x, u in zip(x_row, us)] for x_row in xs])
+    for target in ['numpy', 'parallel']:
+        numpy.testing.assert_allclose(bioreactor.kernel('rhs', target)(xs, us), expected, rtol=1e-14, atol=1e-16)
+
+    # The kernels of each regime are the model's kernels bound to it
+    regime = model.Bioreactor.high_N_DEs if high_N else model.Bioreactor.homeostatic_DEs
+    numpy.testing.assert_array_equal(regime(xs, us, 0.5), bioreactor.bind('rhs')(xs, us, 0.5))
+    numpy.testing.assert_allclose(regime(xs, us, 0.5), expected * 0.5, rtol=1e-14, atol=1e-16)
+
+    g = bioreactor.bind('output', outputs=[0, 2])
+    numpy.testing.assert_array_equal(g(xs, us), model.Bioreactor.static_outputs(xs, us))
+    numpy.testing.assert_allclose(g.compile()(xs, us, numpy.zeros(2)), g(xs, us), rtol=1e-14)
@@ -1,36 +1,45 @@
 import numpy
 import model.NonlinearModel
-import tests.mpc_tests.TankModel as TankModel
 
 
 class DiagTank(model.NonlinearModel):
+    """Two unlinked tanks, the first with a linear and the second with a
+    nonlinear outflow, see `TankModel`"""
     def __init__(self, X0, t0=0):
         self.X = numpy.array(X0)
         self.t = t0
 
-        self.linear_tank = TankModel.TankModel(numpy.atleast_1d(X0[0]), linear=True)
-        self.nonlinear_tank = TankModel.TankModel(numpy.atleast_1d(X0[1]), linear=False)
-
-    def DEs(self, inputs):
-        """Contains the differential and algebraic equations for the system model.
+    @staticmethod
+    def rhs(x, u, params):
+        """Contains the differential equations for the system model.
 
         Parameters
         ----------
-        inputs : ndarray
-            The inputs to the system at the current time
+        x, u : ndarray
+            The states and inputs
+
+        params : tuple
+            Unused
 
         Returns
         -------
-        dX : array_like
+        dh_lin, dh_nonlin : float
             The differential changes to the state variables
         """
+        h_lin, h_nonlin = x[0], x[1]
+        F_lin, F_nonlin = u[0], u[1]
 
-        dh_lin = self.linear_tank.DEs(numpy.atleast_1d(inputs[0]))
-        dh_nonlin = self.linear_tank.DEs(numpy.atleast_1d(inputs[1]))
+        k = 0.1
+        A = 2
+        dh_lin = (F_lin - k*h_lin*A)/A
+        dh_nonlin = (F_nonlin - k * numpy.sqrt(h_nonlin * A)) / A
 
-        dX = numpy.hstack([dh_lin, dh_nonlin])
+        return dh_lin, dh_nonlin
 
-        return dX
+    @staticmethod
+    def output(x, u, params):
+        """Returns all the outputs (state and calculated)"""
+        return x[0], x[1]
 
     def step(self, dt, inputs):
         """Updates the model with inputs
@@ -46,16 +55,3 @@ class DiagTank(model.NonlinearModel):
         dX = self.DEs(inputs)
         self.X += dX*dt
         return self.outputs(inputs)
-
-    def outputs(self, inputs):
-        """Returns all the outputs (state and calculated)
-
-        Returns
-        -------
-        outputs : array_like
-            List of all the outputs from the model
-        """
-
-        outs = numpy.array(self.X)
-        _ = inputs
-        return outs.copy()
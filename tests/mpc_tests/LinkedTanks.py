@@ -8,36 +8,48 @@ class LinkedTanks(model.NonlinearModel):
         self.t = t0
         self.linear = linear
 
-    def DEs(self, inputs):
-        """Contains the differential and algebraic equations for the system model.
+    @property
+    def params(self):
+        return float(self.linear),
+
+    @staticmethod
+    def rhs(x, u, params):
+        """Contains the differential equations for the system model.
 
         Parameters
         ----------
-        inputs : ndarray
-            The inputs to the system at the current time
+        x, u : ndarray
+            The states and inputs
+
+        params : tuple
+            Whether the outflow of the first tank is linear
 
         Returns
         -------
-        dX : array_like
+        dh1, dh2 : float
             The differential changes to the state variables
         """
-        h1, h2 = self.X
-        F1_in, F2_in = inputs  # Normally on the order of (0, 0.1)
+        h1, h2 = x[0], x[1]
+        F1_in, F2_in = u[0], u[1]  # Normally on the order of (0, 0.1)
+        linear = params[0]
 
         k1, k2, k_link = 0.1, 0.3, 0.05
         A1, A2 = 2, 8
 
         F_1to2 = k_link * (h1 - h2)
-        if self.linear:
+        if linear:
             dh1 = (F1_in - k1*h1*A1 - F_1to2)/A1
         else:
             dh1 = (F1_in - k1 * numpy.sqrt(h1 * A1) + F_1to2) / A1
 
         dh2 = (F2_in - k2*h2*A2)/A2
 
-        dX = numpy.array([dh1, dh2])
+        return dh1, dh2
 
-        return dX
+    @staticmethod
+    def output(x, u, params):
+        """Returns all the outputs (state and calculated)"""
+        return x[0], x[1]
 
     def step(self, dt, inputs):
         """Updates the model with inputs
@@ -53,16 +65,3 @@ class LinkedTanks(model.NonlinearModel):
         dX = self.DEs(inputs)
         self.X += dX*dt
         return self.outputs(inputs)
-
-    def outputs(self, inputs):
-        """Returns all the outputs (state and calculated)
-
-        Returns
-        -------
-        outputs : array_like
-            List of all the outputs from the model
-        """
-
-        outs = numpy.array(self.X)
-        _ = inputs
-        return outs.copy()
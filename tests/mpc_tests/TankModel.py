@@ -8,32 +8,39 @@ class TankModel(model.NonlinearModel):
         self.t = t0
         self.simple = linear
 
-    def DEs(self, inputs):
-        """Contains the differential and algebraic equations for the system model.
+    @property
+    def params(self):
+        return float(self.simple),
+
+    @staticmethod
+    def rhs(x, u, params):
+        """Contains the differential equations for the system model.
 
         Parameters
         ----------
-        inputs : ndarray
-            The inputs to the system at the current time
+        x, u : ndarray
+            The states and inputs
+
+        params : tuple
+            Whether the outflow is linear
 
         Returns
         -------
-        dX : array_like
-            The differential changes to the state variables
+        dh : float
+            The differential change to the state variable
         """
-        h, = self.X
-        F_in, = inputs  # Normally on the order of (0, 0.1)
+        h = x[0]
+        F_in = u[0]  # Normally on the order of (0, 0.1)
+        simple = params[0]
 
         k = 0.1
         A = 2
-        if self.simple:
+        if simple:
             dh = (F_in - k*h*A)/A
         else:
             dh = (F_in - k * numpy.sqrt(h * A)) / A
 
-        dX = numpy.array([dh])
-
-        return dX
+        return dh,
 
     def step(self, dt, inputs):
         """Updates the model with inputs
@@ -0,0 +1,386 @@
+import numpy
+import controller
+import model.LinearModel
+import pytest
+import tests.mpc_tests.LinkedTanks as LinkedTanks
+
+
+def linked_tanks():
+    """Returns the linked tanks and their linear model"""
+    tanks = LinkedTanks.LinkedTanks(numpy.array([50., 60.]))
+    lin_model = model.LinearModel.create_LinearModel(
+        tanks,
+        x_bar=numpy.array([50., 60.]),
+        u_bar=numpy.array([10., 12.]),
+        T=1
+    )
+    return tanks, lin_model
+
+
+def mpc_options(lin_model, **kwargs):
+    """Returns the options of a controller of the linked tanks.
+    Keyword arguments override the defaults"""
+    options = dict(
+        P=20,
+        M=8,
+        Q=numpy.diag([10, 10]),
+        R=numpy.diag([0.1, 0.1]),
+        lin_model=lin_model,
+        ysp=lin_model.yn2d(numpy.array([100., 30])),
+        u_bounds=[(-10, 10), (-12, 12)]
+    )
+    options.update(kwargs)
+    return options
+
+
+def precise(*Ks):
+    """Sets the controllers' solver tolerances well below the defaults,
+    so that the solutions of different controllers can be compared"""
+    for K in Ks:
+        K.prob.update_settings(eps_abs=1e-9, eps_rel=1e-9, max_iter=100000)
+
+
+def closed_loop(end_time=60, **kwargs):
+    """Runs the linked tanks under MPC with input bounds and
+    returns the inputs and the OSQP iterations of each step.
+    Keyword arguments are passed to `mpc_options`"""
+    tanks, lin_model = linked_tanks()
+    K = controller.MPC(**mpc_options(lin_model, **kwargs))
+
+    us = [lin_model.u_bar]
+    for _ in range(end_time):
+        for _ in range(100):
+            tanks.step(0.01, us[-1])
+        y = tanks.outputs(us[-1])
+        u = K.step(tanks.X - lin_model.x_bar, us[-1] - lin_model.u_bar, y - lin_model.y_bar)
+        us.append(u + lin_model.u_bar)
+
+    return numpy.array(us), numpy.array(K.iterations)
+
+
+def test_shifted_warm_start():
+    us_cold, iterations_cold = closed_loop(warm_start=False, formulation='sparse', fast_path=False)
+    us_warm, iterations_warm = closed_loop(warm_start=True, formulation='sparse', fast_path=False)
+
+    assert us_warm == pytest.approx(us_cold, abs=5e-2)
+    assert numpy.sum(iterations_warm) <= numpy.sum(iterations_cold)
+
+
+def test_warm_start_after_jumps():
+    # The bioreactor's controller, whose long horizon makes OSQP sensitive to where it starts
+    x_bar = model.Bioreactor.find_SS(numpy.array([0.04, 0.1]), numpy.array([260/180, 640/24.6, 1000/116, 0, 0]))
+    lin_model = model.LinearModel.create_LinearModel(
+        model.Bioreactor(X0=x_bar, high_N=False),
+        x_bar=x_bar,
+        u_bar=numpy.array([0.04, 0.1]),
+        T=1
+    )
+    lin_model.select_subset(states=[0, 2], inputs=[0, 1], outputs=[0, 2])
+
+    Ks = [
+        controller.MPC(
+            P=300,
+            M=200,
+            Q=numpy.diag([0.1, 1]),
+            R=numpy.diag([1, 1]),
+            lin_model=lin_model,
+            ysp=lin_model.yn2d(numpy.array([280, 850]), subselect=False),
+            u_bounds=[(-u_bar, numpy.inf) for u_bar in lin_model.u_bar],
+            warm_start=warm_start
+        )
+        for warm_start in [False, True]
+    ]
+
+    # The state and measurement jump between steps, so the shifted solution is a poor start
+    rng = numpy.random.default_rng(0)
+    for _ in range(6):
+        x0, um1, y0 = rng.normal(0, 5, 2), rng.uniform(0, 0.02, 2), rng.normal(0, 0.3, 2)
+        u_cold, u_warm = [K.step(x0, um1, y0) for K in Ks]
+        assert u_warm == pytest.approx(u_cold, abs=1e-3)
+
+    log = Ks[1].telemetry
+    assert numpy.all(log['status'] == 1)
+    assert 'cold' in log['fallback']
+
+
+@pytest.mark.parametrize('y_bounds', [None, [(-50, 50), (-60, 20)]])
+def test_condensed_formulation(y_bounds):
+    _, lin_model = linked_tanks()
+    Ks = [
+        controller.MPC(**mpc_options(lin_model, y_bounds=y_bounds, formulation=formulation))
+        for formulation in ['sparse', 'condensed']
+    ]
+    # Compare the formulations well below the default solver tolerance
+    precise(*Ks)
+
+    rng = numpy.random.default_rng(0)
+    for _ in range(10):
+        x0, um1, y0 = rng.normal(size=(3, 2)) * [[5], [3], [1]]
+        u_sparse, u_condensed = [K.step(x0, um1, y0) for K in Ks]
+        assert u_condensed == pytest.approx(u_sparse, abs=1e-5)
+        assert Ks[1].y_predicted == pytest.approx(Ks[0].y_predicted, abs=1e-5)
+
+
+def test_mpc_cache():
+    _, lin_model = linked_tanks()
+    cache = controller.MPCCache()
+
+    K1 = cache.get(**mpc_options(lin_model, Q=numpy.diag([10, 10])))
+    precise(K1)
+    x0 = numpy.array([1., 2.])
+    u1 = K1.step(x0, numpy.zeros(2), numpy.zeros(2))
+    for _ in range(3):
+        K1.step(x0, u1, numpy.zeros(2))
+
+    K2 = cache.get(**mpc_options(lin_model, Q=numpy.diag([10, 10])))
+    K3 = cache.get(**mpc_options(lin_model, Q=numpy.diag([10, 20])))
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert K2.prob is K1.prob and K3.prob is not K1.prob
+    assert K2.y_predicted is None
+
+    # The cache only hands out clones, so stepping them leaves the template untouched
+    template, = [K for K in cache._controllers.values() if K.prob is K1.prob]
+    assert template is not K1 and template is not K2
+    assert template.y_predicted is None and template.telemetry.size == 0
+
+    # A clone's cold solve does not start from the iterates of another clone
+    u2 = K2.step(x0, numpy.zeros(2), numpy.zeros(2))
+    assert u2 == pytest.approx(u1, abs=1e-6)
+    assert K2.iterations[0] == K1.iterations[0]
+
+
+def test_batch_mpc():
+    _, lin_model = linked_tanks()
+
+    batch = controller.BatchMPC(5, workers=2, **mpc_options(lin_model))
+    Ks = [controller.MPC(**mpc_options(lin_model)) for _ in range(5)]
+
+    rng = numpy.random.default_rng(0)
+    for _ in range(3):
+        x0s, um1s, y0s = rng.normal(size=(3, 5, 2))
+        ctrls = batch.step(x0s, um1s, y0s)
+        assert ctrls.shape == (5, 2)
+        assert ctrls == pytest.approx(numpy.array([K.step(*args) for K, *args in zip(Ks, x0s, um1s, y0s)]))
+    assert batch.y_predicted == pytest.approx(numpy.array([K.y_predicted for K in Ks]))
+    assert numpy.all(batch.solved)
+
+    # A problem that fails holds its input and the rest are still solved
+    batch.controllers[2].prob.update_settings(max_iter=1, eps_abs=1e-12, eps_rel=1e-12)
+    x0s, um1s, y0s = rng.normal(size=(3, 5, 2))
+    ctrls = batch.step(x0s, um1s, y0s)
+    assert list(batch.solved) == [True, True, False, True, True]
+    assert ctrls[2] == pytest.approx(um1s[2])
+    others = [0, 1, 3, 4]
+    assert ctrls[others] == pytest.approx(numpy.array([Ks[i].step(x0s[i], um1s[i], y0s[i]) for i in others]))
+    batch.close()
+
+    # The options of the controllers are passed on
+    options = mpc_options(lin_model, move_blocking='geometric', fast_path=True, time_budget=1.)
+    batch = controller.BatchMPC(2, **options)
+    assert all(K._fast_path_gains is not None and K.time_budget == 1. for K in batch.controllers)
+    assert batch.controllers[0].H.shape == controller.MPC(**options).H.shape
+    batch.close()
+
+
+@pytest.mark.parametrize('formulation', ['sparse', 'condensed'])
+def test_fast_path(formulation):
+    _, lin_model = linked_tanks()
+    Ks = [
+        controller.MPC(**mpc_options(
+            lin_model, ysp=numpy.zeros(2), u_bounds=[(-3, 3), (-3, 3)], formulation=formulation, fast_path=fast_path
+        ))
+        for fast_path in [False, True]
+    ]
+    precise(*Ks)
+
+    rng = numpy.random.default_rng(0)
+    for _ in range(20):
+        x0, um1, y0 = rng.normal(size=(3, 2)) * [[0.2], [0.2], [0.1]]
+        u_qp, u_fast = [K.step(x0, um1, y0) for K in Ks]
+        assert u_fast == pytest.approx(u_qp, abs=1e-5)
+        assert Ks[1].y_predicted == pytest.approx(Ks[0].y_predicted, abs=1e-5)
+
+    # Large disturbances hit the input bounds, so the QP has to be solved
+    for _ in range(5):
+        x0 = rng.normal(size=2) * 50
+        u_qp, u_fast = [K.step(x0, numpy.zeros(2), numpy.zeros(2)) for K in Ks]
+        assert u_fast == pytest.approx(u_qp, abs=1e-5)
+
+    assert Ks[0].fast_path_hits == 0
+    assert 0 < Ks[1].fast_path_hits < 25
+    assert Ks[1].fast_path_hit_rate == Ks[1].fast_path_hits / 25
+
+
+@pytest.mark.parametrize('move_blocking', ['geometric', [2, 3]])
+def test_move_blocking(move_blocking):
+    _, lin_model = linked_tanks()
+    Ks = [
+        controller.MPC(**mpc_options(
+            lin_model, ysp=numpy.zeros(2), formulation=formulation, move_blocking=blocking, fast_path=False
+        ))
+        for formulation, blocking in [('sparse', None), ('sparse', move_blocking), ('condensed', move_blocking)]
+    ]
+    precise(*Ks)
+
+    # Fewer input moves than the 9 of the unblocked problem
+    assert Ks[1].H.shape[0] < Ks[0].H.shape[0]
+    assert Ks[2].H.shape[0] < 9 * 2
+
+    rng = numpy.random.default_rng(0)
+    for _ in range(5):
+        x0, um1, y0 = rng.normal(size=(3, 2)) * [[0.2], [0.2], [0.1]]
+        u_full, u_sparse, u_condensed = [K.step(x0, um1, y0) for K in Ks]
+        assert u_condensed == pytest.approx(u_sparse, abs=1e-5)
+        assert u_sparse != pytest.approx(u_full, abs=1e-5)
+
+
+def test_telemetry():
+    _, lin_model = linked_tanks()
+    K = controller.MPC(**mpc_options(lin_model, ysp=numpy.zeros(2), u_bounds=[(-3, 3), (-3, 3)], fast_path=True))
+    K._log = K._log[:2]
+
+    # One fast path step, then steps with active input bounds
+    K.step(numpy.zeros(2), numpy.zeros(2), numpy.zeros(2))
+    for _ in range(4):
+        K.step(numpy.array([50., -50.]), numpy.zeros(2), numpy.zeros(2))
+
+    log = K.telemetry
+    assert log.size == 5 and K._log.size == 8
+    assert list(log['fast_path']) == [True, False, False, False, False]
+    assert list(log['warm_started']) == [False, True, True, True, True]
+    assert numpy.all(log['status'] == 1)
+    assert numpy.all(log['iterations'][1:] > 0) and log['iterations'][0] == 0
+    assert numpy.all(log['solve_time'][1:] > 0) and numpy.all(log['step_time'] >= log['solve_time'])
+
+    summary = K.telemetry_summary()
+    assert summary['steps'] == 5
+    assert summary['fast_path_fraction'] == pytest.approx(0.2)
+    assert summary['iterations_max'] == numpy.max(K.iterations)
+    assert summary['step_time_p99'] <= summary['step_time_max']
+
+
+def test_time_budget():
+    us, _ = closed_loop(fast_path=False)
+    us_generous, _ = closed_loop(fast_path=False, time_budget=10.)
+    numpy.testing.assert_allclose(us_generous, us)
+
+    # The solver can not converge in a microsecond, so the fallbacks are used
+    us_tight, iterations = closed_loop(fast_path=False, time_budget=1e-6)
+    assert numpy.all(iterations <= 2)
+    assert numpy.all(numpy.abs(us_tight - [10., 12.]) <= numpy.array([10., 12.]) + 1e-6)
+
+    _, lin_model = linked_tanks()
+    K = controller.MPC(**mpc_options(lin_model, ysp=numpy.zeros(2), u_bounds=[(-3, 3), (-3, 3)], time_budget=1e-6))
+    for _ in range(3):
+        u = K.step(numpy.array([50., -50.]), numpy.zeros(2), numpy.zeros(2))
+        assert numpy.all(numpy.abs(u) <= 3 + 1e-6)
+
+    log = K.telemetry
+    assert not K.deadline_met and not numpy.any(log['deadline_met'])
+    assert set(log['fallback']) <= {'iterate', 'plan'}
+
+
+def test_async_controller():
+    _, lin_model = linked_tanks()
+
+    def get_mpc():
+        return controller.MPC(**mpc_options(lin_model, ysp=numpy.zeros(2), u_bounds=[(-3, 3), (-3, 3)]))
+
+    K = get_mpc()
+    K_async = controller.AsyncController(get_mpc())
+    K_delay = controller.AsyncController(get_mpc(), delay=True)
+
+    x0 = numpy.array([50., -50.])
+    um1 = numpy.zeros(2)
+    y0 = lin_model.C @ x0
+    for _ in range(4):
+        u = K.step(x0, um1, y0)
+
+        # The arguments are copied, so they can change while the step runs
+        x0_reused = x0.copy()
+        K_async.submit(x0_reused, um1, y0)
+        x0_reused[:] = 0
+        numpy.testing.assert_allclose(K_async.result(), u)
+        numpy.testing.assert_allclose(K_async.y_predicted, K.y_predicted)
+
+        x0 = lin_model.A @ x0 + lin_model.B @ u
+        um1, y0 = u, lin_model.C @ x0
+
+    # With a delay each step is solved from the state one control period ahead,
+    # which the controller's model predicts exactly when it is also the plant
+    K_ahead = get_mpc()
+    x0 = numpy.array([50., -50.])
+    um1 = expected = numpy.zeros(2)
+    y_predicted = None
+    for _ in range(4):
+        u = K_delay.step(x0, um1, lin_model.C @ x0)
+        assert K_delay.pending
+        numpy.testing.assert_allclose(u, expected, atol=1e-6)
+        if y_predicted is None:
+            assert K_delay.y_predicted is None
+        else:
+            numpy.testing.assert_allclose(K_delay.y_predicted, y_predicted, atol=1e-6)
+
+        x0 = lin_model.A @ x0 + lin_model.B @ u
+        um1 = u
+        expected = K_ahead.step(x0, um1, lin_model.C @ x0)
+        y_predicted = K_ahead.y_predicted
+
+    with pytest.raises(RuntimeError):
+        K_delay.submit(x0, um1, lin_model.C @ x0)
+
+    assert K_delay.telemetry_summary()['steps'] == 4
+    K_async.close()
+    K_delay.close()
+
+
+@pytest.mark.parametrize('formulation', ['sparse', 'condensed'])
+def test_update_model(formulation):
+    tanks, _ = linked_tanks()
+    bank = model.LinearModelBank.create_LinearModelBank(
+        tanks, [numpy.array([30., 50.])], lambda p: (numpy.array([p[0], 60.]), numpy.array([10., 12.])), T=1
+    )
+
+    def get_mpc(lin_model, get=controller.MPC):
+        K = get(**mpc_options(
+            lin_model,
+            y_bounds=[(-numpy.inf, 70. - lin_model.y_bar[0]), (-numpy.inf, numpy.inf)],
+            u_bounds=[(0 - u_bar, 20 - u_bar) for u_bar in lin_model.u_bar],
+            formulation=formulation,
+            fast_path=False
+        ))
+        precise(K)
+        return K
+
+    old_model, new_model = bank.models
+    K = get_mpc(old_model)
+    K.step(numpy.array([1., 2.]), numpy.zeros(2), numpy.zeros(2))
+    prob = K.prob
+    K.update_model(new_model)
+    assert K.prob is prob
+
+    # The set point and bounds are unchanged in un-deviated form
+    K_new = get_mpc(new_model)
+    K_new.y_predicted = K.y_predicted
+    x0 = numpy.array([45., 62.]) - new_model.x_bar
+    for _ in range(3):
+        u = K.step(x0, numpy.zeros(2), numpy.zeros(2))
+        numpy.testing.assert_allclose(u, K_new.step(x0, numpy.zeros(2), numpy.zeros(2)), atol=1e-6)
+        x0 = new_model.A @ x0 + new_model.B @ u
+
+    # Clones get their own workspace instead of changing the shared one
+    K_clone = K.clone()
+    K_clone.update_model(old_model)
+    assert K_clone.prob is not K.prob
+
+    # Updating a cached controller leaves the cache's template and other clones alone
+    cache = controller.MPCCache()
+    K_cached = get_mpc(old_model, cache.get)
+    K_cached.update_model(new_model)
+    precise(K_cached)
+    K_cached.update_model(old_model)
+    K_other, K_fresh = get_mpc(old_model, cache.get), get_mpc(old_model)
+    assert K_other.prob is not K_cached.prob and K_other.model is old_model
+    x0 = numpy.array([1., 2.])
+    numpy.testing.assert_allclose(K_other.step(x0, numpy.zeros(2), numpy.zeros(2)),
+                                  K_fresh.step(x0, numpy.zeros(2), numpy.zeros(2)), atol=1e-6)
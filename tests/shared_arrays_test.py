@@ -0,0 +1,28 @@
+import multiprocessing
+import pickle
+import numpy
+from shared_arrays import SharedArrays
+
+
+def _double(shared):
+    xs = shared['xs']
+    xs *= 2
+    return float(numpy.sum(xs)), shared.attributes['label']
+
+
+def test_shared_arrays():
+    xs = numpy.arange(12, dtype=numpy.float32).reshape(3, 4)
+    shared = SharedArrays({'xs': xs}, {'label': 'test', 'nested': SharedArrays({'ys': numpy.ones(2)})})
+
+    # Only names, shapes and types are pickled
+    assert len(pickle.dumps(shared)) < xs.nbytes + 500
+
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        total, label = pool.apply(_double, (shared,))
+
+    assert label == 'test'
+    assert total == 2 * numpy.sum(xs)
+    assert numpy.array_equal(shared['xs'], 2 * xs)
+    assert numpy.array_equal(shared.attributes['nested']['ys'], numpy.ones(2))
+
+    shared.unlink()